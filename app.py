@@ -4,9 +4,48 @@ import time
 import re
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from fenjin.analysis import ANALYSIS_SECTIONS, analysis_context, cards_fallback, parse_analysis, store_analysis
+from fenjin.api import DEFAULT_API_BASE, DEFAULT_MODEL, RateLimited, iter_stream, open_stream, request_completion, stream_completion
+from fenjin.archive import EXPORT_DIR, export_path, prune_exports, read_archive, write_archive
+from fenjin.auth import check_token, header_user, parse_user_tokens
+from fenjin.batch import (BATCH_DIR, batch_request, download_remote_output, poll_remote_batch, read_batch_output,
+                          run_local_batch, submit_remote_batch, write_batch_file)
+from fenjin.candidates import CANDIDATE_VARIANTS, generate_candidates, judge_candidates
+from fenjin.characters import CARD_BUDGET, parse_character_cards, find_characters, select_cards
+from fenjin.chat import CHAT_CONTEXT_BUDGET, recent_turns, summarize_chat, summary_due
+from fenjin.checks import score_script, validate_script, format_fix_shots
+from fenjin.diagnostics import (CHAT_KEEP, MESSAGES_HEAD, MESSAGES_KEEP, format_bytes, history_tokens, load_offloaded,
+                               offload_history, state_sizes, stop_tracing, trace_snapshot)
+from fenjin.deps import (find_stale, node_id, node_label, rebuild, record_analysis, record_episode, record_openings, record_review,
+                         split_node, untracked, upstream)
+from fenjin.history import diff_html, diff_stats, record_version, version_text
+from fenjin.ingest import read_novel
+from fenjin.memory import MEMORY_WAIT, extract_memory
+from fenjin.openings import (OPENING_COUNT, design_openings, generate_openings, make_item, opening_text, parse_openings,
+                             resolve_opening, store_opening_text, store_openings)
+from fenjin.project import PROJECT_DEFAULTS
+from fenjin.prompts import (SYSTEM_PROMPT, REVIEW_SYSTEM_PROMPT, build_analysis_prompt, build_opening_prompt,
+                            build_episode_prompt, build_review_prompt, build_dialogue_optimization_prompt,
+                            build_visual_optimization_prompt, build_emotion_optimization_prompt, build_review_fix_prompt,
+                            build_shot_review_prompt, build_chat_prompt, build_format_fix_prompt, prompt_id)
+from fenjin.retrieval import PassageIndex, project_sources
+from fenjin.review import PASS_SCORE, failing_shots, merge_review
+from fenjin.runs import RUN_RETRIES, add_run, finish_run, mark_done, mark_failed, new_run, pending, run_summary, with_retries
+from fenjin.scheduler import RESPONSE_CACHE, SCHEDULER, QuotaExceeded
+from fenjin.screenplay import EXPORT_FORMATS, export_series
+from fenjin.scenes import ENDING_TOKEN_BUDGET, SHOT_RE, build_ending_context, check_continuity, parse_scenes, splice_scenes
+from fenjin.store import (AUTOSAVE_FILE, USER_NAME_RE, content_hash, get_blob, normalize_chapters, put_blob, save_project,
+                          user_project_path)
+from fenjin.templates import PROMPT_DIR, apply_versions, record_usage, rejected_overrides, template_table, usage_rows, versions
+from fenjin.ui import (APP_CSS, MEMORY_MODEL_OPTIONS, MODEL_OPTIONS, PROFILE_HISTORY, REVIEW_MODEL_OPTIONS, STEP_NAMES,
+                       SectionTimer)
+
+timer = SectionTimer()
+
 # ============================================================
 # 页面配置
 # ============================================================
@@ -17,36 +56,42 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# ============================================================
+# 多人模式（FENJIN_MULTI_USER=1）：按用户名分开项目文件，API请求经进程级调度器排队
+# 身份来源：FENJIN_AUTH_HEADER（反向代理认证后传来的用户名头）或 FENJIN_ACCESS_TOKENS（用户名:令牌,...）；
+# 都没配置时用户名是自报的，只适合可信内网，且不开放管理面板。?user= 链接参数需 FENJIN_ALLOW_USER_PARAM=1
+# ============================================================
+MULTI_USER = os.environ.get("FENJIN_MULTI_USER", "") not in ("", "0")
+ADMINS = {u.strip() for u in os.environ.get("FENJIN_ADMINS", "").split(",") if u.strip()}
+AUTH_HEADER = os.environ.get("FENJIN_AUTH_HEADER", "").strip()
+USER_TOKENS = parse_user_tokens(os.environ.get("FENJIN_ACCESS_TOKENS", ""))
+ALLOW_USER_PARAM = os.environ.get("FENJIN_ALLOW_USER_PARAM", "") not in ("", "0")
+TRUSTED_IDENTITY = bool(AUTH_HEADER or USER_TOKENS)
+# 多人模式下服务器的Key只放在进程里，不进会话状态、不回显到浏览器；用户自己填了Key时用用户的
+SERVER_API_KEY = os.environ.get("FENJIN_API_KEY", "")
+
+def project_file():
+    """当前会话的项目文件：多人模式下每个用户一份"""
+    return user_project_path(st.session_state.user) if MULTI_USER else AUTOSAVE_FILE
+
 # ============================================================
 # 本地自动保存/恢复系统（防数据丢失）
 # ============================================================
-AUTOSAVE_FILE = "autosave_data.json"
+def project_snapshot():
+    """当前项目数据（与备份文件/归档同构的dict，不复制正文）"""
+    return {k: st.session_state.get(k, v) for k, v in PROJECT_DEFAULTS.items()}
 
 def auto_save():
-    """将关键数据自动保存到本地文件"""
+    """将关键数据自动保存到本地文件（与命令行版共用同一格式）"""
     try:
-        data = {
-            "chapters": st.session_state.get("chapters", {}),
-            "chapter_order": st.session_state.get("chapter_order", []),
-            "current_step": st.session_state.get("current_step", 0),
-            "current_episode": st.session_state.get("current_episode", 1),
-            "global_analysis": st.session_state.get("global_analysis", ""),
-            "opening_designs": st.session_state.get("opening_designs", ""),
-            "episodes": {str(k): v for k, v in st.session_state.get("episodes", {}).items()},
-            "review_results": {str(k): v for k, v in st.session_state.get("review_results", {}).items()},
-            "memory": st.session_state.get("memory", {}),
-            "messages": st.session_state.get("messages", []),
-            "chat_history": st.session_state.get("chat_history", []),
-            "save_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        }
-        with open(AUTOSAVE_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        save_project(project_snapshot(), project_file())
     except Exception:
         pass
 
 def auto_restore():
     """从本地文件恢复数据（仅当session_state中数据为空时）"""
-    if not os.path.exists(AUTOSAVE_FILE):
+    path = project_file()
+    if not os.path.exists(path):
         return False
     # 如果已经有章节或剧本数据，不需要恢复
     if st.session_state.get("chapters") and len(st.session_state["chapters"]) > 0:
@@ -54,7 +99,7 @@ def auto_restore():
     if st.session_state.get("episodes") and len(st.session_state["episodes"]) > 0:
         return False
     try:
-        with open(AUTOSAVE_FILE, "r", encoding="utf-8") as f:
+        with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
         # 检查备份是否有实际数据
         has_data = (
@@ -66,7 +111,7 @@ def auto_restore():
             return False
         # 恢复数据
         if data.get("chapters"):
-            st.session_state["chapters"] = data["chapters"]
+            st.session_state["chapters"] = normalize_chapters(data["chapters"])
         if data.get("chapter_order"):
             st.session_state["chapter_order"] = data["chapter_order"]
         if data.get("current_step"):
@@ -75,18 +120,40 @@ def auto_restore():
             st.session_state["current_episode"] = data["current_episode"]
         if data.get("global_analysis"):
             st.session_state["global_analysis"] = data["global_analysis"]
+            st.session_state["analysis_sections"] = data.get("analysis_sections") or parse_analysis(data["global_analysis"])
         if data.get("opening_designs"):
             st.session_state["opening_designs"] = data["opening_designs"]
+            st.session_state["opening_items"] = data.get("opening_items") or parse_openings(data["opening_designs"])
+        if data.get("selected_opening"):
+            st.session_state["selected_opening"] = data["selected_opening"]
         if data.get("episodes"):
             st.session_state["episodes"] = {int(k): v for k, v in data["episodes"].items()}
         if data.get("review_results"):
             st.session_state["review_results"] = {int(k): v for k, v in data["review_results"].items()}
+        if data.get("episode_alternates"):
+            st.session_state["episode_alternates"] = {int(k): v for k, v in data["episode_alternates"].items()}
+        if data.get("episode_history"):
+            st.session_state["episode_history"] = {int(k): v for k, v in data["episode_history"].items()}
         if data.get("memory"):
             st.session_state["memory"] = data["memory"]
         if data.get("messages"):
             st.session_state["messages"] = data["messages"]
         if data.get("chat_history"):
             st.session_state["chat_history"] = data["chat_history"]
+        if data.get("chat_summary"):
+            st.session_state["chat_summary"] = data["chat_summary"]
+        if data.get("batch_jobs"):
+            st.session_state["batch_jobs"] = data["batch_jobs"]
+        if data.get("build_inputs"):
+            st.session_state["build_inputs"] = data["build_inputs"]
+        if data.get("prompt_versions"):
+            st.session_state["prompt_versions"] = data["prompt_versions"]
+        if data.get("prompt_stats"):
+            st.session_state["prompt_stats"] = data["prompt_stats"]
+        if data.get("batch_runs"):
+            st.session_state["batch_runs"] = data["batch_runs"]
+        if data.get("history_archive"):
+            st.session_state["history_archive"] = data["history_archive"]
         return True
     except Exception:
         return False
@@ -94,431 +161,37 @@ def auto_restore():
 def clear_autosave():
     """清除本地备份文件"""
     try:
-        if os.path.exists(AUTOSAVE_FILE):
-            os.remove(AUTOSAVE_FILE)
+        path = project_file()
+        if os.path.exists(path):
+            os.remove(path)
     except Exception:
         pass
 
 # ============================================================
 # CSS样式
 # ============================================================
-st.markdown("""
-<style>
-    .block-container { padding: 1.5rem 2rem 2rem 2rem; max-width: 1200px; }
-    .header-bar {
-        background: linear-gradient(135deg, #1e3a5f 0%, #2c5282 50%, #2b6cb0 100%);
-        border-radius: 12px; padding: 20px 28px; margin-bottom: 24px;
-        color: white; display: flex; justify-content: space-between; align-items: center;
-        flex-wrap: wrap; gap: 10px;
-    }
-    .header-left .header-title { font-size: 1.6rem; font-weight: 700; margin: 0; letter-spacing: 1px; }
-    .header-left .header-sub { font-size: 0.78rem; opacity: 0.8; margin-top: 4px; }
-    .header-badge {
-        background: rgba(255,255,255,0.15); border: 1px solid rgba(255,255,255,0.25);
-        border-radius: 20px; padding: 6px 16px; font-size: 0.75rem; color: white;
-    }
-    .step-indicator {
-        display: flex; gap: 0; margin: 0 0 20px 0; background: #f7f8fa;
-        border-radius: 10px; overflow: hidden; border: 1px solid #e2e8f0;
-    }
-    .step-item {
-        flex: 1; text-align: center; padding: 12px 8px; font-size: 0.8rem;
-        font-weight: 500; color: #718096; border-right: 1px solid #e2e8f0; transition: all 0.3s;
-    }
-    .step-item:last-child { border-right: none; }
-    .step-item.active { background: #ebf4ff; color: #2b6cb0; font-weight: 600; }
-    .step-item.done { background: #f0fff4; color: #276749; }
-    .step-num {
-        display: inline-block; width: 22px; height: 22px; border-radius: 50%;
-        background: #cbd5e0; color: white; font-size: 0.7rem; line-height: 22px;
-        text-align: center; margin-right: 6px; vertical-align: middle;
-    }
-    .step-item.active .step-num { background: #3182ce; }
-    .step-item.done .step-num { background: #38a169; }
-    .card {
-        background: #ffffff; border: 1px solid #e2e8f0; border-radius: 10px;
-        padding: 20px; margin-bottom: 16px; box-shadow: 0 1px 3px rgba(0,0,0,0.04);
-    }
-    .card:hover { box-shadow: 0 4px 12px rgba(0,0,0,0.08); }
-    .card-header {
-        display: flex; align-items: center; gap: 8px; margin-bottom: 14px;
-        padding-bottom: 10px; border-bottom: 1px solid #edf2f7;
-    }
-    .card-icon { font-size: 1.2rem; }
-    .card-title { font-size: 0.95rem; font-weight: 600; color: #2d3748; margin: 0; }
-    .card-subtitle { font-size: 0.75rem; color: #a0aec0; margin-left: auto; }
-    .chapter-item {
-        display: flex; align-items: center; padding: 10px 14px; background: #f7fafc;
-        border: 1px solid #e2e8f0; border-radius: 8px; margin: 6px 0; transition: all 0.2s;
-    }
-    .chapter-item:hover { border-color: #90cdf4; background: #ebf8ff; }
-    .chapter-icon {
-        width: 32px; height: 32px; border-radius: 8px;
-        background: linear-gradient(135deg, #667eea, #764ba2); color: white;
-        display: flex; align-items: center; justify-content: center;
-        font-size: 0.8rem; font-weight: 600; margin-right: 12px; flex-shrink: 0;
-    }
-    .chapter-info { flex: 1; }
-    .chapter-name { font-size: 0.88rem; font-weight: 500; color: #2d3748; }
-    .chapter-meta { font-size: 0.72rem; color: #a0aec0; margin-top: 2px; }
-    .stats-bar { display: flex; gap: 16px; margin: 12px 0; }
-    .stat-item {
-        flex: 1; background: #f7fafc; border: 1px solid #e2e8f0;
-        border-radius: 8px; padding: 12px 16px; text-align: center;
-    }
-    .stat-value { font-size: 1.4rem; font-weight: 700; color: #2b6cb0; }
-    .stat-label { font-size: 0.72rem; color: #a0aec0; margin-top: 2px; }
-    .tag {
-        display: inline-block; padding: 3px 10px; border-radius: 12px;
-        font-size: 0.7rem; font-weight: 600;
-    }
-    .tag-blue { background: #ebf8ff; color: #2b6cb0; }
-    .tag-green { background: #f0fff4; color: #276749; }
-    .tag-yellow { background: #fffff0; color: #975a16; }
-    .tag-red { background: #fff5f5; color: #c53030; }
-    .tag-purple { background: #faf5ff; color: #6b46c1; }
-    .empty-state { text-align: center; padding: 40px 20px; color: #a0aec0; }
-    .empty-state .empty-icon { font-size: 2.5rem; margin-bottom: 12px; }
-    .empty-state .empty-text { font-size: 0.9rem; margin-bottom: 4px; }
-    .empty-state .empty-hint { font-size: 0.78rem; color: #cbd5e0; }
-    .memory-panel {
-        background: linear-gradient(135deg, #fffff0, #fefcbf);
-        border: 1px solid #ecc94b; border-radius: 10px; padding: 16px; margin: 8px 0;
-    }
-    .memory-item { display: flex; gap: 8px; margin: 6px 0; font-size: 0.82rem; }
-    .memory-item .memory-key { color: #975a16; font-weight: 600; white-space: nowrap; }
-    .memory-item .memory-val { color: #744210; }
-    .sidebar-group-title {
-        font-size: 0.78rem; font-weight: 600; color: #4a5568;
-        text-transform: uppercase; letter-spacing: 0.5px; margin-bottom: 10px;
-        display: flex; align-items: center; gap: 6px;
-    }
-    section[data-testid="stSidebar"] { background: #f8fafc; }
-    .stButton > button { border-radius: 8px; font-weight: 500; font-size: 0.82rem; padding: 0.4rem 1rem; }
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 4px; background: #f7fafc; padding: 4px; border-radius: 10px; border: 1px solid #e2e8f0;
-    }
-    .stTabs [data-baseweb="tab"] { border-radius: 8px; padding: 8px 20px; font-size: 0.82rem; }
-    .stTabs [aria-selected="true"] { background: white !important; box-shadow: 0 1px 3px rgba(0,0,0,0.08); }
-    .restore-banner {
-        background: linear-gradient(135deg, #f0fff4, #c6f6d5);
-        border: 1px solid #68d391; border-radius: 10px; padding: 12px 16px;
-        margin-bottom: 16px; display: flex; align-items: center; gap: 10px;
-    }
-    @media (max-width: 768px) {
-        .header-bar { flex-direction: column; text-align: center; }
-        .stats-bar { flex-direction: column; }
-    }
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-</style>
-""", unsafe_allow_html=True)
-
-# ============================================================
-# 系统提示词
-# ============================================================
-SYSTEM_PROMPT = """【微短剧生成 3.1 系统指令】
-
-═══════════════════════════════════════
-第零法则：视觉翻译（一切规则之上的规则）
-═══════════════════════════════════════
-
-小说是给眼睛的——读者靠文字在脑中自己生成画面。
-剧本是给画面的——观众只能看到或听到你拍给他看的东西。
-
-你的工作是——把小说用文字"告诉"读者的一切，全部翻译成摄像机能拍到的画面,并用人物的台词（声音）来增加代入感！
-
-禁止对角色OOC，人物的台词、行为、举止都必须符合小说里的人设！
-因此在给核心角色编写每一句台词的时候都要参考【角色驱动卡】
-
-═══════════════════════════════════════
-翻译铁律
-═══════════════════════════════════════
-
-铁律一：小说的"叙述"必须翻译为"动作流"
-铁律二：小说的"心理描写"必须翻译为"身体反应搭配角色内心独白"
-铁律三：小说的"设定/背景交代"必须翻译为"环境展示"
-铁律四：台词的正确用法——塑造起人物
-
-═══════════════════════════════════════
-台词的黄金法则
-═══════════════════════════════════════
-
-【核心原则：台词是角色性格的DNA标签，不是越短越好】
-
-不同角色必须有截然不同的说话方式，这比"精简"重要一万倍。
-
-举例——同样表达"危险，快走"：
-· 暴躁军人："都他妈愣着干嘛？撤！现在！"
-· 冷静医生："情况不对。我们需要立刻离开这里。"
-· 怂包少年："哥、哥哥……那个……咱能不能……先……"
-· 傲娇大小姐："谁要跟你们一起跑了。……哼，不过本小姐今天刚好也想换个地方。"
-· 老练杀手：（一言不发，直接拽起对方就走）
-· 话痨技术宅："等等等等，我算了一下，按它的速度和我们的距离，大概还有47秒——不对，43秒，快跑快跑快跑！"
-
-长短取决于角色性格，不取决于"精简原则"。
-
-【台词长短的真实规律】
-→ 角色性格决定基础句长
-→ 情绪类型决定变化方向：
-  · 暴怒/恐惧/震惊 → 比平时更短（但话痨的"短"可能仍然比沉默角色的"长"要长）
-  · 紧张/兴奋/炫耀 → 比平时更长更碎
-  · 压抑/隐忍/心碎 → 说一半吞回去、词不达意、答非所问
-→ 关系决定说话方式：同一角色面对不同人说话不同
-
-【绝对禁止的台词方式】
-❌ 把所有角色台词统一缩短到2-4个字——会让所有角色都像"高冷人设"
-❌ 删掉角色口头禅、语气词——那是角色灵魂
-❌ 把话痨改成惜字如金——那是OOC
-❌ 台词和画面分开写——必须嵌入画面流中
-
-═══════════════════════════════════════
-★★★ 分镜格式铁律（最重要的格式规范）★★★
-═══════════════════════════════════════
-
-【铁律A：台词必须嵌入画面动作流中】
-
-台词不是单独一行，台词必须出现在它被说出的那个精确时间位置上，
-和此刻正在发生的动作、表情、身体状态写在一起。
-
-❌ 绝对禁止的格式（台词与画面分离）：
-```
-画面：[秦洛打响指，电流在指尖炸开，许多多被吓得后弹]
-秦洛："看，技能点。"
-许多多OS：（他有异能？！）
-音效：电流滋滋声
-```
-问题：读者/导演不知道"看，技能点"这句话是在打响指前说的？还是后弹之后说的？
-
-✅ 正确格式（台词嵌入动作流的精确时间点）：
-```
-秦洛带着战术手套的手指伸进毯子边缘——
-啪！响指。一簇幽蓝电流在指尖炸开（音效：尖锐滋滋声），
-电光照亮整个角落。
-秦洛（得意挑眉，嘴角歪向左边）："看。哥的技能点。"
-许多多灰白的瞳孔骤然收缩——身体本能后弹，
-后背撞在车厢壁上。
-许多多一脸诧异，OS：（异能？！他……真的有异能？！）
-```
-
-规则：
-1. 台词出现在它被说出的精确时间点——在哪个动作之后、哪个动作之前
-2. 台词前面必须紧跟说话时的【情绪状态+面部表情+身体动作】
-3. 内心OS出现在角色产生这个想法的精确时刻
-4. 音效出现在发出声音的那个动作旁边，用（）标注
-
-【铁律B：说台词时必须描写说话者的完整状态】
-
-每一句台词前面，必须包含以下三要素中的至少两个：
-
-① 情绪/语气标签：（低沉、暴怒、故作轻松、嘴硬但声音发颤、咬牙切齿……）
-② 面部表情：（挑眉、眼神躲闪、下颌收紧、瞳孔放大、嘴角抽搐……）
-③ 身体动作：（双手插兜、指尖点桌面、侧过头不看对方、攥紧拳头……）
-
-❌ 禁止的写法（裸台词）：
-秦洛："抱紧点。"
-
-✅ 正确的写法：
-秦洛低头看她，故意把表情板得很凶（但声音不自觉放软了）："抱紧点。掉下去被变异兽叼走，真就是一口一个小丧尸。"
-
-✅ 更好的写法：
-秦洛低头——本来想摆出教训小孩的凶脸，
-但看到她灰白大眼睛滴溜溜乱转的样子，
-喉结不自觉滚了一下，声音硬拽着往下压：
-"抱紧点。掉下去被变异兽叼走，真就是一口一个小丧尸。"
-他说完下意识把手臂往上紧了紧——
-这个动作和他嘴里的威胁完全矛盾。
-→ 观众同时看到：凶脸+放软的声音+收紧的手臂 = 嘴硬心软，全员心动。
-
-
-【铁律D：好莱坞级动作奇观与镜头语法（视觉爆发力法则）】
-当遇到射击、异能释放、巨兽袭击等战斗时刻，绝对禁止平铺直叙！
-必须调用以下“高级镜头调度语法”，制造强烈的视觉冲击力：
-
-1. 【子弹时间（Bullet Time）与微距跟踪】：
-必须写出时间膨胀感。例如：慢动作特写子弹出膛，枪口震荡出扭曲的空气涟漪（空气阻力），镜头死死死贴着高速旋转的弹头（跟踪镜头），随后瞬间恢复正常语速，子弹狠狠掼入目标。
-2. 【快慢速切（升降格）】：
-动作极静与极动的瞬间切换。例如：上一秒是缓慢滴落的汗水或慢动作的后坐力震颤（升格），下一秒瞬间切为巨兽轰然倒塌的极速狂暴画面（降格/正常速）。
-3. 【极速推镜（Crash Zoom）】：
-瞬间拉近距离制造压迫感。例如：镜头从全景瞬间推至变异大象充满血丝的浑浊巨眼特写。
-4. 【感官剥夺与音效反差】：
-在最爆裂的动作前，先制造死寂。例如：枪响后，所有环境音瞬间消失，只剩尖锐的耳鸣声，随后再爆发巨兽砸地的震天轰鸣。
-
-❌ 错误的干瘪描述：
-白述开枪。子弹射中大象。大象倒下（2s）。
-
-✅ 完美的动作奇观分镜示范（实算时长依然只要2-3秒）：
-【镜头极速推近】特写白述扣下扳机的食指——砰！
-【慢动作/子弹时间】枪口喷出炽热的火舌，巨大的后坐力震起他发梢的灰尘。一颗大口径穿甲弹撕裂夜风，弹头挤压空气形成一圈圈扭曲的水波纹阻力（1.5s）。
-【镜头死死跟踪弹头】子弹在半空划出致命的红线，瞬间加速（快慢切）——噗嗤！精准绞碎变异巨象布满血丝的右眼！（1s）
-
-【铁律F：真实三维物理与空间逻辑法则（反降智/反常识预警）】
-AI经常因为追求“动作酷炫”而写出违背人体工学和物理常识的动作（例如：坐在越野车副驾驶的人，由于腿部空间受限，绝对不可能用脚直接踹回头顶的天窗！这属于毫无常识的低级漏洞）。
-
-在编写任何动作前，必须在脑中运行【三维物理模拟器】：
-1. 【空间与人体工学】：角色所处的空间有多大？姿势是什么？（狭窄车厢内无法挥舞长柄武器；坐姿无法向正上方高抬腿踹门；打开车顶天窗在真实情况中只能是用手砸/推）。
-2. 【动线与发力逻辑】：动作必须符合真实的物理发力方式。
-3. 【重力与惯性】：高速行驶的车辆上，人探出车外会被狂风吹得极难稳定，必须有明确的物理支撑点（如：一手死死抓住窗框边缘）。
-4. 【道具溯源】：角色手里拿的道具、开枪的子弹，必须有明确的来源和合理的存放位置，严禁凭空变出物品。
-
-🚨 强制指令：如果小说原著的描写本身违背了物理常识或逻辑漏洞，你必须在影视化翻译时，【自动将其修正】为符合真实物理逻辑的动作！绝对不允许照搬原著的降智设定！
-
-【铁律G：反应镜头与“活体”法则（严禁角色道具化）】
-AI常犯的致命错误：只描写正在说话或打斗的人，把旁边不说话、或者处于“被抱着/背着/牵着”的角色写成没有生命的“木头”或“背包”，导致角色看起来极度空洞、像个假人。
-在影视剧中，只要角色在画面内，哪怕是背景板，哪怕不说话，也必须有属于角色性格的描述！
-
-🚨 强制指令：
-1. 【非说话者的反应镜头】：当A在长篇大论或激烈行动时，必须给画面内的B（尤其是核心角色）穿插0.5-1.5秒的【反应镜头】（微表情、翻白眼、手指抓紧、眼神躲闪或呼吸变化）。
-2. 【被动状态的微细节】：如果角色处于“被抱着/拉着”的被动状态（如丧尸许多多），必须描写她/他的身体反馈和感官动作。
-❌ 错误的空洞描写（像抱了个道具）：秦洛单臂托抱着许多多，大步流星走着。陈小飞跑过来说话。
-✅ 正确的活体描写（鲜活感拉满）：秦洛单臂托抱着许多多往前走。许多多像无尾熊一样死死搂着他的脖子，灰蒙蒙的眼睛滴溜溜地四下乱转，听到陈小飞激动的声音时，她迟钝地歪了歪脑袋，咬了咬自己的手指（1.5s）。
-
-═══════════════════════════════════════
-灵魂锚定
-═══════════════════════════════════════
-你不是在"把小说改成剧本"。你是在替这些角色活一遍。
-产品规格：每集分镜数量自由抉择 | 无第三人称旁白 | 集集强钩子。
-
-═══════════════════════════════════════
-五条创作铁律
-═══════════════════════════════════════
-①【人设即法律】角色的性格、说话方式、行为逻辑必须95%忠于原著。
-②【外化】一切"想、觉得、心痛、暗爽"必须转化为可拍摄的具体画面。允许第一人称内心OS，严禁第三人称旁白。
-③【伏笔】每一个重大转折之前，必须存在至少一个视觉/听觉微伏笔。
-④【潜台词】角色嘴上说的话与真实意图之间必须存在缝隙。台词传递表面意思，身体泄露真相。
-⑤【钩子铁律】前15秒必须制造具体的疑问或情绪冲击。每集结尾必须制造悬念。集内至少一次情绪急转。
-
-═══════════════════════════════════════
-角色驱动卡系统
-═══════════════════════════════════════
-为每个主要角色建立驱动卡，每次写台词/行为时必须调用：
-· 核心人格（一句话定义）
-· 说话DNA：句式习惯/口头禅/绝对不说的话/示范原句
-· 行为DNA：愤怒/心软/恐惧/说谎/得意时的物理反应
-· 红线（绝对不做的事）
-· 关系动态
-
-校验：每句台词→"遮住角色名能猜出是谁？"→不能→重写。
-
-═══════════════════════════════════════
-画面描写规律
-═══════════════════════════════════════
-→ 必须有一个"不寻常的具体细节"
-→ 用声音锚定空间（沉默场景更需要微小声音来放大沉默）
-→ 光源必须具体
-→ 身体失控比表情形容词有力一万倍
-→ 反差动作比直球动作有力
-
-═══════════════════════════════════════
-完整剧本格式示范
-═══════════════════════════════════════
-白天
-秦洛带着战术手套的手指伸进毯子边缘——
-啪！响指。一簇幽蓝电流在指尖炸开，
-电光瞬间照亮整个角落（音效：尖锐滋滋声）。
-秦洛得意地挑起左边眉毛，嘴角歪出一个欠揍的弧度：
-"看。哥的技能点。生存手册上没这玩意儿吧？"
-许多多灰白的瞳孔骤然收缩——
-身体本能地向后一弹，后背撞在车厢铁壁上，
-发出沉闷的一声响（音效：后背撞击闷响）。
-她的手指不自觉攥紧了毯子边缘，指甲陷进绒毛里。
-许多多OS：（异能……是真的存在的？
-那他们能活到现在……就是靠这个？）
-
-格式要点：
-1. 台词嵌入在动作流的精确时间位置
-2. 台词前紧跟说话者的表情+情绪+身体状态
-3. 内心OS在角色产生想法的时刻出现
-4. 音效用（）标注在发声的动作旁边
-
-═══════════════════════════════════════
-题材引擎
-═══════════════════════════════════════
-【需要观众爽】→ 弹簧法
-【需要观众心动】→ 磁铁法
-【需要观众虐】→ 错位法
-【需要观众紧张】→ 橡皮筋法
-【需要观众笑】→ 错位法
-
-═══════════════════════════════════════
-工作流
-═══════════════════════════════════════
-【第1轮：全局提炼】故事核心、角色驱动卡、大纲、核心节点、逻辑链、氛围基调、视觉强场景
-【第2轮：开场手法设计】6条不同方案，含前30秒逐秒画面
-【第3轮：剧本生成】编剧内心独白+结构速写+角色调用+影视化排雷+完整分镜
-【第4轮：自检与优化】五个敌对视角+量化打分+细节清单"""
-
-REVIEW_SYSTEM_PROMPT = """你是一个专业的微短剧分镜质检专家。对照小说原文，对每一条分镜进行严格的质量检查。
-
-必须切换为以下五个敌对视角，逐一对整集发起攻击：
-
-【视角1：普通观众（刷短视频的路人）】
-- 哪里看不懂？哪里无聊想跳过？
-- 我能不能在完全不知道原著的情况下看懂这一集？
-- 结尾够不够让我点"下一集"？
-- 输出：作为路人观众，我会在第X秒划走，因为______
-
-【视角2：竞品编剧与逻辑警察（想找你毛病的同行）】
-- 【常识与物理排雷】：哪个动作描写是毫无常识、违背物理定律或人体工学的？（例如坐着高抬腿踹天窗、狭窄空间挥舞大剑、重力环境下的反牛顿动作等低级错误）
-- 哪些分镜是"偷懒"的？（用台词代替画面、用旁白交代信息）
-- 哪些情绪转折是"硬拗"的？（缺少铺垫就突然转变）
-- 整体节奏有没有拖沓或跳跃？
-- 输出：如果我是竞品，我会狠狠嘲笑你第X分镜的______动作完全违背了物理常识，在现实拍摄中应该修改为______。
-
-【视角3：原著粉（对人设极度敏感的读者）】
-- 哪个角色被OOC了？具体哪句话/哪个行为违背原著？
-- 哪些核心情节被改掉了？改得合不合理？
-- 角色关系的化学反应够不够？
-- 原著中最打动人的情感核心有没有被保留？
-- 输出：作为原著粉，我最不能接受的是______，因为原著中______
-
-【视角4：剪辑师（负责后期剪辑的技术人员）】
-- 哪些分镜时长虚标？（标10秒但内容只够5秒，或标10秒但内容需要20秒）
-- 哪些分镜之间缺少衔接点？（上一镜结尾画面和下一镜开头画面接不上）
-- 哪些分镜的动作描写不够精确，导致我无法判断镜头怎么拍？
-- 有没有分镜的画面信息过载（一个镜头里塞了太多东西）？
-- 台词和画面的时间关系清楚吗？我能判断台词在哪个动作时说出吗？
-- 输出：作为剪辑师，我剪不动的地方是______，因为______
-
-【视角5：导演（对整体质量负责的决策者）】
-- 这集的"记忆点"是什么？观众看完能记住的画面是什么？
-- 情绪曲线画出来是什么形状？有没有平坦段？
-- 演员拿到这个剧本，能不能直接演？还是会来问我"这里怎么演"？
-- 整集的视觉风格统一吗？有没有某个分镜画风突变？
-- 如果只能保留3个分镜，我保留哪3个？其余的有没有可以合并或删除的？
-- 画面里的“不说话”或处于“被动（被抱/被牵/）”的角色，是否被忽略，没有给符合（剧情/性格）的（微表情/动作）和反应镜头？
-- 输出：作为导演，我最想重拍的是分镜______，最满意的是分镜______
-
-【重点检查项：台词三合一】
-对每句台词检查：
-- 嵌入位置：这句话在动作流的哪个时间点说出？读者能否判断？
-- 说话状态：说这句话时人物的表情、情绪、身体动作是否描写了？
-- 角色DNA：这句话符合角色的说话习惯吗？
-
-
-对每条分镜逐一输出检查报告，最后给出整集汇总。
-7分以下必须给出具体修改方案。"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # ============================================================
 # Session State
 # ============================================================
 def init_session_state():
     defaults = {
-        "api_key": "", "api_base": "https://yunwu.ai/v1/",
-        "model_id": "deepseek-chat", "custom_model": "",
+        "api_key": "" if MULTI_USER else SERVER_API_KEY, "api_base": os.environ.get("FENJIN_API_BASE", DEFAULT_API_BASE),
+        "model_id": DEFAULT_MODEL, "custom_model": "",
         "chapters": {}, "chapter_order": [],
         "current_step": 0, "current_episode": 1,
-        "global_analysis": "", "opening_designs": "",
-        "episodes": {}, "review_results": {},
+        "global_analysis": "", "analysis_sections": {}, "opening_designs": "", "opening_items": [], "selected_opening": "",
+        "episodes": {}, "episode_meta": {}, "episode_alternates": {}, "episode_history": {}, "review_results": {},
         "memory": {
             "storyline": "", "characters": "", "progress": "",
             "last_ending": "", "pending_foreshadow": "",
             "next_foreshadow": "", "emotion_track": ""
         },
-        "messages": [], "chat_history": [],
+        "messages": [], "chat_history": [], "chat_summary": {},
         "mode": "默认", "selected_chapters_for_analysis": [],
-        "review_model": None,
+        "review_model": None, "memory_model": "gpt-4o-mini", "batch_jobs": [], "batch_runs": [], "build_inputs": {},
+        "prompt_versions": {}, "prompt_stats": {}, "history_archive": {}, "user": "",
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -527,12 +200,40 @@ def init_session_state():
 init_session_state()
 
 # 启动时尝试恢复数据
+if MULTI_USER and not st.session_state.user and AUTH_HEADER:
+    un = header_user(getattr(st, "context", None) and st.context.headers, AUTH_HEADER)
+    if not USER_NAME_RE.match(un):
+        st.error(f"❌ 未通过认证：请求缺少有效的 {AUTH_HEADER} 头（需经反向代理登录，Streamlit 1.37+）")
+        st.stop()
+    st.session_state.user = un
+if MULTI_USER and not st.session_state.user:
+    st.markdown("### 👤 登录")
+    un = st.text_input("用户名", value=st.query_params.get("user", "") if ALLOW_USER_PARAM else "", key="lg_u",
+                       help="每个用户名对应一份独立的项目；字母、数字、下划线、中文或短横线，最多32字")
+    tok = st.text_input("访问令牌", type="password", key="lg_t") if USER_TOKENS else ""
+    if un and (tok or not USER_TOKENS):
+        if not USER_NAME_RE.match(un):
+            st.error("❌ 用户名不合法")
+        elif USER_TOKENS and not check_token(USER_TOKENS, un, tok):
+            st.error("❌ 用户名或访问令牌不正确")
+        else:
+            st.session_state.user = un
+            if ALLOW_USER_PARAM:
+                st.query_params["user"] = un
+            st.rerun()
+    if not TRUSTED_IDENTITY:
+        st.caption("⚠️ 用户名未经验证，知道名字就能打开对应项目，仅限可信内网使用")
+    st.stop()
+
 if not st.session_state.get("_restore_attempted"):
     st.session_state["_restore_attempted"] = True
     restored = auto_restore()
     if restored:
         st.session_state["_just_restored"] = True
 
+# 模板表是进程级的：每次重跑按本会话项目的选择切换本脚本线程启用的版本
+st.session_state.prompt_versions = apply_versions(st.session_state.prompt_versions, thread_local=True)
+
 # ============================================================
 # API调用
 # ============================================================
@@ -540,95 +241,47 @@ def get_active_model():
     model = st.session_state.model_id
     if model == "自定义模型":
         model = st.session_state.custom_model
-    return model if model else "deepseek-chat"
+    return model if model else DEFAULT_MODEL
+
+def get_api_key():
+    return st.session_state.api_key or (SERVER_API_KEY if MULTI_USER else "")
 
 def call_api_streaming(messages, system_prompt=SYSTEM_PROMPT):
-    api_key = st.session_state.api_key
-    api_base = st.session_state.api_base.rstrip("/")
-    model = get_active_model()
-    if not api_key:
+    cfg = get_api_config()
+    if not cfg["api_key"]:
         st.error("❌ 请先配置 API Key")
         return None
-    if not api_base:
+    if not cfg["api_base"]:
         st.error("❌ 请先配置接口地址")
         return None
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {
-        "model": model,
-        "messages": [{"role": "system", "content": system_prompt}] + messages,
-        "stream": True, "temperature": 0.7, "max_tokens": 16384
-    }
-    max_retries = 3
-    for attempt in range(max_retries):
+    try:
+        return open_stream(cfg, messages, system_prompt, on_retry=lambda wait_time, attempt: st.warning(
+            f"⚠️ API限流，{wait_time}秒后自动重试（第{attempt}/3次）..."))
+    except requests.exceptions.Timeout:
+        st.error("❌ 超时（300秒）")
+    except requests.exceptions.ConnectionError:
+        st.error("❌ 无法连接，检查接口地址")
+    except requests.exceptions.HTTPError as e:
+        code = e.response.status_code if e.response is not None else "?"
+        body = ""
         try:
-            resp = requests.post(f"{api_base}/chat/completions", headers=headers, json=data, stream=True, timeout=300)
-            if resp.status_code == 429:
-                wait_time = (attempt + 1) * 30
-                st.warning(f"⚠️ API限流，{wait_time}秒后自动重试（第{attempt+1}/{max_retries}次）...")
-                time.sleep(wait_time)
-                continue
-            resp.raise_for_status()
-            return resp
-        except requests.exceptions.Timeout:
-            st.error("❌ 超时（300秒）")
-            return None
-        except requests.exceptions.ConnectionError:
-            st.error("❌ 无法连接，检查接口地址")
-            return None
-        except requests.exceptions.HTTPError as e:
-            code = e.response.status_code if e.response is not None else "?"
-            if code == 429:
-                wait_time = (attempt + 1) * 30
-                st.warning(f"⚠️ API限流，{wait_time}秒后自动重试（第{attempt+1}/{max_retries}次）...")
-                time.sleep(wait_time)
-                continue
-            body = ""
-            try:
-                body = e.response.text[:500] if e.response is not None else ""
-            except:
-                pass
-            st.error(f"❌ HTTP {code}: {body}")
-            return None
-        except Exception as e:
-            st.error(f"❌ {type(e).__name__}: {e}")
-            return None
-    st.error("❌ 多次重试仍被限流，请等待几分钟后再试")
+            body = e.response.text[:500] if e.response is not None else ""
+        except Exception:
+            pass
+        st.error(f"❌ HTTP {code}: {body}")
+    except RateLimited:
+        st.error("❌ 多次重试仍被限流，请等待几分钟后再试")
+    except QuotaExceeded as e:
+        st.error(f"❌ Token配额已用完：{e}")
+    except Exception as e:
+        st.error(f"❌ {type(e).__name__}: {e}")
     return None
 
 def process_stream(response):
     if response is None:
         return
     try:
-        for line in response.iter_lines():
-            if not line:
-                continue
-            try:
-                line_str = line.decode("utf-8")
-            except:
-                continue
-            if not line_str.startswith("data: "):
-                continue
-            data_str = line_str[6:].strip()
-            if data_str == "[DONE]":
-                break
-            if not data_str:
-                continue
-            try:
-                data = json.loads(data_str)
-            except json.JSONDecodeError:
-                continue
-            choices = data.get("choices")
-            if not choices or not isinstance(choices, list) or len(choices) == 0:
-                continue
-            first = choices[0]
-            if not isinstance(first, dict):
-                continue
-            delta = first.get("delta")
-            if not delta or not isinstance(delta, dict):
-                continue
-            content = delta.get("content")
-            if content:
-                yield content
+        yield from iter_stream(response)
     except requests.exceptions.ChunkedEncodingError:
         st.warning("⚠️ 传输中断，已保存内容")
     except requests.exceptions.ConnectionError:
@@ -645,294 +298,591 @@ def stream_to_container(response, container):
         container.markdown(full)
     return full
 
-def call_api_non_streaming(messages, system_prompt=SYSTEM_PROMPT):
-    api_key = st.session_state.api_key
-    api_base = st.session_state.api_base.rstrip("/")
-    model = get_active_model()
-    if not api_key or not api_base:
-        return None
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    data = {
-        "model": model,
-        "messages": [{"role": "system", "content": system_prompt}] + messages,
-        "stream": False, "temperature": 0.7, "max_tokens": 16384
+def get_api_config(model=None):
+    """快照当前接口配置，供后台线程使用（线程内不能访问session_state）"""
+    return {
+        "api_base": st.session_state.api_base.rstrip("/"),
+        "api_key": get_api_key(),
+        "model": model or get_active_model(),
+        "user": st.session_state.user,
     }
+
+def call_api_non_streaming(messages, system_prompt=SYSTEM_PROMPT, model=None, temperature=0.7, max_tokens=16384):
+    cfg = get_api_config(model)
+    if not cfg["api_key"] or not cfg["api_base"]:
+        return None
     try:
-        resp = requests.post(f"{api_base}/chat/completions", headers=headers, json=data, timeout=120)
-        resp.raise_for_status()
-        result = resp.json()
-        choices = result.get("choices")
-        if not choices or len(choices) == 0:
-            return None
-        return choices[0].get("message", {}).get("content", "")
+        return request_completion(cfg, messages, system_prompt, temperature, max_tokens)
     except Exception as e:
         st.error(f"❌ {type(e).__name__}: {e}")
         return None
 
+def note_prompt_use(kind, started, text, scored=True):
+    """按当前启用的Prompt版本累计一次调用（耗时从 started 起算；剧本类附带本地评分），用于A/B对比"""
+    record_usage(st.session_state.prompt_stats, prompt_id(kind), time.perf_counter() - started, text,
+                 score_script(text)["score"] if scored else None)
+
+@st.cache_resource
+def get_background_executor():
+    """进程级后台线程池（只创建一次，不随重跑重建）"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="fenjin-bg")
+
 # ============================================================
 # 章节管理
 # ============================================================
-def add_chapter(name, content):
+def add_chapter(name, content, save=True):
     if name and content:
-        st.session_state.chapters[name] = content
+        st.session_state.chapters[name] = {"hash": put_blob(content), "length": len(content)}
         if name not in st.session_state.chapter_order:
             st.session_state.chapter_order.append(name)
-        auto_save()
+        invalidate_chapter_stats()
+        if save:
+            auto_save()
         return True
     return False
 
+def add_chapters_bulk(items):
+    """批量添加章节，全部加入后只写一次本地备份"""
+    added = []
+    for name, content in items:
+        name = unique_chapter_name(name)
+        if add_chapter(name, content, save=False):
+            added.append((name, len(content)))
+    if added:
+        auto_save()
+    return added
+
+def unique_chapter_name(name):
+    """章节重名时追加序号，避免覆盖已有章节"""
+    if name not in st.session_state.chapters:
+        return name
+    i = 2
+    while f"{name}({i})" in st.session_state.chapters:
+        i += 1
+    return f"{name}({i})"
+
 def remove_chapter(name):
     if name in st.session_state.chapters:
         del st.session_state.chapters[name]
         if name in st.session_state.chapter_order:
             st.session_state.chapter_order.remove(name)
+        invalidate_chapter_stats()
         auto_save()
 
+def get_chapter_text(name):
+    """按需从章节存储加载正文"""
+    meta = st.session_state.chapters.get(name)
+    if not meta:
+        return ""
+    try:
+        return get_blob(meta["hash"])
+    except Exception as e:
+        st.warning(f"⚠️ 章节「{name}」读取失败：{type(e).__name__}: {e}")
+        return ""
+
+def chapter_length(name):
+    meta = st.session_state.chapters.get(name)
+    return meta.get("length", 0) if meta else 0
+
 def get_combined_text(names=None):
     if names is None:
         names = st.session_state.chapter_order
-    return "\n\n".join(f"【{n}】\n{st.session_state.chapters[n]}" for n in names if n in st.session_state.chapters)
+    return "\n\n".join(f"【{n}】\n{get_chapter_text(n)}" for n in names if n in st.session_state.chapters)
 
 # ============================================================
-# 自动提取末尾分镜
+# 派生统计缓存（只在写入时失效，重跑时不再全量重算）
 # ============================================================
-def extract_last_scenes(script, n=2):
-    """从剧本中自动提取最后n个分镜"""
-    scenes = re.split(r'(?=【分镜\s*\d+】)', script)
-    scenes = [s.strip() for s in scenes if s.strip() and '【分镜' in s]
-    if not scenes:
-        return ""
-    last_scenes = scenes[-n:]
-    return "\n\n".join(last_scenes)
+PAGE_SIZE = 20
+
+# 由章节/剧本派生、可随时重建的缓存（整体替换项目时清空）
+DERIVED_KEYS = ["_chapter_stats", "_episode_totals", "entity_index", "_scene_cache", "_ending_cache",
+                "_format_cache", "continuity_issues", "_chat_index"]
+# 属于当前项目的后台任务：换项目时丢弃，结果不再合并进新项目
+JOB_KEYS = ["_memory_jobs", "_chat_summary_job", "_batch_futures"]
+
+def invalidate_chapter_stats():
+    st.session_state.pop("_chapter_stats", None)
+
+def chapter_stats():
+    """章节数/总字数，基于元数据计算并缓存到下次增删章节"""
+    cs = st.session_state.get("_chapter_stats")
+    if cs is None:
+        total = sum(chapter_length(c) for c in st.session_state.chapter_order)
+        cs = {"count": len(st.session_state.chapter_order), "chars": total}
+        st.session_state["_chapter_stats"] = cs
+    return cs
+
+def set_episode(ep, text, source="编辑"):
+    """写入剧本、追加一个历史版本（source 记录是哪一步产生的），并刷新该集的统计缓存"""
+    ep_versions = st.session_state.episode_history.setdefault(ep, [])
+    if not ep_versions and ep in st.session_state.episodes:
+        record_version(ep_versions, st.session_state.episodes[ep], "初始")
+    record_version(ep_versions, text, source)
+    st.session_state.episodes[ep] = text
+    st.session_state.episode_meta[ep] = {
+        "hash": content_hash(text), "shots": len(SHOT_RE.findall(text)), "chars": len(text)
+    }
+    st.session_state.pop("_episode_totals", None)
+
+def episode_stats(ep):
+    """单集统计（分镜数/字数/哈希），缺失时按需补算一次"""
+    meta = st.session_state.episode_meta.get(ep)
+    if meta is None:
+        text = st.session_state.episodes.get(ep, "")
+        meta = {"hash": content_hash(text), "shots": len(SHOT_RE.findall(text)), "chars": len(text)}
+        st.session_state.episode_meta[ep] = meta
+    return meta
+
+def episode_totals():
+    tt = st.session_state.get("_episode_totals")
+    if tt is None:
+        tt = {"chars": sum(episode_stats(e)["chars"] for e in st.session_state.episodes)}
+        st.session_state["_episode_totals"] = tt
+    return tt
+
+def paginate(items, key, page_size=PAGE_SIZE):
+    """超过一页时显示页码选择，返回 (起始下标, 当前页条目)"""
+    if len(items) <= page_size:
+        return 0, items
+    pages = (len(items) + page_size - 1) // page_size
+    pg = st.number_input(f"页码（共{pages}页）", 1, pages, 1, key=key)
+    start = (int(pg) - 1) * page_size
+    return start, items[start:start + page_size]
+
+def flash(msg):
+    """留一条成功提示到刷新后显示（紧接着 st.rerun() 时当场显示的提示看不到）"""
+    st.session_state.setdefault("_flash", []).append(msg)
 
 # ============================================================
-# Prompt构建
+# 流式导入（大文件自动识别编码并分章）
 # ============================================================
-def build_analysis_prompt(text):
-    return f"""【微短剧3.1启动】
-
-以下是需要改编的小说原文：
-
-{text}
-
-请执行【第1轮：全局提炼】，输出：
-1. 一句话故事核心
-2. 每个主要角色的【驱动卡】（必须从原著提取原句作为说话DNA示范，特别注意每个角色的说话习惯差异）
-3. 故事大纲（分阶段）+ 各阶段核心情绪类型
-4. 必须保留的核心情节节点（10-20个）
-5. 需要补充的逻辑链节点
-6. 全剧环境/氛围基调 + 天气光影变化建议
-7. 视觉强场景与短剧记忆点（5-8个瞬间，每个3-5句具体画面描述）"""
-
-def build_opening_prompt():
-    return """请执行【第2轮：开场手法设计】
-
-输出6条完全不同的第1集开场方案，每条包含：
-- 开场类型标签
-- 前30秒逐秒画面描述
-- 30秒后如何衔接主线"""
-
-def build_episode_prompt(ep, text, opening="", prev_ending=""):
-    mem = st.session_state.memory
-    mem_str = ""
-    if mem.get("storyline"):
-        mem_str = f"""
-📌 主线：{mem['storyline']}
-📌 人物：{mem['characters']}
-📌 进度：第{mem['progress']}集
-📌 伏笔：{mem['pending_foreshadow']}
-📌 引爆：{mem['next_foreshadow']}
-📌 情绪：{mem['emotion_track']}"""
-
-    prev_str = ""
-    if prev_ending and prev_ending.strip():
-        prev_str = f"""
-═══════════════════════════════════════
-🔗 上集末尾（必须衔接）
-═══════════════════════════════════════
-以下是上一集的结尾分镜，本集第一个分镜必须与之自然衔接：
-- 画面衔接：本集开场画面必须接上上集最后的"衔接点"
-- 情绪衔接：延续上集结尾的情绪氛围（可以延续也可以反转，但不能无视）
-- 时空衔接：注意角色的物理位置、状态、穿着与上集保持一致
-- 如果上集结尾有悬念钩子，本集需要在合适时机回应
-
-上集末尾内容：
-{prev_ending}
-"""
-    else:
-        prev_str = "\n（本集为第一集或新篇章开始，无需衔接上集）\n"
-
-    return f"""请执行【第3轮：剧本生成】—— 第{ep}集
-{mem_str}
-{prev_str}
-{"选择的开场方案：" + opening if opening else ""}
-
-参考小说原文：
-{text}
-
-严格执行前置ABCD，然后输出完整分镜剧本。
-
-【分镜格式强制要求——必须严格遵守】
-
-1. 台词必须嵌入画面动作流中，出现在它被说出的精确时间位置
-   不允许把台词单独放在画面描写下面！
-
-2. 每句台词前面必须紧跟说话者的：
-   - 情绪/语气（低沉/暴怒/故作轻松/嘴硬但声音发颤……）
-   - 面部表情（挑眉/眼神躲闪/下颌收紧/嘴角抽搐……）
-   - 身体动作（双手插兜/侧过头/攥拳……）
-   至少写两个。
-
-3. 内心OS出现在角色产生想法的那个时刻
-
-4. 音效用（）标注在发声动作旁边
-
-5.遇到动作戏/危机爆发，必须写出专业镜头语句，并强制调用【好莱坞级镜头语法】：
-   - 必须出现“特写”、“跟踪镜头”、“慢动作/子弹时间”、“极速推拉”等导演术语！
-   - 必须描写空气扭曲、后坐力、弹道轨迹、巨兽体型压迫感等视觉奇观！
-   - 你可以用100-200字去极致描绘一发子弹破空的空气阻力，即使这段描写的实算时长只有2-3秒。
-
-6.动作生成前置排雷（物理与常识校验）：
-   - 写每一个动作前，检查是否符合物理常识（副驾驶怎么踹天窗？手被绑在背后怎么开枪？）。
-   - 发现原著有逻辑硬伤，必须自动用符合常识的合理动作替换，并在内心独白的【影视化排雷】中注明修改原因
-
-7.严禁角色“道具化”发呆：
-   - 画面中如果不说话的核心角色（特别是被抱着/牵引着的角色/站着背景的角色），绝对不能变成空洞的背景板！
-   - 必须强制穿插他们的【反应镜头】（微表情/眼神乱转/小动作/身体反馈），赋予他们鲜活的生命感！
-
-示范格式：
-【分镜x】
-[角色动作描写]——
-[继续动作/变化]（音效：xxx）。
-角色A（情绪描写+表情+身体状态）："台词内容"
-[另一角色的反应动作]。
-角色B（情绪描写+表情+身体状态） OS：（内心独白内容）"""
+def import_novel_file(fileobj, default_name):
+    """流式导入一个小说文件，返回 (编码, [(章节名, 字数), ...])"""
+    enc, chapters = read_novel(fileobj, default_name)
+    return enc, add_chapters_bulk(chapters)
 
-def build_review_prompt(ep, script, text):
-    return f"""请对第{ep}集剧本执行完整的【第4轮：自检与优化】。
-
-【小说原文】
-{text}
-
-【剧本分镜】
-{script}
-
-请严格按照以下内容逐一执行，不得遗漏任何部分：
-
-【重点2：台词嵌入度】
-每句台词是否嵌入在画面动作流的精确位置？
-还是单独另起一行与画面分离？
-
-【重点3：台词情绪描写】
-每句台词前面是否描写了说话者当时的情绪+表情+身体状态？
-还是"裸台词"（只有角色名+台词内容）？
-
-【第二部分：五个敌对视角攻击】
-质检完所有分镜后，切换为以下五个视角逐一攻击整集：
-
-视角1——普通观众（刷短视频的路人）：
-不看原著能看懂吗？有代入感吗？
-→ 输出："我会在第X秒划走，因为______"
-
-视角2——竞品编剧（找毛病的同行）：
-哪些情节不连贯？哪些情绪硬拗？哪些台词不符合角色人设？
-→ 输出："我会攻击你的______，并用______做得更好"
-
-视角3——原著粉（人设敏感的读者）：
-哪个角色OOC？核心情节被改了吗？主角戏份有变少吗？情感核心保留了吗？
-→ 输出："最不能接受______，因为原著中______"
-
-视角4——剪辑师（后期技术人员）：
-时长虚标？缺衔接点？动作不够精确？画面信息过载？台词时间关系清楚吗？
-→ 输出："剪不动的地方是______，因为______"
-
-视角5——导演（整体质量负责人）：
-记忆点是什么？情绪曲线形状？演员能直接演吗？视觉风格统一吗？
-→ 输出："最想重拍分镜______，最满意分镜______"
-
-输出检查报告+汇总。7分以下必须给修改方案。"""
-
-def build_dialogue_optimization_prompt(ep, script, global_analysis=""):
-    character_info = ""
-    if global_analysis:
-        character_info = f"\n【角色驱动卡参考】\n{global_analysis[:4000]}\n"
-    return f"""台词优化第{ep}集。
-
-{character_info}
-
-【核心：台词优化≠精简！而是个性化+潜台词化+情绪匹配】
-
-优化步骤：
-1. 确认每个角色的说话DNA
-2. 逐句检查：个性标签、情绪匹配、潜台词深度、关系动态
-3. 补充台词前的情绪/表情/身体描写（如果缺失）
-4. 确保台词嵌入在画面动作流的正确时间位置
-
-❌ 禁止：统一缩短/删口头禅/让话痨变沉默/台词与画面分离
-✅ 要求：每处修改标注原因+关联角色DNA
-
-当前剧本：
-{script}
+# ============================================================
+# 上集末尾（按Token预算自适应选取结尾分镜）
+# ============================================================
+ENDING_CACHE_SIZE = 64
+def ending_context(script, h=None):
+    """按内容哈希缓存的上集末尾，供单集/批量生成、优化和质检共用"""
+    if not script:
+        return ""
+    budget = st.session_state.get("ending_budget", ENDING_TOKEN_BUDGET)
+    summarize = st.session_state.get("ending_summary", True)
+    key = (h or content_hash(script), budget, summarize)
+    cache = st.session_state.setdefault("_ending_cache", {})
+    if key not in cache:
+        if len(cache) >= ENDING_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cache[key] = build_ending_context(script, budget, summarize, get_entity_index()["characters"])
+    return cache[key]
 
-输出优化后完整剧本。"""
+# ============================================================
+# 全局记忆（每集生成后由小模型在后台自动提炼）
+# ============================================================
+def update_memory(**fields):
+    """程序写入记忆卡；同时换掉总览里可编辑输入框的key，避免旧输入值覆盖新记忆"""
+    st.session_state.memory.update(fields)
+    st.session_state["_memory_rev"] = st.session_state.get("_memory_rev", 0) + 1
+
+def get_memory_model():
+    mm = st.session_state.get("memory_model")
+    if mm == "关闭":
+        return None
+    return mm if mm and mm != "与生成模型相同" else get_active_model()
 
-def build_visual_optimization_prompt(ep, script):
-    return f"""画面优化第{ep}集。
+def schedule_memory_update(ep, script):
+    """提交后台记忆提炼，不阻塞当前页面"""
+    model = get_memory_model()
+    if not model or not get_api_key():
+        return
+    cfg = get_api_config(model)
+    fut = get_background_executor().submit(extract_memory, cfg, ep, script, dict(st.session_state.memory))
+    st.session_state.setdefault("_memory_jobs", {})[ep] = fut
+
+def apply_memory_updates():
+    """把已完成的后台提炼结果按集数顺序合并进记忆卡"""
+    jobs = st.session_state.get("_memory_jobs")
+    if not jobs:
+        return
+    changed = False
+    for ep in sorted(jobs):
+        fut = jobs[ep]
+        if not fut.done():
+            continue
+        del jobs[ep]
+        try:
+            upd = fut.result()
+        except Exception as e:
+            st.toast(f"⚠️ 第{ep}集记忆提炼失败：{type(e).__name__}")
+            continue
+        if upd and ep >= st.session_state.memory.get("extracted_ep", 0):
+            update_memory(extracted_ep=ep, **upd)
+            changed = True
+    if changed:
+        auto_save()
 
-要求：
-1. 不寻常具体细节（声音/光影/微动作）
-2. 声音锚定空间
-3. 光源具体化
-4. 身体失控＞表情形容词
-5. 反差动作＞直球动作
-6. 每分镜≥5个动作事件（有时间流动感）
-7. 台词保持嵌入式格式不变
-8. 实算时长不变
+def wait_memory_update(ep, timeout=MEMORY_WAIT):
+    """等第ep集的后台记忆提炼（最多timeout秒）并合并；批量生成下一集前调用"""
+    fut = (st.session_state.get("_memory_jobs") or {}).get(ep)
+    if fut is not None and not fut.done():
+        with st.spinner(f"🧠 等待第{ep}集记忆提炼..."):
+            wait_futures([fut], timeout)
+    apply_memory_updates()
+
+def schedule_chat_summary():
+    """对话窗口外攒够消息时，提交后台滚动摘要（同一时间只跑一个）"""
+    cs = st.session_state.chat_summary
+    due = summary_due(st.session_state.chat_history, cs.get("upto", 0))
+    model = get_memory_model()
+    if not due or not model or not get_api_key() or st.session_state.get("_chat_summary_job"):
+        return
+    turns = st.session_state.chat_history[due[0]:due[1]]
+    fut = get_background_executor().submit(summarize_chat, get_api_config(model), cs.get("text", ""), turns)
+    st.session_state["_chat_summary_job"] = (due[1], fut)
+
+def apply_chat_summary():
+    """后台摘要完成后写回；失败时保留原摘要，下次再压缩"""
+    job = st.session_state.get("_chat_summary_job")
+    if not job or not job[1].done():
+        return
+    del st.session_state["_chat_summary_job"]
+    upto, fut = job
+    try:
+        text = fut.result()
+    except Exception as e:
+        st.toast(f"⚠️ 对话摘要失败：{type(e).__name__}")
+        return
+    if text:
+        st.session_state.chat_summary = {"text": text, "upto": upto}
+        auto_save()
 
-当前剧本：
-{script}
+def apply_history_policy():
+    """对话历史超过保留条数时把较早的消息转存到磁盘；返回是否有转存
+
+    生成上下文保留全局提炼那一轮和最近几条；自由对话开启摘要时只转存已并入摘要的部分。
+    """
+    arch = st.session_state.history_archive
+    ms, refs = offload_history(st.session_state.messages, MESSAGES_KEEP, MESSAGES_HEAD)
+    if refs:
+        st.session_state.messages = ms
+        arch.setdefault("messages", []).extend(refs)
+    if st.session_state.get("_chat_summary_job"):
+        return bool(refs)
+    ch, cs = st.session_state.chat_history, st.session_state.chat_summary
+    keep = CHAT_KEEP
+    if get_memory_model() and get_api_key():
+        keep = max(keep, len(ch) - cs.get("upto", 0))
+    kept, crefs = offload_history(ch, keep)
+    if crefs:
+        st.session_state.chat_history = kept
+        arch.setdefault("chat_history", []).extend(crefs)
+        if cs:
+            cs["upto"] = max(cs.get("upto", 0) - len(crefs), 0)
+    return bool(refs or crefs)
+
+def chat_index():
+    """检索索引放在session里，按来源哈希增量同步"""
+    idx = st.session_state.get("_chat_index")
+    if idx is None:
+        idx = st.session_state["_chat_index"] = PassageIndex()
+    idx.sync(project_sources(st.session_state))
+    return idx
+
+def episode_context():
+    """生成剧本时的历史上下文：已有自动记忆卡时只带全局提炼那一轮，不再带全部历史
+
+    全局提炼已拆分时那一轮只带生成需要的部分，不再重复发送提炼时的小说原文。
+    还有记忆提炼没完成时（记忆卡落后于上一集），补上最近一轮生成对话。
+    """
+    head = analysis_context(st.session_state, "episode")
+    ms = st.session_state.messages
+    if not st.session_state.memory.get("extracted_ep"):
+        return head + ms[2:]
+    if st.session_state.get("_memory_jobs") and len(ms) >= 4:
+        return head + ms[-2:]
+    return head
 
-输出优化后完整剧本，修改处标注【🎨】。"""
+# ============================================================
+# 角色索引（从全局提炼解析驱动卡，记录在章节/剧本中的出场）
+# ============================================================
+def get_entity_index():
+    """角色索引：驱动卡随全局提炼变化重建，出场记录按内容哈希增量扫描"""
+    ga = st.session_state.global_analysis
+    ah = content_hash(ga) if ga else ""
+    idx = st.session_state.get("entity_index")
+    if idx is None or idx["analysis_hash"] != ah:
+        idx = {"analysis_hash": ah, "characters": parse_character_cards(ga), "chapter_hits": {}, "episode_hits": {}}
+    chars = idx["characters"]
+    if chars:
+        for ch in st.session_state.chapter_order:
+            h = st.session_state.chapters[ch]["hash"]
+            if h not in idx["chapter_hits"]:
+                idx["chapter_hits"][h] = find_characters(get_chapter_text(ch), chars)
+        for e in st.session_state.episodes:
+            h = episode_stats(e)["hash"]
+            if h not in idx["episode_hits"]:
+                idx["episode_hits"][h] = find_characters(st.session_state.episodes[e], chars)
+    st.session_state["entity_index"] = idx
+    return idx
+
+def character_appearances(idx):
+    """{角色名: {"chapters": (首次, 末次), "episodes": (首集, 末集)}}"""
+    out = {name: {"chapters": None, "episodes": None} for name in idx["characters"]}
+    for ch in st.session_state.chapter_order:
+        for name in idx["chapter_hits"].get(st.session_state.chapters[ch]["hash"], {}):
+            first = out[name]["chapters"][0] if out[name]["chapters"] else ch
+            out[name]["chapters"] = (first, ch)
+    for e in sorted(st.session_state.episodes):
+        for name in idx["episode_hits"].get(episode_stats(e)["hash"], {}):
+            first = out[name]["episodes"][0] if out[name]["episodes"] else e
+            out[name]["episodes"] = (first, e)
+    return out
+
+def select_character_cards(script, budget=CARD_BUDGET):
+    """只取本集实际出场角色的驱动卡；剧本里认不出角色时取章节里出场最多的，解析不到驱动卡时退回截断全文"""
+    idx = get_entity_index()
+    ranking = {}
+    for ch in st.session_state.chapter_order:
+        for name, n in idx["chapter_hits"].get(st.session_state.chapters[ch]["hash"], {}).items():
+            ranking[name] = ranking.get(name, 0) + n
+    return select_cards(script, idx["characters"], cards_fallback(st.session_state), budget, ranking)
 
-def build_emotion_optimization_prompt(ep, script):
-    return f"""情绪优化第{ep}集。
+# ============================================================
+# 分镜解析（场景索引）与本地连续性检查
+# ============================================================
+def get_scenes(ep):
+    """按 剧本哈希+驱动卡版本 缓存的场景索引"""
+    idx = get_entity_index()
+    key = (episode_stats(ep)["hash"], idx["analysis_hash"])
+    cache = st.session_state.setdefault("_scene_cache", {})
+    hit = cache.get(ep)
+    if hit is None or hit[0] != key:
+        hit = (key, parse_scenes(st.session_state.episodes.get(ep, ""), idx["characters"]))
+        cache[ep] = hit
+    return hit[1]
+
+def run_continuity_check():
+    scene_map = {e: get_scenes(e) for e in sorted(st.session_state.episodes)}
+    issues = check_continuity(scene_map)
+    st.session_state["continuity_issues"] = issues
+    return issues
 
-要求：
-1. 开场15秒足够冲击
-2. 集内至少一次情绪急转
-3. 结尾悬念钩子
-4. 情绪曲线有起伏
-5. 题材引擎（弹簧法/磁铁法/错位法/橡皮筋法）
-6. ≥65%转折来自互动
-7. 台词格式和嵌入方式不变
+# ============================================================
+# 本地格式校验（不调用模型）与定向修复
+# ============================================================
+def format_issues(ep):
+    """按内容哈希缓存的格式校验结果"""
+    h = episode_stats(ep)["hash"]
+    cache = st.session_state.setdefault("_format_cache", {})
+    hit = cache.get(ep)
+    if hit is None or hit[0] != h:
+        hit = (h, validate_script(st.session_state.episodes.get(ep, "")))
+        cache[ep] = hit
+    return hit[1]
 
-当前剧本：
-{script}
+# ============================================================
+# 离线批处理（OpenAI Batch API 格式，非流式，牺牲延迟换吞吐/成本）
+# ============================================================
+def build_batch_job(kind, start, end, tx):
+    """按当前状态构造一批请求（批内各集互不依赖，上集末尾只取已生成的集）
+
+    返回 (请求列表, 衔接了已生成上集结尾的集数)；后者随任务保存，写回时据此记录依赖。
+    """
+    reqs, prev_used = [], []
+    if kind == "episode":
+        ctx = episode_context()
+        for e in range(start, end + 1):
+            if e - 1 in st.session_state.episodes:
+                pe = ending_context(st.session_state.episodes[e - 1], episode_stats(e - 1)["hash"])
+                prev_used.append(e)
+            else:
+                pe = st.session_state.memory.get("last_ending", "") if e == start else ""
+            reqs.append(batch_request(f"episode-{e}", get_active_model(), SYSTEM_PROMPT,
+                                      ctx + [{"role": "user", "content": build_episode_prompt(e, tx, st.session_state.get("selected_opening", "") if e == 1 else "", pe, st.session_state.memory)}]))
+    else:
+        model = st.session_state.review_model or get_active_model()
+        for e in range(start, end + 1):
+            if e not in st.session_state.episodes:
+                continue
+            sc_text = st.session_state.episodes[e]
+            pe = ending_context(st.session_state.episodes[e - 1], episode_stats(e - 1)["hash"]) if e - 1 in st.session_state.episodes else ""
+            reqs.append(batch_request(f"review-{e}", model, REVIEW_SYSTEM_PROMPT,
+                                      [{"role": "user", "content": build_review_prompt(e, sc_text, tx, select_character_cards(sc_text), pe)}]))
+    return reqs, prev_used
+
+def refresh_batch_jobs():
+    """检查本地模拟任务是否完成"""
+    futs = st.session_state.get("_batch_futures") or {}
+    for job in st.session_state.batch_jobs:
+        if job["status"] != "running" or job["mode"] != "本地模拟":
+            continue
+        fut = futs.get(job["id"])
+        if fut is None:
+            # 进程重启后后台任务已丢失：输出完整则视为完成，否则标记中断
+            n = 0
+            if os.path.exists(job["output_path"]):
+                with open(job["output_path"], encoding="utf-8") as fh:
+                    n = sum(1 for _ in fh)
+            job["status"] = "completed" if n >= job["count"] else "interrupted"
+            continue
+        if not fut.done():
+            continue
+        try:
+            job["counts"] = fut.result()
+            job["status"] = "completed"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = f"{type(e).__name__}: {e}"
+        del futs[job["id"]]
+
+def ingest_batch_output(job):
+    """把结果写回 episodes / review_results"""
+    got, errors = [], []
+    for cid, text, err in read_batch_output(job["output_path"]):
+        kind, _, n = (cid or "").partition("-")
+        if not n.isdigit():
+            continue
+        n = int(n)
+        if text is None:
+            errors.append(f"{cid}: {err}")
+        elif kind == "episode":
+            set_episode(n, text, "离线批处理")
+            # 提交时是否衔接了上集记在任务里；旧任务没有记录时按写回时的状态近似
+            prev = n in job["prev_used"] if "prev_used" in job else n - 1 in st.session_state.episodes
+            record_episode(st.session_state, n, job.get("chapters"), job.get("opening", "") if n == 1 else "",
+                           prev and n - 1 in st.session_state.episodes, job.get("model") or get_active_model())
+            got.append(n)
+        elif kind == "review":
+            st.session_state.review_results[n] = text
+            record_review(st.session_state, n, job.get("model") or st.session_state.review_model or get_active_model())
+            got.append(n)
+    if job["kind"] == "episode" and got:
+        last = max(got)
+        if last >= max(st.session_state.episodes):
+            update_memory(progress=str(last), last_ending=ending_context(st.session_state.episodes[last], episode_stats(last)["hash"]))
+        st.session_state.current_step = max(st.session_state.current_step, 3)
+    elif got:
+        st.session_state.current_step = max(st.session_state.current_step, 4)
+    job["status"] = "ingested"
+    auto_save()
+    return got, errors
+
+def commit_episode(ep, text, cx, source="生成", names=None, opening="", prev_used=False):
+    """保存新生成的一集：剧本、对话历史、进度、上集末尾，并提交后台记忆提炼
+
+    names/opening/prev_used 记录本集由哪些章节、哪个开场、是否衔接上集生成，供依赖图判断过期。
+    """
+    set_episode(ep, text, source)
+    record_episode(st.session_state, ep, names, opening, prev_used and ep - 1 in st.session_state.episodes, get_active_model())
+    st.session_state.messages = cx + [{"role": "assistant", "content": text}]
+    st.session_state.current_step = max(st.session_state.current_step, 3)
+    update_memory(progress=str(ep))
+    last_scenes = ending_context(text, episode_stats(ep)["hash"])
+    if last_scenes:
+        update_memory(last_ending=last_scenes)
+    schedule_memory_update(ep, text)
+    auto_save()
+
+def replace_episode(ep, text, source):
+    """换用已有一集的另一个版本（采用备选、回滚）：与 commit_episode 一样刷新上集末尾、记忆提炼和依赖记录"""
+    set_episode(ep, text, source)
+    inp = st.session_state.build_inputs.get(node_id("episode", ep))
+    if inp:
+        record_episode(st.session_state, ep, list(inp.get("chapters", {})) or None,
+                       st.session_state.selected_opening if inp.get("opening") else "", bool(inp.get("prev")), inp.get("model"))
+    if ep == max(st.session_state.episodes):
+        update_memory(last_ending=ending_context(text, episode_stats(ep)["hash"]))
+    schedule_memory_update(ep, text)
+    auto_save()
+
+def run_batch(run):
+    """按运行清单逐集生成：已完成的跳过；失败的按指数退避重试，仍失败就记进清单、继续下一集"""
+    tx = get_combined_text(run["chapters"] or None)
+    run["status"] = "running"
+    auto_save()
+    for e in pending(run):
+        st.markdown(f"---\n### 🎬 第{e}集")
+        wait_memory_update(e - 1)
+        # 续跑时上一集可能在本集之后才补上，直接取第e-1集的末尾，没有再退回记忆卡
+        prev = st.session_state.episodes.get(e - 1)
+        pe = ending_context(prev, episode_stats(e - 1)["hash"]) if prev else st.session_state.memory.get("last_ending", "")
+        cx = episode_context() + [{"role": "user", "content": build_episode_prompt(e, tx, prev_ending=pe, memory=st.session_state.memory)}]
+        co = st.empty()
+
+        def attempt():
+            t = time.perf_counter()
+            r = call_api_streaming(cx)
+            f = stream_to_container(r, co) if r else ""
+            if not f:
+                raise RuntimeError("返回为空" if r else "请求失败")
+            return f, time.perf_counter() - t
 
-输出优化后完整剧本，修改处标注【❤️】。"""
+        try:
+            (f, secs), tries = with_retries(attempt, on_retry=lambda wait, n, ex: st.warning(
+                f"⚠️ 第{e}集{ex}，{wait}秒后重试（第{n}/{RUN_RETRIES - 1}次）"))
+        except Exception as ex:
+            mark_failed(run, e, str(ex), RUN_RETRIES)
+            auto_save()
+            st.error(f"❌ 第{e}集{RUN_RETRIES}次均失败（{ex}），已记入清单，继续下一集")
+            continue
+        note_prompt_use("episode", time.perf_counter() - secs, f)
+        mark_done(run, e, secs, tries)
+        commit_episode(e, f, cx, "批量生成", run["chapters"], "", bool(pe))
+        st.success(f"✅ 第{e}集")
+    finish_run(run)
+    auto_save()
+
+apply_memory_updates()
+apply_chat_summary()
+if apply_history_policy():
+    auto_save()
+timer.mark("初始化")
 
 # ============================================================
 # 侧边栏
 # ============================================================
 with st.sidebar:
+    if MULTI_USER:
+        sm = SCHEDULER.metrics()
+        quota = sm["limits"]["user_tokens"]
+        used = sm["users"].get(st.session_state.user, {}).get("tokens", 0)
+        st.caption(f"👤 {st.session_state.user}" + (f" · 近1小时 {used:,} / {quota:,} Token" if quota else ""))
+        if not TRUSTED_IDENTITY:
+            st.caption("⚠️ 用户名未经验证（仅限可信内网）：换个名字即可打开别人的项目，配额也按名字计")
+        if TRUSTED_IDENTITY and st.session_state.user in ADMINS:
+            with st.expander("🛡️ 调度状态", expanded=False):
+                a1, a2 = st.columns(2)
+                a1.metric("排队", sm["queued"])
+                a2.metric("进行中", sm["running"])
+                a1.metric("平均等待", f"{sm['avg_wait']:.1f}s")
+                a2.metric("最长等待", f"{sm['max_wait']:.1f}s")
+                lim = sm["limits"]
+                st.caption(f"已放行{sm['served']} · 超配额拒绝{sm['rejected']} · 429暂停{sm['rate_limited']}次"
+                           + (f"（还剩{sm['paused_for']:.0f}s）" if sm["paused_for"] else ""))
+                st.caption(f"上限：全局并发{lim['max_concurrency'] or '不限'} · 每人并发{lim['user_concurrency'] or '不限'}"
+                           f" · 每人每小时{lim['user_tokens'] or '不限'} Token")
+                if sm["users"]:
+                    st.markdown("| 用户 | 进行中 | 近1小时Token |\n|---|---:|---:|\n" + "\n".join(
+                        f"| {u} | {v['running']} | {v['tokens']:,} |" for u, v in sm["users"].items()))
+                cs = RESPONSE_CACHE.stats()
+                st.caption(f"共享响应缓存：{cs['entries']}条 · 命中{cs['hits']} / 未命中{cs['misses']}")
     st.markdown('<div class="sidebar-group-title">🔌 API 配置</div>', unsafe_allow_html=True)
     api_base = st.text_input("接口地址", value=st.session_state.api_base, key="sb_ab", placeholder="https://yunwu.ai/v1/")
     st.session_state.api_base = api_base
-    api_key = st.text_input("API Key", value=st.session_state.api_key, type="password", key="sb_ak", placeholder="sk-...")
+    server_key = MULTI_USER and SERVER_API_KEY
+    api_key = st.text_input("API Key", value=st.session_state.api_key, type="password", key="sb_ak",
+                            placeholder="已使用服务器配置的Key（填写则改用自己的）" if server_key else "sk-...")
     st.session_state.api_key = api_key
 
     st.markdown("---")
     st.markdown('<div class="sidebar-group-title">🤖 模型</div>', unsafe_allow_html=True)
-    model_options = [
-        "deepseek-chat", "deepseek-reasoner",
-        "claude-sonnet-4-20250514", "claude-opus-4-20250514",
-        "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "o3-mini",
-        "gemini-2.5-pro-preview-06-05", "自定义模型"
-    ]
     cm1, cm2 = st.columns([3, 1])
     with cm1:
-        sel = st.selectbox("生成模型", model_options,
-            index=model_options.index(st.session_state.model_id) if st.session_state.model_id in model_options else 0, key="sb_m")
+        sel = st.selectbox("生成模型", MODEL_OPTIONS,
+            index=MODEL_OPTIONS.index(st.session_state.model_id) if st.session_state.model_id in MODEL_OPTIONS else 0, key="sb_m")
         st.session_state.model_id = sel
     with cm2:
         st.markdown("<br>", unsafe_allow_html=True)
@@ -943,9 +893,36 @@ with st.sidebar:
     if sel == "自定义模型":
         cm = st.text_input("模型ID", value=st.session_state.custom_model, key="sb_c", placeholder="deepseek-v3")
         st.session_state.custom_model = cm
-    rev_opts = ["与生成模型相同"] + model_options
-    rv = st.selectbox("质检模型", rev_opts, key="sb_rv")
+    rv = st.selectbox("质检模型", REVIEW_MODEL_OPTIONS, key="sb_rv")
     st.session_state.review_model = None if rv == "与生成模型相同" else rv
+    mm = st.selectbox("记忆模型", MEMORY_MODEL_OPTIONS, key="sb_mm", help="每集生成后在后台自动提炼全局记忆（建议选小模型）",
+        index=MEMORY_MODEL_OPTIONS.index(st.session_state.memory_model) if st.session_state.memory_model in MEMORY_MODEL_OPTIONS else 0)
+    st.session_state.memory_model = mm
+
+    with st.expander("🧩 Prompt模板", expanded=False):
+        rows = template_table()
+        for name in dict.fromkeys(r["name"] for r in rows):
+            vs = versions(name)
+            if len(vs) > 1:
+                cur = st.session_state.prompt_versions.get(name, vs[0])
+                pv = st.selectbox(f"{name} 版本", vs, index=vs.index(cur) if cur in vs else 0, key=f"sb_pv_{name}")
+                if pv != cur:
+                    st.session_state.prompt_versions[name] = pv
+                    apply_versions(st.session_state.prompt_versions, thread_local=True)
+                    auto_save()
+        st.markdown("| 模板 | 字段 | 静态Token |\n|---|---|---:|\n" + "\n".join(
+            f"| {'**' + r['id'] + '**' if r['active'] else r['id']} | {', '.join(r['fields']) or '—'} | {r['static_tokens']} |"
+            for r in rows))
+        for fn, why in rejected_overrides().items():
+            st.caption(f"⚠️ {PROMPT_DIR}/{fn} 未载入：{why}")
+        urows = usage_rows(st.session_state.prompt_stats)
+        if urows:
+            lines = ["| Prompt标识 | 次数 | 均耗时s | Token/s | 均分 |", "|---|---:|---:|---:|---:|"]
+            for r in urows:
+                score = "—" if r["avg_score"] is None else f"{r['avg_score']:.1f}"
+                lines.append(f"| {r['id']} | {r['n']} | {r['avg_secs']:.1f} | {r['tok_per_sec']:.0f} | {score} |")
+            st.markdown("\n".join(lines))
+        st.caption("粗体为启用版本；在 prompt_templates/ 下放 名称@版本.txt 可增加版本做A/B")
 
     st.markdown("---")
     st.markdown('<div class="sidebar-group-title">🎯 模式</div>', unsafe_allow_html=True)
@@ -956,13 +933,42 @@ with st.sidebar:
     st.markdown('<div class="sidebar-group-title">💾 数据</div>', unsafe_allow_html=True)
     if st.button("📌 全局记忆", use_container_width=True, key="sb_me"):
         st.session_state["show_memory_modal"] = True
-    if st.session_state.episodes:
-        st.download_button("📦 导出全部", use_container_width=True, key="sb_ex",
-            data=json.dumps({"analysis": st.session_state.global_analysis,
-                "episodes": {str(k): v for k, v in st.session_state.episodes.items()},
-                "reviews": {str(k): v for k, v in st.session_state.review_results.items()},
-                "memory": st.session_state.memory}, ensure_ascii=False, indent=2),
-            file_name=f"剧本_{datetime.now().strftime('%m%d_%H%M')}.json", mime="application/json")
+    if st.session_state.chapters or st.session_state.episodes:
+        # 点击后才打包到磁盘，平时重跑不生成导出数据
+        if st.button("📦 打包导出", use_container_width=True, key="sb_ex", help="zip：每章/每集/每份质检一个文件 + manifest"):
+            try:
+                prefix = st.session_state.user or "项目"
+                path = export_path(prefix)
+                write_archive(project_snapshot(), path)
+                prune_exports(prefix)
+                st.session_state["_export_path"] = path
+            except Exception as e:
+                st.error(f"❌ 导出失败：{type(e).__name__}: {e}")
+        xp = st.session_state.get("_export_path")
+        if xp and os.path.exists(xp):
+            with open(xp, "rb") as f:
+                st.download_button(f"📥 下载 {os.path.basename(xp)}", f, os.path.basename(xp), "application/zip",
+                                   use_container_width=True, key="sb_exd")
+    ia = st.file_uploader("📂 导入项目", type=["zip"], key="sb_im", help="导入「打包导出」或 fenjin export 生成的归档，会替换当前项目")
+    if ia and f"{ia.name}:{ia.size}" not in st.session_state.setdefault("_imported_uploads", []):
+        try:
+            data = read_archive(ia)
+        except Exception as e:
+            st.error(f"❌ {ia.name}: {type(e).__name__}: {e}")
+        else:
+            for k in DERIVED_KEYS + JOB_KEYS:
+                st.session_state.pop(k, None)
+            for k, v in PROJECT_DEFAULTS.items():
+                st.session_state[k] = data.get(k, type(v)())
+            if not st.session_state.analysis_sections:
+                st.session_state.analysis_sections = parse_analysis(st.session_state.global_analysis)
+            if not st.session_state.opening_items:
+                st.session_state.opening_items = parse_openings(st.session_state.opening_designs)
+            st.session_state.episode_meta = {}
+            st.session_state["_memory_rev"] = st.session_state.get("_memory_rev", 0) + 1
+            st.session_state["_imported_uploads"].append(f"{ia.name}:{ia.size}")
+            auto_save()
+            st.success(f"✅ 已导入：{len(st.session_state.chapter_order)}章 · {len(st.session_state.episodes)}集")
 
     # 手动保存按钮
     if st.button("💾 手动保存", use_container_width=True, key="sb_sv"):
@@ -973,10 +979,17 @@ with st.sidebar:
     if st.button("🗑️ 重置", use_container_width=True, key="sb_rs"):
         if st.session_state.get("confirm_reset"):
             data_keys = ["chapters", "chapter_order", "current_step", "current_episode",
-                         "global_analysis", "opening_designs", "episodes", "review_results",
+                         "global_analysis", "analysis_sections", "opening_designs", "opening_items", "selected_opening",
+                         "episodes", "episode_meta", "review_results",
+                         "episode_alternates", "episode_history", "_chapter_stats", "_episode_totals",
                          "memory", "messages", "chat_history", "mode",
                          "selected_chapters_for_analysis", "confirm_reset",
-                         "_restore_attempted", "_just_restored"]
+                         "_restore_attempted", "_just_restored", "_imported_uploads",
+                         "_memory_jobs", "_memory_rev", "entity_index", "_scene_cache",
+                         "continuity_issues", "_ending_cache", "_format_cache",
+                         "batch_jobs", "_batch_futures", "_profile_history", "_export_path", "_screenplay_path",
+                         "build_inputs", "prompt_versions", "prompt_stats", "chat_summary", "_chat_index",
+                         "_chat_summary_job", "history_archive", "_tm_snapshot", "_tm_rows", "batch_runs", "_batch_panel"]
             for k in data_keys:
                 if k in st.session_state:
                     del st.session_state[k]
@@ -988,6 +1001,13 @@ with st.sidebar:
             st.warning("⚠️ 再次点击确认重置（所有数据将清除）")
             st.rerun()
 
+    st.markdown("---")
+    profiling = st.checkbox("⏱ 渲染计时", key="sb_prof", help="显示本次重跑各区段的耗时，用于对比优化前后")
+    prof_box = st.container()
+    diagnosing = st.checkbox("🩺 内存诊断", key="sb_diag", help="会话各项的内存占用、历史Token数、备份文件大小；可按需拍 tracemalloc 快照")
+    diag_box = st.container()
+timer.mark("侧边栏")
+
 # ============================================================
 # 顶部
 # ============================================================
@@ -999,8 +1019,9 @@ if st.session_state.get("_just_restored"):
     <span style="font-size:0.85rem;color:#276749;"><b>数据已自动恢复</b> — 检测到上次的工作数据，已自动载入。</span>
     </div>""", unsafe_allow_html=True)
     st.session_state["_just_restored"] = False
+for msg in st.session_state.pop("_flash", []):
+    st.success(msg)
 
-step_names = ["导入章节", "全局提炼", "开场设计", "生成剧本", "质检优化"]
 current = st.session_state.current_step
 st.markdown(f"""<div class="header-bar"><div class="header-left">
 <div class="header-title">🎬 影视化视觉翻译引擎 V3.2</div>
@@ -1011,7 +1032,7 @@ st.markdown(f"""<div class="header-bar"><div class="header-left">
 <span class="header-badge">🤖 {get_active_model()}</span></div></div>""", unsafe_allow_html=True)
 
 sh = ""
-for i, n in enumerate(step_names):
+for i, n in enumerate(STEP_NAMES):
     c = "done" if i < current else ("active" if i == current else "")
     ic = "✓" if i < current else str(i + 1)
     sh += f'<div class="step-item {c}"><span class="step-num">{ic}</span>{n}</div>'
@@ -1033,31 +1054,36 @@ if st.session_state.get("show_memory_modal"):
             st.session_state["show_memory_modal"] = False
             st.rerun()
 
+timer.mark("顶部")
+
 # ============================================================
 # 步骤一
 # ============================================================
 st.markdown("""<div class="card"><div class="card-header">
 <span class="card-icon">📖</span><span class="card-title">步骤一：导入小说章节</span>
-<span class="card-subtitle">.txt/.md 上传 或 粘贴</span></div></div>""", unsafe_allow_html=True)
+<span class="card-subtitle">.txt/.md 上传（自动分章） 或 粘贴</span></div></div>""", unsafe_allow_html=True)
 
 ca, cl = st.columns([1, 1])
 with ca:
     at = st.tabs(["📁 上传", "✍️ 粘贴"])
     with at[0]:
-        up = st.file_uploader("选择", type=["txt", "md", "text"], accept_multiple_files=True, key="up")
+        up = st.file_uploader("选择", type=["txt", "md", "text"], accept_multiple_files=True, key="up",
+                              help="整本小说可直接上传，自动识别编码（UTF-8/GBK/GB18030）并按「第X章」分章")
         if up:
+            imported = st.session_state.setdefault("_imported_uploads", [])
             for u in up:
-                if u.size > 200 * 1024:
-                    st.warning(f"⚠️ {u.name}>200KB")
+                uk = f"{u.name}:{u.size}"
+                if uk in imported:
                     continue
-                try:
-                    ct = u.read().decode("utf-8", errors="ignore")
-                except:
-                    ct = ""
                 cn = u.name.rsplit(".", 1)[0] if "." in u.name else u.name
-                if cn not in st.session_state.chapters and ct:
-                    add_chapter(cn, ct)
-                    st.success(f"✅ {cn} ({len(ct)}字)")
+                try:
+                    enc, added = import_novel_file(u, cn)
+                except Exception as e:
+                    st.error(f"❌ {u.name}: {type(e).__name__}: {e}")
+                    continue
+                imported.append(uk)
+                if added:
+                    st.success(f"✅ {cn}：{len(added)}章 · {sum(n for _, n in added):,}字 · {enc}")
     with at[1]:
         pn = st.text_input("名称", placeholder="第1章", key="pn")
         pc = st.text_area("内容", height=180, placeholder="粘贴...", key="pc")
@@ -1072,18 +1098,18 @@ with ca:
 with cl:
     st.markdown("**已导入**")
     if st.session_state.chapter_order:
-        tc = sum(len(st.session_state.chapters.get(c, "")) for c in st.session_state.chapter_order)
+        cs = chapter_stats()
         st.markdown(f"""<div class="stats-bar">
-<div class="stat-item"><div class="stat-value">{len(st.session_state.chapter_order)}</div><div class="stat-label">章节</div></div>
-<div class="stat-item"><div class="stat-value">{tc:,}</div><div class="stat-label">总字</div></div>
-<div class="stat-item"><div class="stat-value">{tc // max(len(st.session_state.chapter_order), 1):,}</div><div class="stat-label">均字</div></div>
+<div class="stat-item"><div class="stat-value">{cs["count"]}</div><div class="stat-label">章节</div></div>
+<div class="stat-item"><div class="stat-value">{cs["chars"]:,}</div><div class="stat-label">总字</div></div>
+<div class="stat-item"><div class="stat-value">{cs["chars"] // max(cs["count"], 1):,}</div><div class="stat-label">均字</div></div>
 </div>""", unsafe_allow_html=True)
-        for i, ch in enumerate(st.session_state.chapter_order):
-            ct = st.session_state.chapters.get(ch, "")
+        start, page = paginate(st.session_state.chapter_order, "ch_pg")
+        for i, ch in enumerate(page, start):
             c1, c2, c3 = st.columns([5, 1, 1])
             with c1:
                 st.markdown(f"""<div class="chapter-item"><div class="chapter-icon">{i + 1}</div>
-<div class="chapter-info"><div class="chapter-name">{ch}</div><div class="chapter-meta">{len(ct):,}字</div></div></div>""", unsafe_allow_html=True)
+<div class="chapter-info"><div class="chapter-name">{ch}</div><div class="chapter-meta">{chapter_length(ch):,}字</div></div></div>""", unsafe_allow_html=True)
             with c2:
                 if st.button("👁️", key=f"v{i}", help="看"):
                     st.session_state[f"e{i}"] = not st.session_state.get(f"e{i}", False)
@@ -1093,10 +1119,12 @@ with cl:
                     st.rerun()
             if st.session_state.get(f"e{i}"):
                 with st.expander(f"📖 {ch}", expanded=True):
-                    st.text_area("", ct, height=200, disabled=True, key=f"p{i}")
+                    st.text_area("", get_chapter_text(ch), height=200, disabled=True, key=f"p{i}")
     else:
         st.markdown("""<div class="empty-state"><div class="empty-icon">📚</div><div class="empty-text">暂无</div></div>""", unsafe_allow_html=True)
 
+timer.mark("步骤一")
+
 # ============================================================
 # 步骤二
 # ============================================================
@@ -1110,14 +1138,17 @@ with s2a:
         sc = st.multiselect("选择章节", st.session_state.chapter_order, default=st.session_state.chapter_order, key="sc", label_visibility="collapsed")
         st.session_state.selected_chapters_for_analysis = sc
         if sc:
-            st.info(f"📊 {len(sc)}章 · {sum(len(st.session_state.chapters.get(c, '')) for c in sc):,}字")
+            st.info(f"📊 {len(sc)}章 · {sum(chapter_length(c) for c in sc):,}字")
+        structured = st.checkbox("🧩 结构化提炼（JSON）", key="sa_js",
+                                 help="按七个部分输出JSON并分别存储；后续开场/生成/优化只带各自需要的部分，提示词更短")
         b1, b2 = st.columns(2)
         with b1:
-            da = st.button("🚀 提炼", key="da", use_container_width=True, type="primary", disabled=not (sc and st.session_state.api_key))
+            da = st.button("🚀 提炼", key="da", use_container_width=True, type="primary", disabled=not (sc and get_api_key()))
         with b2:
             if st.session_state.global_analysis:
                 if st.button("🔄 重做", key="rd", use_container_width=True):
                     st.session_state.global_analysis = ""
+                    st.session_state.analysis_sections = {}
                     st.rerun()
     else:
         st.info("💡 先导入")
@@ -1127,25 +1158,37 @@ with s2b:
     st.markdown("**结果**")
     if da:
         t = get_combined_text(sc)
-        ms = [{"role": "user", "content": build_analysis_prompt(t)}]
+        ms = [{"role": "user", "content": build_analysis_prompt(t, structured)}]
         with st.spinner("🧠 分析中..."):
+            t0 = time.perf_counter()
             r = call_api_streaming(ms)
             if r:
                 co = st.empty()
                 f = stream_to_container(r, co)
                 if f:
-                    st.session_state.global_analysis = f
-                    st.session_state.messages = ms + [{"role": "assistant", "content": f}]
+                    note_prompt_use("analysis_json" if structured else "analysis", t0, f, scored=False)
+                    text = store_analysis(st.session_state, f)
+                    if text != f:
+                        co.markdown(text)
+                    st.session_state.messages = ms + [{"role": "assistant", "content": text}]
                     st.session_state.current_step = max(st.session_state.current_step, 1)
+                    record_analysis(st.session_state, sc, get_active_model(), structured)
                     auto_save()
                     st.success("✅ 完成！")
+                    if structured and not st.session_state.analysis_sections:
+                        st.warning("⚠️ 未能解析出JSON各部分，已按原文保存，后续调用仍带完整提炼")
     elif st.session_state.global_analysis:
         with st.expander("📋 查看", expanded=False):
             st.markdown(st.session_state.global_analysis)
+        parts = st.session_state.analysis_sections
         st.markdown('<span class="tag tag-green">✅ 完成</span>', unsafe_allow_html=True)
+        if parts:
+            st.caption(f"已拆分 {len(parts)}/{len(ANALYSIS_SECTIONS)} 部分：" + "、".join(t for k, t in ANALYSIS_SECTIONS if k in parts))
     else:
         st.markdown("""<div class="empty-state"><div class="empty-icon">🔍</div><div class="empty-text">等待</div></div>""", unsafe_allow_html=True)
 
+timer.mark("步骤二")
+
 # ============================================================
 # 步骤三
 # ============================================================
@@ -1174,22 +1217,37 @@ with st.expander("🔗 上集衔接（可选）", expanded=False):
         st.info(f"✅ 已自动提取第{st.session_state.memory.get('progress', '?')}集末尾分镜")
 
     prev_ending = st.text_area(
-        "上集末尾内容（最后1-3个分镜）",
+        "上集末尾内容（按预算自动选取的结尾分镜）",
         value=auto_ending,
         height=150,
-        key="prev_ending_input",
+        key=f"prev_ending_input_{st.session_state.get('_memory_rev', 0)}",
         help="粘贴上一集最后的分镜内容，AI会据此衔接。留空=第一集或新篇章开始",
         placeholder="留空表示不需要衔接（第一集或新篇章）\n\n或粘贴上一集最后的分镜内容，例如：\n【分镜11】（实算12.5s）\n场景：衣柜内外 · 傍晚...\n秦洛（咬牙切齿）：\"啧！你一个丧尸卖什么萌啊？\"\n..."
     )
 
+    eb1, eb2 = st.columns([2, 1])
+    with eb1:
+        st.session_state.ending_budget = st.slider("衔接Token预算", 300, 4000, st.session_state.get("ending_budget", ENDING_TOKEN_BUDGET), 100,
+                                                   key="sb_eb", help="从上集结尾往前取分镜，直到用完预算")
+    with eb2:
+        st.session_state.ending_summary = st.checkbox("前段压缩为一行概要", value=st.session_state.get("ending_summary", True), key="sb_es")
+
     if st.button("🗑️ 清空衔接", key="clear_prev", help="清空表示新篇章开始"):
-        st.session_state.memory["last_ending"] = ""
+        update_memory(last_ending="")
         auto_save()
         st.rerun()
 
 # ============================================================
 # 功能按钮
 # ============================================================
+g1, g2, _ = st.columns([1, 1, 3])
+with g1:
+    best_of = st.number_input("候选数（best of N）", 1, len(CANDIDATE_VARIANTS), 1, key="bo_n",
+                              help=">1 时并发生成多个候选，本地评分择优，其余保留为备选")
+with g2:
+    st.markdown("<br>", unsafe_allow_html=True)
+    use_judge = st.checkbox("LLM评审择优", key="bo_j", disabled=best_of <= 1, help="额外一次非流式调用，让模型在候选中选最佳")
+
 bc = st.columns(7)
 bd = [("🎯", "设计开场"), ("🎬", "生成剧本"), ("🔍", "质量检查"), ("💬", "优化台词"), ("🎨", "优化画面"), ("❤️", "优化情绪"), ("📦", "批量生成")]
 bt = {}
@@ -1197,6 +1255,8 @@ for i, (ic, lb) in enumerate(bd):
     with bc[i]:
         bt[lb] = st.button(f"{ic} {lb}", key=f"b_{lb}", use_container_width=True, type="primary" if lb == "生成剧本" else "secondary")
 
+timer.mark("步骤三")
+
 # ============================================================
 # 主Tabs
 # ============================================================
@@ -1207,18 +1267,38 @@ with mt[0]:
         if not ad:
             st.warning("⚠️ 先提炼")
         else:
-            ms = st.session_state.messages + [{"role": "user", "content": build_opening_prompt()}]
-            with st.spinner("🎯..."):
-                r = call_api_streaming(ms)
-                if r:
-                    co = st.empty()
-                    f = stream_to_container(r, co)
+            ctx = analysis_context(st.session_state, "openings")
+            if not get_api_key():
+                st.error("❌ 请先配置 API Key")
+            else:
+                # 六条方案各一次短调用并发生成，只带全局提炼（不带后续的对话历史）
+                items = []
+                pg = st.progress(0.0, text=f"🎯 并发设计{OPENING_COUNT}条开场方案...")
+                t0 = time.perf_counter()
+                for (n, style), fut in generate_openings(get_api_config(), ctx):
+                    try:
+                        f = fut.result()
+                    except QuotaExceeded as ex:
+                        st.error(f"❌ {ex}")
+                        f = None
+                    except Exception as ex:
+                        st.warning(f"⚠️ 方案{n}失败：{type(ex).__name__}: {ex}")
+                        f = None
                     if f:
-                        st.session_state.opening_designs = f
-                        st.session_state.messages = ms + [{"role": "assistant", "content": f}]
-                        st.session_state.current_step = max(st.session_state.current_step, 2)
-                        auto_save()
-                        st.success("✅")
+                        note_prompt_use("opening_one", t0, f, scored=False)
+                        items.append(make_item(n, style, f))
+                    pg.progress(min(1.0, (len(items) + 0.001) / OPENING_COUNT), text=f"🎯 已完成 {len(items)}/{OPENING_COUNT}")
+                pg.empty()
+                if items:
+                    items.sort(key=lambda it: it["n"])
+                    f = store_openings(st.session_state, items)
+                    # 对话历史只追加一轮开场：前两条仍是真实的全局提炼（ctx 只是裁剪过的提炼上下文）
+                    st.session_state.messages = st.session_state.messages + [
+                        {"role": "user", "content": build_opening_prompt()}, {"role": "assistant", "content": f}]
+                    st.session_state.current_step = max(st.session_state.current_step, 2)
+                    record_openings(st.session_state, get_active_model(), parallel=True)
+                    auto_save()
+                    st.success(f"✅ {len(items)}条方案，到「🎯 开场」选择")
 
     if bt["生成剧本"]:
         if not ad:
@@ -1227,76 +1307,186 @@ with mt[0]:
             tx = get_combined_text(ec if ec else None)
             op = st.session_state.get("selected_opening", "")
             pe = prev_ending if prev_ending else ""
-            pr = build_episode_prompt(en, tx, op, pe)
-            cx = st.session_state.messages + [{"role": "user", "content": pr}]
-            with st.spinner(f"🎬 第{en}集..."):
-                r = call_api_streaming(cx)
-                if r:
-                    co = st.empty()
-                    f = stream_to_container(r, co)
-                    if f:
-                        st.session_state.episodes[en] = f
-                        st.session_state.messages = cx + [{"role": "assistant", "content": f}]
-                        st.session_state.current_step = max(st.session_state.current_step, 3)
-                        st.session_state.memory["progress"] = str(en)
-                        last_scenes = extract_last_scenes(f, n=2)
-                        if last_scenes:
-                            st.session_state.memory["last_ending"] = last_scenes
-                        auto_save()
-                        st.success(f"✅ 第{en}集完成！")
+            pr = build_episode_prompt(en, tx, op, pe, st.session_state.memory)
+            cx = episode_context() + [{"role": "user", "content": pr}]
+            if best_of > 1:
+                if not get_api_key():
+                    st.error("❌ 请先配置 API Key")
+                else:
+                    cands = []
+                    pg = st.progress(0.0, text=f"🎲 第{en}集：并发生成{best_of}个候选...")
+                    t0 = time.perf_counter()
+                    for (_, temp, hint), fut in generate_candidates(get_api_config(), cx, best_of):
+                        try:
+                            f = fut.result()
+                        except Exception as ex:
+                            st.warning(f"⚠️ 候选失败：{type(ex).__name__}: {ex}")
+                            f = None
+                        if f:
+                            # 候选同时发出，完成时刻即各自的耗时
+                            note_prompt_use("episode", t0, f)
+                            cands.append({"text": f, "temperature": temp, "hint": hint, "score": score_script(f)})
+                        pg.progress(min(1.0, (len(cands) + 0.001) / best_of), text=f"🎲 已完成 {len(cands)}/{best_of}")
+                    if cands:
+                        cands.sort(key=lambda c: -c["score"]["score"])
+                        wi = None
+                        if use_judge and len(cands) > 1:
+                            try:
+                                wi = judge_candidates(get_api_config(), en, cands, st.session_state.prompt_stats)
+                            except Exception as ex:
+                                st.error(f"❌ {type(ex).__name__}: {ex}")
+                        winner = cands.pop(wi or 0)
+                        st.session_state.episode_alternates[en] = cands
+                        commit_episode(en, winner["text"], cx, f"生成（{best_of}选1）", ec, op, bool(pe))
+                        st.success(f"✅ 第{en}集完成！胜出候选评分{winner['score']['score']}"
+                                   f"{'（LLM评审选出）' if wi is not None else ''}，保留{len(cands)}个备选")
                     else:
                         st.warning("⚠️ 空")
+            else:
+                with st.spinner(f"🎬 第{en}集..."):
+                    t0 = time.perf_counter()
+                    r = call_api_streaming(cx)
+                    if r:
+                        co = st.empty()
+                        f = stream_to_container(r, co)
+                        if f:
+                            note_prompt_use("episode", t0, f)
+                            commit_episode(en, f, cx, "生成", ec, op, bool(pe))
+                            st.success(f"✅ 第{en}集完成！")
+                        else:
+                            st.warning("⚠️ 空")
 
     if bt["批量生成"]:
+        st.session_state["_batch_panel"] = True
+    if st.session_state.get("_batch_panel"):
         if not ad:
             st.warning("⚠️")
         else:
-            b1, b2 = st.columns(2)
+            runs = st.session_state.batch_runs
+            last = runs[-1] if runs else None
+            b1, b2, b3, b4 = st.columns([2, 2, 2, 1])
             with b1:
                 bs = st.number_input("起始", 1, 200, en, key="bs")
             with b2:
                 be = st.number_input("结束", 1, 200, min(en + 2, 200), key="be")
-            if st.button("🚀 开始", key="bg", type="primary"):
-                tx = get_combined_text(ec if ec else None)
-                for e in range(int(bs), int(be) + 1):
-                    st.markdown(f"---\n### 🎬 第{e}集")
-                    pe = st.session_state.memory.get("last_ending", "")
-                    cx = st.session_state.messages + [{"role": "user", "content": build_episode_prompt(e, tx, prev_ending=pe)}]
-                    r = call_api_streaming(cx)
-                    if r:
-                        co = st.empty()
-                        f = stream_to_container(r, co)
-                        if f:
-                            st.session_state.episodes[e] = f
-                            st.session_state.messages = cx + [{"role": "assistant", "content": f}]
-                            st.session_state.memory["progress"] = str(e)
-                            last_scenes = extract_last_scenes(f, n=2)
-                            if last_scenes:
-                                st.session_state.memory["last_ending"] = last_scenes
-                            auto_save()
-                            st.success(f"✅ 第{e}集")
-                        else:
-                            st.warning(f"⚠️ 第{e}集空")
-                            break
+            with b3:
+                st.markdown("<br>", unsafe_allow_html=True)
+                go = st.button("🚀 开始", key="bg", type="primary", use_container_width=True)
+            with b4:
+                st.markdown("<br>", unsafe_allow_html=True)
+                if st.button("✖", key="bg_x", help="收起批量生成"):
+                    st.session_state.pop("_batch_panel", None)
+                    st.rerun()
+            resume = False
+            if last:
+                rs = run_summary(last)
+                state = {"done": "已完成", "partial": "有未完成的集", "running": "已中断"}[last["status"]]
+                st.caption(f"📋 清单 {last['id']}：第{last['episodes'][0]}-{last['episodes'][-1]}集 · {state} · "
+                           f"完成{rs['done']}/{rs['total']} · 失败{rs['failed']} · 均耗时{rs['avg']:.0f}s · 更新于{last['updated']}")
+                for fe, fi in sorted(last["failed"].items(), key=lambda x: int(x[0])):
+                    st.caption(f"　❌ 第{fe}集：{fi['error']}（尝试{fi['attempts']}次，{fi['at']}）")
+                if rs["left"]:
+                    resume = st.button(f"▶️ 续跑剩余{rs['left']}集（跳过已完成）", key="bg_r")
+            if go and be < bs:
+                st.warning("⚠️ 结束集不能小于起始集")
+            elif go or resume:
+                run_batch(add_run(runs, new_run(range(int(bs), int(be) + 1), ec, get_active_model())) if go else last)
+                # 刷新一次，让清单摘要和续跑按钮反映本轮结果
+                st.rerun()
+
+    with st.expander("🌙 离线批处理（Batch API · 非流式）", expanded=False):
+        st.caption("把多集剧本或质检打包成 Batch JSONL 一次提交，适合夜间长批次；批内各集互不衔接，只引用已生成集的结尾")
+        j1, j2, j3, j4 = st.columns(4)
+        with j1:
+            bk = st.radio("类型", ["剧本", "质检"], key="bj_k", horizontal=True)
+        with j2:
+            bjs = st.number_input("起始集", 1, 200, en, key="bj_s")
+        with j3:
+            bje = st.number_input("结束集", 1, 200, min(en + 9, 200), key="bj_e")
+        with j4:
+            bm = st.radio("方式", ["本地模拟", "Batch API"], key="bj_m", horizontal=True,
+                          help="本地模拟：按Batch格式在后台逐条调用接口；Batch API：提交到 /files + /batches")
+        j5, j6 = st.columns([3, 1])
+        with j5:
+            bbase = st.text_input("Batch接口地址", key="bj_b", placeholder="留空＝与接口地址相同")
+        with j6:
+            bcc = st.number_input("本地并发", 1, 16, 4, key="bj_c")
+        if st.button("📤 生成并提交", key="bj_go", disabled=not (get_api_key() and (ad or bk == "质检"))):
+            reqs, prev_used = build_batch_job("episode" if bk == "剧本" else "review", int(bjs), int(bje), get_combined_text(ec if ec else None))
+            if not reqs:
+                st.warning("⚠️ 范围内没有可处理的集")
+            else:
+                jid = datetime.now().strftime("%m%d_%H%M%S")
+                job = {"id": jid, "kind": "episode" if bk == "剧本" else "review", "range": [int(bjs), int(bje)],
+                       "mode": bm, "input_path": write_batch_file(reqs, jid),
+                       "output_path": os.path.join(BATCH_DIR, f"{jid}_output.jsonl"),
+                       "status": "running", "count": len(reqs), "created": datetime.now().strftime("%m-%d %H:%M"),
+                       "chapters": ec or [], "model": (st.session_state.review_model if bk != "剧本" else None) or get_active_model(),
+                       "prev_used": prev_used, "opening": st.session_state.get("selected_opening", "") if bk == "剧本" else ""}
+                cfg = get_api_config()
+                if bbase.strip():
+                    cfg["api_base"] = bbase.strip().rstrip("/")
+                try:
+                    if bm == "本地模拟":
+                        fut = get_background_executor().submit(run_local_batch, cfg, job["input_path"], job["output_path"], int(bcc))
+                        st.session_state.setdefault("_batch_futures", {})[jid] = fut
                     else:
-                        st.error(f"❌ 第{e}集失败")
-                        break
+                        job["batch_id"] = submit_remote_batch(cfg, job["input_path"])["id"]
+                        job["api_base"] = cfg["api_base"]
+                    st.session_state.batch_jobs.append(job)
+                    auto_save()
+                    st.success(f"✅ 已提交 {len(reqs)} 条请求（任务 {jid}）")
+                except Exception as ex:
+                    st.error(f"❌ 提交失败：{type(ex).__name__}: {ex}")
+        refresh_batch_jobs()
+        for job in reversed(st.session_state.batch_jobs[-10:]):
+            q1, q2, q3 = st.columns([4, 1, 1])
+            with q1:
+                st.markdown(f"`{job['id']}` · {'剧本' if job['kind'] == 'episode' else '质检'} 第{job['range'][0]}-{job['range'][1]}集 · "
+                            f"{job['count']}条 · {job['mode']} · **{job['status']}**"
+                            + (f" · ✅{job['counts']['completed']} ❌{job['counts']['failed']}" if job.get("counts") else "")
+                            + (f" · {job['error']}" if job.get("error") else ""))
+            with q2:
+                if job["mode"] == "Batch API" and job["status"] == "running" and st.button("🔄 查询", key=f"bjq{job['id']}"):
+                    try:
+                        cfg = {**get_api_config(), "api_base": job["api_base"]}
+                        info = poll_remote_batch(cfg, job["batch_id"])
+                        rc = info.get("request_counts") or {}
+                        job["counts"] = {"completed": rc.get("completed", 0), "failed": rc.get("failed", 0), "total": rc.get("total", 0)}
+                        if info.get("status") == "completed" and info.get("output_file_id"):
+                            download_remote_output(cfg, info["output_file_id"], job["output_path"])
+                            job["status"] = "completed"
+                        elif info.get("status") in ("failed", "expired", "cancelled"):
+                            job["status"] = "failed"
+                            job["error"] = info.get("status")
+                        auto_save()
+                        st.rerun()
+                    except Exception as ex:
+                        st.error(f"❌ {type(ex).__name__}: {ex}")
+            with q3:
+                if job["status"] == "completed" and st.button("📥 导入", key=f"bji{job['id']}"):
+                    got, errors = ingest_batch_output(job)
+                    st.success(f"✅ 导入{len(got)}条")
+                    for er in errors[:5]:
+                        st.warning(f"⚠️ {er}")
 
     if bt["优化台词"]:
         if en in st.session_state.episodes:
-            pr = build_dialogue_optimization_prompt(en, st.session_state.episodes[en], st.session_state.global_analysis)
-            ms = st.session_state.messages + [{"role": "user", "content": pr}]
+            pr = build_dialogue_optimization_prompt(en, st.session_state.episodes[en], select_character_cards(st.session_state.episodes[en]))
+            ms = analysis_context(st.session_state, "dialogue") + st.session_state.messages[2:] + [{"role": "user", "content": pr}]
             with st.spinner("💬 角色DNA台词优化..."):
+                t0 = time.perf_counter()
                 r = call_api_streaming(ms)
                 if r:
                     co = st.empty()
                     f = stream_to_container(r, co)
                     if f:
-                        st.session_state.episodes[en] = f
+                        note_prompt_use("dialogue", t0, f)
+                        set_episode(en, f, "台词优化")
                         st.session_state.messages = ms + [{"role": "assistant", "content": f}]
-                        last_scenes = extract_last_scenes(f, n=2)
+                        last_scenes = ending_context(f, episode_stats(en)["hash"])
                         if last_scenes:
-                            st.session_state.memory["last_ending"] = last_scenes
+                            update_memory(last_ending=last_scenes)
                         auto_save()
                         st.success("✅ 台词优化完成（角色DNA驱动）")
         else:
@@ -1305,18 +1495,20 @@ with mt[0]:
     if bt["优化画面"]:
         if en in st.session_state.episodes:
             pr = build_visual_optimization_prompt(en, st.session_state.episodes[en])
-            ms = st.session_state.messages + [{"role": "user", "content": pr}]
+            ms = analysis_context(st.session_state, "visual") + st.session_state.messages[2:] + [{"role": "user", "content": pr}]
             with st.spinner("🎨..."):
+                t0 = time.perf_counter()
                 r = call_api_streaming(ms)
                 if r:
                     co = st.empty()
                     f = stream_to_container(r, co)
                     if f:
-                        st.session_state.episodes[en] = f
+                        note_prompt_use("visual", t0, f)
+                        set_episode(en, f, "画面优化")
                         st.session_state.messages = ms + [{"role": "assistant", "content": f}]
-                        last_scenes = extract_last_scenes(f, n=2)
+                        last_scenes = ending_context(f, episode_stats(en)["hash"])
                         if last_scenes:
-                            st.session_state.memory["last_ending"] = last_scenes
+                            update_memory(last_ending=last_scenes)
                         auto_save()
                         st.success("✅ 画面优化完成")
         else:
@@ -1325,18 +1517,20 @@ with mt[0]:
     if bt["优化情绪"]:
         if en in st.session_state.episodes:
             pr = build_emotion_optimization_prompt(en, st.session_state.episodes[en])
-            ms = st.session_state.messages + [{"role": "user", "content": pr}]
+            ms = analysis_context(st.session_state, "emotion") + st.session_state.messages[2:] + [{"role": "user", "content": pr}]
             with st.spinner("❤️..."):
+                t0 = time.perf_counter()
                 r = call_api_streaming(ms)
                 if r:
                     co = st.empty()
                     f = stream_to_container(r, co)
                     if f:
-                        st.session_state.episodes[en] = f
+                        note_prompt_use("emotion", t0, f)
+                        set_episode(en, f, "情绪优化")
                         st.session_state.messages = ms + [{"role": "assistant", "content": f}]
-                        last_scenes = extract_last_scenes(f, n=2)
+                        last_scenes = ending_context(f, episode_stats(en)["hash"])
                         if last_scenes:
-                            st.session_state.memory["last_ending"] = last_scenes
+                            update_memory(last_ending=last_scenes)
                         auto_save()
                         st.success("✅ 情绪优化完成")
         else:
@@ -1345,48 +1539,280 @@ with mt[0]:
     st.markdown("---")
     if st.session_state.episodes:
         st.markdown("### 📜 已生成剧本")
+        # 只渲染选中的一集（含下载内容），重跑耗时与总集数无关
         se = sorted(st.session_state.episodes.keys())
-        et = st.tabs([f"第{e}集" for e in se])
-        for ix, e in enumerate(se):
-            with et[ix]:
-                s = st.session_state.episodes[e]
-                sh = len(re.findall(r'【分镜\s*\d+】', s))
-                m1, m2, m3, m4 = st.columns(4)
-                m1.metric("分镜", sh or "—")
-                m2.metric("时长", f"~{sh * 12}s" if sh else "—")
-                m3.metric("字数", f"{len(s):,}")
-                m4.metric("质检", "✅" if e in st.session_state.review_results else "⏳")
-                st.markdown(s)
-                d1, d2 = st.columns(2)
-                with d1:
-                    st.download_button(f"📥 导出", s, f"第{e}集.md", "text/markdown", key=f"dl{e}")
-                with d2:
-                    st.download_button("📋 纯文本", s, f"第{e}集_纯文本.txt", "text/plain", key=f"cd{e}")
+        e = st.selectbox("选择集数", se, index=se.index(en) if en in se else len(se) - 1,
+                         format_func=lambda x: f"第{x}集 · {episode_stats(x)['shots']}镜")
+        s = st.session_state.episodes[e]
+        est = episode_stats(e)
+        sh = est["shots"]
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("分镜", sh or "—")
+        m2.metric("时长", f"~{sh * 12}s" if sh else "—")
+        m3.metric("字数", f"{est['chars']:,}")
+        m4.metric("质检", "✅" if e in st.session_state.review_results else "⏳")
+        fi = format_issues(e)
+        if fi:
+            with st.expander(f"🩺 格式问题（{len(fi)}）", expanded=False):
+                for i in fi[:50]:
+                    st.markdown(f"- **分镜{i['shot']}** · {i['msg']}" + (f"：`{i['line'][:60]}`" if i["line"] else ""))
+                if len(fi) > 50:
+                    st.caption(f"……另有{len(fi) - 50}条")
+                if st.button("🩹 定向修复", key=f"ff{e}", help="只把有问题的分镜发给模型修正，再拼回原剧本"):
+                    with st.spinner("🩹..."):
+                        t0 = time.perf_counter()
+                        r = call_api_streaming([{"role": "user", "content": build_format_fix_prompt(e, s, fi)}])
+                        if r:
+                            f = stream_to_container(r, st.empty())
+                            note_prompt_use("format_fix", t0, f, scored=False)
+                            bad = format_fix_shots(fi)
+                            fixed = {sc["num"]: sc["text"] for sc in parse_scenes(f) if sc["num"] in bad}
+                            if fixed:
+                                set_episode(e, splice_scenes(s, fixed), "格式修复")
+                                if e == max(st.session_state.episodes):
+                                    update_memory(last_ending=ending_context(st.session_state.episodes[e], episode_stats(e)["hash"]))
+                                auto_save()
+                                flash(f"✅ 第{e}集已修正{len(fixed)}个分镜，剩余问题{len(format_issues(e))}条")
+                                st.rerun()
+                            else:
+                                st.warning("⚠️ 未解析到分镜")
+        else:
+            st.caption("🩺 格式检查通过")
+        st.markdown(s)
+        d1, d2 = st.columns(2)
+        with d1:
+            st.download_button(f"📥 导出", s, f"第{e}集.md", "text/markdown", key="dl_ep")
+        with d2:
+            st.download_button("📋 纯文本", s, f"第{e}集_纯文本.txt", "text/plain", key="cd_ep")
+        with st.expander("🎞 剧本格式导出（Fountain / FDX / DOCX / 分镜表）", expanded=False):
+            x1, x2, x3 = st.columns([2, 2, 1])
+            with x1:
+                xf = st.selectbox("格式", list(EXPORT_FORMATS), format_func=lambda k: EXPORT_FORMATS[k][0], key="sp_f")
+            with x2:
+                xs = st.radio("范围", [f"第{e}集", f"全部{len(se)}集"], key="sp_s", horizontal=True)
+            with x3:
+                st.markdown("<br>", unsafe_allow_html=True)
+                xgo = st.button("🎞 生成", key="sp_go", use_container_width=True)
+            if xgo:
+                eps = [e] if xs.startswith("第") else se
+                name = f"第{e}集" if len(eps) == 1 else f"第{eps[0]}-{eps[-1]}集"
+                path = os.path.join(EXPORT_DIR, f"{name}{EXPORT_FORMATS[xf][1]}")
+                try:
+                    export_series(xf, ((k, st.session_state.episodes[k]) for k in eps), path, name,
+                                  get_entity_index()["characters"])
+                    st.session_state["_screenplay_path"] = (path, xf)
+                except Exception as ex:
+                    st.error(f"❌ 导出失败：{type(ex).__name__}: {ex}")
+            xp = st.session_state.get("_screenplay_path")
+            if xp and os.path.exists(xp[0]):
+                with open(xp[0], "rb") as f:
+                    st.download_button(f"📥 {os.path.basename(xp[0])}", f, os.path.basename(xp[0]),
+                                       EXPORT_FORMATS[xp[1]][2], key="sp_dl")
+        alts = st.session_state.episode_alternates.get(e)
+        if alts:
+            with st.expander(f"🎲 备选版本（{len(alts)}）", expanded=False):
+                for ai, alt in enumerate(alts):
+                    sc_ = alt["score"]
+                    a1, a2 = st.columns([5, 1])
+                    with a1:
+                        st.markdown(f"**备选{ai + 1}** · 评分{sc_['score']} · {sc_['shots']}镜 · 嵌入率{sc_['embed']:.0%} · "
+                                    f"~{sc_['duration']}s" + (f" · 温度{alt['temperature']}" if alt.get("temperature") is not None else "") + f" {alt['hint']}")
+                    with a2:
+                        if st.button("采用", key=f"alt{e}_{ai}"):
+                            alts[ai] = {"text": s, "temperature": None, "hint": "（原版本）", "score": score_script(s)}
+                            replace_episode(e, alt["text"], f"采用备选{ai + 1}")
+                            st.rerun()
+                    if st.checkbox("预览", key=f"altv{e}_{ai}"):
+                        st.markdown(alt["text"])
+        ep_versions = st.session_state.episode_history.get(e, [])
+        if len(ep_versions) > 1:
+            with st.expander(f"🕘 版本历史（{len(ep_versions)}）", expanded=False):
+                cur = est["hash"]
+                labels = [f"v{i + 1} · {v['time']} · {v['source']} · {v['chars']:,}字" + (" · 当前" if v["hash"] == cur else "")
+                          for i, v in enumerate(ep_versions)]
+                h1, h2 = st.columns(2)
+                with h1:
+                    va = st.selectbox("旧版本", range(len(ep_versions)), index=max(0, len(ep_versions) - 2),
+                                      format_func=lambda i: labels[i], key=f"vh_a{e}")
+                with h2:
+                    vb = st.selectbox("新版本", range(len(ep_versions)), index=len(ep_versions) - 1,
+                                      format_func=lambda i: labels[i], key=f"vh_b{e}")
+                try:
+                    ta, tb = version_text(ep_versions[va]), version_text(ep_versions[vb])
+                except Exception as ex:
+                    st.error(f"❌ 版本读取失败：{type(ex).__name__}: {ex}")
+                else:
+                    add, rem = diff_stats(ta, tb)
+                    st.caption(f"v{va + 1} → v{vb + 1}：+{add} 行 / -{rem} 行")
+                    if ta != tb:
+                        st.markdown(f'<div class="diff-wrap">{diff_html(ta, tb, f"v{va + 1}", f"v{vb + 1}")}</div>',
+                                    unsafe_allow_html=True)
+                    if ep_versions[va]["hash"] != cur and st.button(f"↩️ 回滚到 v{va + 1}", key=f"vh_rb{e}"):
+                        replace_episode(e, ta, f"回滚至v{va + 1}")
+                        st.rerun()
     else:
         st.markdown("""<div class="empty-state"><div class="empty-icon">🎬</div><div class="empty-text">尚未生成</div></div>""", unsafe_allow_html=True)
 
+timer.mark("剧本")
+
+def run_review(ep, tx):
+    """流式质检一集并保存结果"""
+    sc_text = st.session_state.episodes[ep]
+    pe = ending_context(st.session_state.episodes[ep - 1], episode_stats(ep - 1)["hash"]) if ep - 1 in st.session_state.episodes else ""
+    rm = [{"role": "user", "content": build_review_prompt(ep, sc_text, tx, select_character_cards(sc_text), pe)}]
+    og = st.session_state.model_id
+    if st.session_state.review_model:
+        st.session_state.model_id = st.session_state.review_model
+    try:
+        with st.spinner(f"🔍 质检第{ep}集..."):
+            t0 = time.perf_counter()
+            r = call_api_streaming(rm, REVIEW_SYSTEM_PROMPT)
+            if r:
+                co = st.empty()
+                f = stream_to_container(r, co)
+                if f:
+                    note_prompt_use("review", t0, f, scored=False)
+                    st.session_state.review_results[ep] = f
+                    st.session_state.current_step = max(st.session_state.current_step, 4)
+                    record_review(st.session_state, ep, get_active_model())
+                    auto_save()
+                    st.success(f"✅ 第{ep}集质检完成")
+                    return True
+    finally:
+        st.session_state.model_id = og
+    return False
+
+def rebuild_stale_ui(stale, workers):
+    """只重建过期项（与命令行 fenjin rebuild 相同）：接口调用在线程池里并行，写回都在脚本线程里完成"""
+    inputs = st.session_state.build_inputs
+    cfg = get_api_config()
+    rcfg = get_api_config(st.session_state.review_model)
+
+    def names_of(node):
+        return [n for n in inputs[node].get("chapters", {}) if n in st.session_state.chapters]
+
+    def prepare(node):
+        kind, ep = split_node(node)
+        if kind == "analysis":
+            names = names_of(node)
+            if not names:
+                raise RuntimeError("参与提炼的章节已全部删除")
+            ms = [{"role": "user", "content": build_analysis_prompt(get_combined_text(names), inputs[node].get("structured"))}]
+            return lambda: (stream_completion(cfg, ms, SYSTEM_PROMPT), ms)
+        if kind == "openings":
+            ctx = analysis_context(st.session_state, "openings")
+            if inputs[node].get("parallel"):
+                return lambda: (design_openings(cfg, ctx), None)
+            ms = ctx + [{"role": "user", "content": build_opening_prompt()}]
+            return lambda: (stream_completion(cfg, ms, SYSTEM_PROMPT), None)
+        if kind == "episode":
+            inp = inputs[node]
+            op = st.session_state.get("selected_opening", "") if inp.get("opening") else ""
+            eps = st.session_state.episodes
+            pe = ending_context(eps[ep - 1], episode_stats(ep - 1)["hash"]) if inp.get("prev") and ep - 1 in eps else ""
+            pr = build_episode_prompt(ep, get_combined_text(names_of(node) or None), op, pe, st.session_state.memory)
+            cx = episode_context() + [{"role": "user", "content": pr}]
+            return lambda: (stream_completion(cfg, cx, SYSTEM_PROMPT), (cx, op))
+        sc_text = st.session_state.episodes[ep]
+        pe = ending_context(st.session_state.episodes[ep - 1], episode_stats(ep - 1)["hash"]) if ep - 1 in st.session_state.episodes else ""
+        rm = [{"role": "user", "content": build_review_prompt(ep, sc_text, get_combined_text(), select_character_cards(sc_text), pe)}]
+        return lambda: (stream_completion(rcfg, rm, REVIEW_SYSTEM_PROMPT), None)
+
+    def commit(node, out):
+        text, ctx = out
+        if not text:
+            raise RuntimeError("返回为空")
+        kind, ep = split_node(node)
+        if kind == "analysis":
+            text = store_analysis(st.session_state, text)
+            st.session_state.messages = ctx + [{"role": "assistant", "content": text}]
+            record_analysis(st.session_state, names_of(node), cfg["model"], inputs[node].get("structured"))
+        elif kind == "openings":
+            if inputs[node].get("parallel"):
+                store_openings(st.session_state, text)
+            else:
+                store_opening_text(st.session_state, text)
+            record_openings(st.session_state, cfg["model"], inputs[node].get("parallel"))
+        elif kind == "episode":
+            cx, op = ctx
+            commit_episode(ep, text, cx, "重建", names_of(node) or None, op, bool(inputs[node].get("prev")))
+        else:
+            st.session_state.review_results[ep] = text
+            record_review(st.session_state, ep, rcfg["model"])
+        auto_save()
+
+    with st.status(f"♻️ 重建{len(stale)}项...", expanded=True) as box:
+        res = rebuild(list(stale), lambda n: upstream(n, inputs[n]), prepare, commit, workers, log=box.write)
+        box.update(label=f"♻️ 重建{len(res['done'])}项，失败{len(res['failed'])}项",
+                   state="error" if res["failed"] else "complete")
+    return res
+
+def fix_failing_shots(ep, failing):
+    """质检定向修改：只修改不达标的分镜，拼回原剧本，再只复检这些分镜并合并进原报告"""
+    script = st.session_state.episodes[ep]
+    t0 = time.perf_counter()
+    with st.spinner(f"🔧 修改{len(failing)}个分镜..."):
+        r = call_api_streaming([{"role": "user", "content": build_review_fix_prompt(ep, script, failing)}])
+        f = stream_to_container(r, st.empty()) if r else ""
+    fixed = {sc["num"]: sc["text"] for sc in parse_scenes(f) if sc["num"] in failing}
+    if not fixed:
+        if f:
+            st.warning("⚠️ 未解析到分镜")
+        return
+    note_prompt_use("review_fix", t0, f)
+    set_episode(ep, splice_scenes(script, fixed), "质检定向修改")
+    if ep == max(st.session_state.episodes):
+        update_memory(last_ending=ending_context(st.session_state.episodes[ep], episode_stats(ep)["hash"]))
+    auto_save()
+    og = st.session_state.model_id
+    if st.session_state.review_model:
+        st.session_state.model_id = st.session_state.review_model
+    try:
+        t0 = time.perf_counter()
+        with st.spinner(f"🔍 复检{len(fixed)}个分镜..."):
+            pr = build_shot_review_prompt(ep, fixed, failing, select_character_cards("\n".join(fixed.values())))
+            r = call_api_streaming([{"role": "user", "content": pr}], REVIEW_SYSTEM_PROMPT)
+            part = stream_to_container(r, st.empty()) if r else ""
+        if part:
+            note_prompt_use("review_shots", t0, part, scored=False)
+            st.session_state.review_results[ep] = merge_review(st.session_state.review_results[ep], part, fixed)
+            record_review(st.session_state, ep, get_active_model())
+    finally:
+        st.session_state.model_id = og
+    auto_save()
+    left = failing_shots(st.session_state.review_results[ep])
+    flash(f"✅ 第{ep}集已修改{len(fixed)}个分镜" + (f"，复检后仍有{len(left)}个不达标" if left else "，复检全部达标"))
+    st.rerun()
+
 with mt[1]:
     if bt["质量检查"]:
         if en not in st.session_state.episodes:
             st.warning(f"⚠️ 第{en}集未生成")
         else:
-            tx = get_combined_text(ec if ec else None)
-            sc_text = st.session_state.episodes[en]
-            rm = [{"role": "user", "content": build_review_prompt(en, sc_text, tx)}]
-            og = st.session_state.model_id
-            if st.session_state.review_model:
-                st.session_state.model_id = st.session_state.review_model
-            with st.spinner(f"🔍 质检第{en}集..."):
-                r = call_api_streaming(rm, REVIEW_SYSTEM_PROMPT)
-                if r:
-                    co = st.empty()
-                    f = stream_to_container(r, co)
-                    if f:
-                        st.session_state.review_results[en] = f
-                        st.session_state.current_step = max(st.session_state.current_step, 4)
-                        auto_save()
-                        st.success(f"✅ 第{en}集质检完成")
-            st.session_state.model_id = og
+            run_review(en, get_combined_text(ec if ec else None))
+
+    if len(st.session_state.episodes) >= 2:
+        with st.expander("🧭 连续性检查（本地，不消耗Token）", expanded=bool(st.session_state.get("continuity_issues"))):
+            k1, k2 = st.columns(2)
+            with k1:
+                if st.button("🧭 检查全剧", key="cc_run", use_container_width=True):
+                    t0 = time.perf_counter()
+                    run_continuity_check()
+                    st.caption(f"⏱️ {(time.perf_counter() - t0) * 1000:.0f}ms · {len(st.session_state.episodes)}集")
+            issues = st.session_state.get("continuity_issues") or []
+            flagged = sorted({i["ep"] for i in issues if i["level"] == "warn" and i["ep"] in st.session_state.episodes})
+            with k2:
+                if st.button(f"🔍 只质检标记集（{len(flagged)}）", key="cc_rv", use_container_width=True, disabled=not flagged):
+                    tx = get_combined_text(ec if ec else None)
+                    for e in flagged:
+                        st.markdown(f"---\n### 🔍 第{e}集")
+                        if not run_review(e, tx):
+                            break
+            if issues:
+                for i in issues:
+                    st.markdown(f"{'⚠️' if i['level'] == 'warn' else 'ℹ️'} **第{i['ep']}集** · {i['msg']}")
+            elif "continuity_issues" in st.session_state:
+                st.success("✅ 未发现衔接问题")
 
     if st.session_state.review_results:
         for e in sorted(st.session_state.review_results.keys()):
@@ -1394,43 +1820,13 @@ with mt[1]:
             with st.expander(f"📊 第{e}集", expanded=(e == en)):
                 st.markdown(rv)
                 f1, f2, f3 = st.columns(3)
+                failing = failing_shots(rv) if e in st.session_state.episodes else {}
+                if failing:
+                    st.caption(f"🔧 {PASS_SCORE}分以下：" + "、".join(f"分镜{n}" for n in failing))
                 with f1:
-                    if st.button(f"🔧 自动修改", key=f"fx{e}", type="primary"):
-                        fp = f"""根据质检修改第{e}集所有7分以下项。
-
-【修改格式要求】
-1. 台词必须嵌入画面动作流（不能单独分行）
-2. 每句台词前必须有情绪+表情+身体描写
-3. 时长必须实算
-4. 台词个性化（不能统一精简）
-
-质检：\n{rv}\n原剧本：\n{st.session_state.episodes[e]}\n输出修改后完整剧本。"""
-                        fm = st.session_state.messages + [{"role": "user", "content": fp}]
-                        with st.spinner("🔧..."):
-                            r = call_api_streaming(fm)
-                            if r:
-                                co = st.empty()
-                                f = stream_to_container(r, co)
-                                if f:
-                                    # --- 新增：纯净版剧本提取器 ---
-                                    # 防止AI输出的“【编剧内心独白】”等前言污染最终剧本
-                                    final_script = f
-                                    match = re.search(r'【分镜\s*1?】', f) # 寻找第一个分镜的开头
-                                    if match:
-                                        final_script = f[match.start():].strip() # 只截取分镜及之后的内容
-                                    
-                                    # 更新剧本内容为纯净版
-                                    st.session_state.episodes[e] = final_script
-                                    
-                                    # 更新记忆库的末尾分镜
-                                    last_scenes = extract_last_scenes(final_script, n=2)
-                                    if last_scenes:
-                                        st.session_state.memory["last_ending"] = last_scenes
-                                        
-                                    # --- 新增：强制UI刷新 ---
-                                    st.success(f"✅ 第{e}集修改已自动保存！正在刷新剧本界面...")
-                                    time.sleep(1.5) # 停顿1.5秒让用户看清提示
-                                    st.rerun() # 强制刷新整个网页，同步更新“剧本”Tab
+                    if st.button("🔧 自动修改", key=f"fx{e}", type="primary", disabled=not failing,
+                                 help="只把不达标的分镜和对应意见发给模型，拼回原剧本后只复检改动的分镜"):
+                        fix_failing_shots(e, failing)
                 with f2:
                     st.download_button("📥", rv, f"第{e}集_质检.md", "text/markdown", key=f"dr{e}")
                 with f3:
@@ -1441,69 +1837,178 @@ with mt[1]:
     else:
         st.markdown("""<div class="empty-state"><div class="empty-icon">🔍</div><div class="empty-text">暂无质检</div></div>""", unsafe_allow_html=True)
 
+timer.mark("质检")
 with mt[2]:
     if st.session_state.opening_designs:
-        st.markdown("### 🎯 6套方案")
-        st.markdown(st.session_state.opening_designs)
+        items = st.session_state.opening_items
+        st.markdown(f"### 🎯 {len(items) or 6}套方案")
+        if items:
+            for it in items:
+                with st.expander(f"方案{it['n']}｜{it['label']}", expanded=False):
+                    st.markdown(it["text"])
+        else:
+            st.markdown(st.session_state.opening_designs)
         st.markdown("---")
+        # 选中的方案以全文带进剧本Prompt；自定义内容原样使用（只填编号时也换成该方案全文）
+        opts = [it["n"] for it in items] + ["自定义"]
         o1, o2 = st.columns([3, 1])
         with o1:
-            ch = st.text_input("选择", placeholder="1-6或自定义", key="oc")
+            pick = st.selectbox("选择", opts, key="oc_pick",
+                                format_func=lambda n: n if n == "自定义" else f"方案{n}｜{next(it['label'] for it in items if it['n'] == n)}")
+            ch = st.text_area("自定义开场", key="oc", height=100, placeholder="写下自己的开场设计") if pick == "自定义" else ""
         with o2:
             st.markdown("<br>", unsafe_allow_html=True)
             if st.button("✅", key="cf", use_container_width=True, type="primary"):
-                if ch:
-                    st.session_state["selected_opening"] = ch
+                chosen = resolve_opening(items, ch) if pick == "自定义" else opening_text(next(it for it in items if it["n"] == pick))
+                if chosen:
+                    st.session_state["selected_opening"] = chosen
                     auto_save()
-                    st.success(f"✅ {ch}")
+                    st.success(f"✅ {chosen.splitlines()[0][:40]}")
+        if st.session_state.selected_opening:
+            with st.expander("📌 当前选择（第1集按此开场）", expanded=False):
+                st.markdown(st.session_state.selected_opening)
     else:
         st.markdown("""<div class="empty-state"><div class="empty-icon">🎯</div><div class="empty-text">待设计</div></div>""", unsafe_allow_html=True)
 
+timer.mark("开场")
 with mt[3]:
     st.markdown("### 💬 自由对话")
+    old = st.session_state.history_archive.get("chat_history", [])
+    if old and st.toggle(f"📜 显示已转存的{len(old)}条早期对话", key="ch_old"):
+        for mg in load_offloaded(old[-CHAT_KEEP:]):
+            with st.chat_message(mg["role"]):
+                st.markdown(mg["content"])
     for mg in st.session_state.chat_history[-20:]:
         with st.chat_message(mg["role"]):
             st.markdown(mg["content"])
+    cs = st.session_state.chat_summary
+    if cs.get("text"):
+        with st.expander("🧾 早前对话摘要", expanded=False):
+            st.markdown(cs["text"])
     ui = st.chat_input("输入...", key="ci")
     if ui:
+        turns = recent_turns(st.session_state.chat_history, cs.get("upto", 0))
         st.session_state.chat_history.append({"role": "user", "content": ui})
-        cx = ""
-        if st.session_state.global_analysis:
-            cx += f"\n【提炼】{st.session_state.global_analysis[:3000]}"
-        if st.session_state.episodes:
-            la = max(st.session_state.episodes.keys())
-            cx += f"\n【第{la}集】{st.session_state.episodes[la][:2000]}"
-        fm = f"背景：{cx}\n\n指令：{ui}" if cx else ui
+        with st.chat_message("user"):
+            st.markdown(ui)
+        passages = chat_index().context(ui, CHAT_CONTEXT_BUDGET)
+        msgs = turns + [{"role": "user", "content": build_chat_prompt(ui, passages, cs.get("text", ""))}]
         with st.chat_message("assistant"):
-            r = call_api_streaming([{"role": "user", "content": fm}])
+            t0 = time.perf_counter()
+            r = call_api_streaming(msgs)
             if r:
                 co = st.empty()
                 f = stream_to_container(r, co)
                 if f:
+                    note_prompt_use("chat", t0, f, scored=False)
+                    if passages:
+                        st.caption("📎 参考：" + "、".join(dict.fromkeys(p["label"] for p in passages)))
                     st.session_state.chat_history.append({"role": "assistant", "content": f})
+                    schedule_chat_summary()
                     auto_save()
 
+timer.mark("对话")
 with mt[4]:
     st.markdown("### 📊 总览")
     o1, o2, o3, o4 = st.columns(4)
     o1.metric("📚", len(st.session_state.chapter_order))
     o2.metric("🎬", len(st.session_state.episodes))
     o3.metric("✅", len(st.session_state.review_results))
-    o4.metric("📝", f"{sum(len(v) for v in st.session_state.episodes.values()):,}" if st.session_state.episodes else "0")
+    o4.metric("📝", f"{episode_totals()['chars']:,}" if st.session_state.episodes else "0")
+    if st.session_state.build_inputs:
+        models = {"main": get_active_model(), "review": st.session_state.review_model or get_active_model()}
+        stale = find_stale(st.session_state, models if st.session_state.get("dg_m") else None)
+        with st.expander(f"♻️ 依赖状态（{len(stale)}项过期）" if stale else "♻️ 依赖状态（全部最新）", expanded=False):
+            st.checkbox("生成时的模型与当前设置不同也算过期", key="dg_m")
+            if stale:
+                st.markdown("\n".join(f"- **{node_label(n)}**：{'；'.join(why)}" for n, why in stale.items()))
+            legacy = untracked(st.session_state)
+            if legacy:
+                st.caption(f"ℹ️ {len(legacy)}个产物没有记录生成输入（旧版本生成），不参与判断")
+            d1, d2 = st.columns([1, 2])
+            with d1:
+                dgw = st.number_input("并行数", 1, 8, 4, key="dg_w", help="互不依赖的节点（如各集质检）同时重建")
+            with d2:
+                st.markdown("<br>", unsafe_allow_html=True)
+                dgo = st.button("♻️ 只重建过期项", key="dg_go", disabled=not (stale and get_api_key()))
+            if dgo:
+                rebuild_stale_ui(stale, int(dgw))
     st.markdown("---")
     if st.session_state.episodes:
-        for e in sorted(st.session_state.episodes.keys()):
-            s = st.session_state.episodes[e]
-            sh = len(re.findall(r'【分镜\s*\d+】', s))
+        _, page = paginate(sorted(st.session_state.episodes.keys()), "ov_pg")
+        for e in page:
+            est = episode_stats(e)
+            sh = est["shots"]
             st.markdown(f"""<div class="chapter-item"><div class="chapter-icon" style="background:linear-gradient(135deg,#3182ce,#2b6cb0);">{e}</div>
 <div class="chapter-info"><div class="chapter-name">第{e}集 <span class="tag tag-blue">{sh}镜</span> <span class="tag tag-green">~{sh * 12}s</span></div>
-<div class="chapter-meta">{len(s):,}字 · {"✅" if e in st.session_state.review_results else "⏳"}</div></div></div>""", unsafe_allow_html=True)
+<div class="chapter-meta">{est["chars"]:,}字 · {"✅" if e in st.session_state.review_results else "⏳"}</div></div></div>""", unsafe_allow_html=True)
+    if st.session_state.global_analysis:
+        with st.expander("👥 角色索引", expanded=False):
+            idx = get_entity_index()
+            if idx["characters"]:
+                apps = character_appearances(idx)
+                rows = ["| 角色 | 别名 | 章节出场 | 剧本出场 | 说话DNA示范 |", "|---|---|---|---|---|"]
+                for name, c in idx["characters"].items():
+                    ca_, ea_ = apps[name]["chapters"], apps[name]["episodes"]
+                    rows.append(f"| {name} | {'、'.join(c['aliases']) or '—'} | "
+                                f"{f'{ca_[0]} → {ca_[1]}' if ca_ else '—'} | {f'第{ea_[0]}→{ea_[1]}集' if ea_ else '—'} | "
+                                f"{' / '.join(c['quotes'][:2]) or '—'} |")
+                st.markdown("\n".join(rows))
+            else:
+                st.info("💡 未在全局提炼中识别到【驱动卡】")
     st.markdown("---")
     st.markdown("#### 📌 记忆（可编辑）")
     for lb, ky in [("主线", "storyline"), ("人物", "characters"), ("进度", "progress"), ("结尾", "last_ending"), ("伏笔", "pending_foreshadow"), ("引爆", "next_foreshadow"), ("情绪", "emotion_track")]:
-        nv = st.text_input(f"📌 {lb}", value=st.session_state.memory.get(ky, ""), key=f"m_{ky}")
+        nv = st.text_input(f"📌 {lb}", value=st.session_state.memory.get(ky, ""), key=f"m_{ky}_{st.session_state.get('_memory_rev', 0)}")
         st.session_state.memory[ky] = nv
 
+timer.mark("总览")
+
 st.markdown("---")
 st.markdown(f"""<div style="text-align:center;padding:16px 0;"><span style="color:#a0aec0;font-size:0.75rem;">
 🎬 影视化视觉翻译引擎 V3.2 · 台词嵌入画面流 · 实算时长 · 角色DNA · {get_active_model()}</span></div>""", unsafe_allow_html=True)
+
+# ============================================================
+# 渲染计时（侧边栏开关）
+# ============================================================
+if profiling:
+    timer.mark("页脚")
+    hist = st.session_state.setdefault("_profile_history", [])
+    hist.append(dict(timer.sections))
+    del hist[:-PROFILE_HISTORY]
+    rows = ["| 区段 | 本次 ms | 近{}次均值 ms |".format(len(hist)), "|---|---:|---:|"]
+    for name, sec in timer.sections:
+        avg = sum(h.get(name, 0) for h in hist) / len(hist)
+        rows.append(f"| {name} | {sec * 1000:.1f} | {avg * 1000:.1f} |")
+    with prof_box:
+        st.markdown("\n".join(rows))
+        st.caption(f"本次重跑共 {timer.total * 1000:.1f} ms · 均值 {sum(sum(h.values()) for h in hist) / len(hist) * 1000:.1f} ms")
+
+# ============================================================
+# 内存诊断（侧边栏开关）
+# ============================================================
+if diagnosing:
+    with diag_box:
+        rows = state_sizes(st.session_state, skip=("_tm_snapshot",))
+        st.caption(f"会话共约 {format_bytes(sum(b for _, b in rows))} · {len(rows)}个键（近似值，共享对象只计一次）")
+        st.markdown("| 键 | 占用 |\n|---|---:|\n" + "\n".join(f"| {k} | {format_bytes(b)} |" for k, b in rows[:15]))
+        arch = st.session_state.history_archive
+        st.caption(f"生成上下文 {len(st.session_state.messages)}条 / {history_tokens(st.session_state.messages):,} Token · "
+                   f"自由对话 {len(st.session_state.chat_history)}条 / {history_tokens(st.session_state.chat_history):,} Token · "
+                   f"已转存 {len(arch.get('messages', []))} + {len(arch.get('chat_history', []))}条")
+        pf = project_file()
+        st.caption(f"备份文件 {pf}：{format_bytes(os.path.getsize(pf)) if os.path.exists(pf) else '未生成'}")
+        d1, d2 = st.columns(2)
+        if d1.button("📸 内存快照", key="sb_tm", help="首次点击开启 tracemalloc；之后每次与上一张快照对比增长"):
+            snap, trows = trace_snapshot(st.session_state.get("_tm_snapshot"))
+            st.session_state["_tm_snapshot"] = snap
+            st.session_state["_tm_rows"] = trows
+        if d2.button("⏹ 停止追踪", key="sb_tm_off"):
+            stop_tracing()
+            st.session_state.pop("_tm_snapshot", None)
+            st.session_state.pop("_tm_rows", None)
+        trows = st.session_state.get("_tm_rows")
+        if trows:
+            st.markdown("| 位置 | 占用 | 增长 | 次数 |\n|---|---:|---:|---:|\n" + "\n".join(
+                f"| {loc} | {format_bytes(size)} | {'—' if diff is None else format_bytes(diff) if diff >= 0 else '-' + format_bytes(-diff)} | {n} |"
+                for loc, size, diff, n in trows))
@@ -0,0 +1,19 @@
+"""影视化视觉翻译引擎：Prompt构建、接口调用、分镜解析与持久化（不依赖Streamlit）
+
+网页版 app.py 和命令行 ``fenjin run`` 共用这里的实现。
+"""
+from .api import make_config, open_stream, iter_stream, request_completion, stream_completion, RateLimited
+from .prompts import (SYSTEM_PROMPT, REVIEW_SYSTEM_PROMPT, build_analysis_prompt, build_opening_prompt,
+                      build_episode_prompt, build_review_prompt, build_dialogue_optimization_prompt,
+                      build_visual_optimization_prompt, build_emotion_optimization_prompt)
+from .scenes import parse_scenes, splice_scenes, build_ending_context, estimate_tokens, check_continuity
+from .characters import parse_character_cards, find_characters, select_cards
+from .checks import validate_script, score_script
+from .memory import extract_memory, memory_card
+from .store import content_hash, put_blob, get_blob, load_project, save_project
+from .ingest import read_novel
+from .project import Project
+from .deps import find_stale
+from .pipeline import analyze, run, rebuild_stale
+
+__version__ = "3.2.0"
@@ -0,0 +1,122 @@
+"""全局提炼的结构化拆分：七个部分分别存储，下游调用只带需要的部分
+
+两种来源：结构化提炼（模型按JSON输出七个字段）；或普通提炼的Markdown按「1.～7.」编号标题拆分。
+JSON 输出会先转成同样编号标题的Markdown存进 global_analysis，所以展示、驱动卡解析、检索都不用区分来源。
+"""
+import json
+import re
+
+ANALYSIS_SECTIONS = [
+    ("core", "一句话故事核心"), ("cards", "角色驱动卡"), ("outline", "故事大纲与情绪"),
+    ("beats", "核心情节节点"), ("logic", "逻辑链补充"), ("tone", "环境氛围与光影"), ("visuals", "视觉强场景与记忆点"),
+]
+SECTION_TITLES = dict(ANALYSIS_SECTIONS)
+# Markdown标题里用来认出各部分的关键词（按顺序查找，避免把节内的编号列表当成标题）
+SECTION_KEYWORDS = {
+    "core": ("故事核心", "一句话"), "cards": ("驱动卡",), "outline": ("大纲",), "beats": ("情节节点", "核心情节"),
+    "logic": ("逻辑链",), "tone": ("氛围", "基调"), "visuals": ("视觉强场景", "记忆点", "视觉"),
+}
+# 各类调用需要的部分；不在这里的调用仍带完整的提炼对话
+SECTION_NEEDS = {
+    "openings": ("core", "cards", "outline", "visuals"),
+    "episode": ("core", "cards", "outline", "beats", "logic", "tone", "visuals"),
+    "dialogue": ("cards",),
+    "visual": ("tone", "visuals"),
+    "emotion": ("core", "cards", "outline"),
+}
+HEADING_RE = re.compile(r'^[ \t]*(?:#|\*\*|【|第?[1-7一二三四五六七][ \t]*[\.、．:：)）])')
+JSON_RE = re.compile(r'\{.*\}', re.S)
+
+def _flatten(v):
+    """JSON字段值 → 文本；驱动卡数组转成「### 角色名」标题，供 parse_character_cards 解析"""
+    if isinstance(v, str):
+        return v.strip()
+    if isinstance(v, list):
+        parts = []
+        for x in v:
+            if isinstance(x, dict) and x.get("name"):
+                body = x.get("card") or "\n".join(f"{k}：{_flatten(w)}" for k, w in x.items() if k != "name")
+                parts.append(f"### {x['name']}\n{_flatten(body)}")
+            else:
+                parts.append(f"- {_flatten(x)}")
+        return "\n".join(parts)
+    if isinstance(v, dict):
+        return "\n".join(f"{k}：{_flatten(w)}" for k, w in v.items())
+    return "" if v is None else str(v)
+
+def parse_analysis_json(text):
+    """结构化提炼的JSON → {部分: 文本}；字段名接受英文键或中文标题，解析失败返回空dict"""
+    m = JSON_RE.search(text or "")
+    if not m:
+        return {}
+    try:
+        data = json.loads(m.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    out = {}
+    for key, title in ANALYSIS_SECTIONS:
+        v = data.get(key, data.get(title))
+        if v:
+            out[key] = _flatten(v)
+    return out
+
+def parse_analysis_markdown(text):
+    """普通提炼的Markdown按编号标题拆成 {部分: 文本}（不含标题行）；认不出的部分不出现在结果里"""
+    lines = (text or "").splitlines()
+    found, i = [], 0
+    for key, _ in ANALYSIS_SECTIONS:
+        for j in range(i, len(lines)):
+            ln = lines[j]
+            if len(ln) <= 60 and HEADING_RE.match(ln) and any(k in ln for k in SECTION_KEYWORDS[key]):
+                found.append((key, j))
+                i = j + 1
+                break
+    out = {}
+    for n, (key, j) in enumerate(found):
+        end = found[n + 1][1] if n + 1 < len(found) else len(lines)
+        body = "\n".join(lines[j + 1:end]).strip()
+        if body:
+            out[key] = body
+    return out
+
+def is_json_analysis(text):
+    return (text or "").lstrip().startswith(("{", "```"))
+
+def parse_analysis(text):
+    if is_json_analysis(text):
+        return parse_analysis_json(text) or parse_analysis_markdown(text)
+    return parse_analysis_markdown(text)
+
+def render_sections(sections, keys=None):
+    """按编号标题拼回Markdown（keys 为空时拼全部已有部分）"""
+    keys = [k for k, _ in ANALYSIS_SECTIONS] if keys is None else keys
+    nums = {k: i + 1 for i, (k, _) in enumerate(ANALYSIS_SECTIONS)}
+    return "\n\n".join(f"## {nums[k]}. {SECTION_TITLES[k]}\n{sections[k]}" for k in keys if sections.get(k))
+
+def store_analysis(data, text):
+    """写入全局提炼和拆分出的各部分；JSON输出转成Markdown正文。返回写入的正文"""
+    sections = parse_analysis(text)
+    if is_json_analysis(text) and sections:
+        text = render_sections(sections)
+    data["global_analysis"] = text
+    data["analysis_sections"] = sections
+    return text
+
+def analysis_context(data, kind):
+    """生成/优化调用带的「全局提炼」那一轮
+
+    已拆分出本类调用需要的全部部分时，只带这些部分（不再带提炼时发送的小说原文）；否则沿用对话历史的前两条。
+    """
+    sections = data.get("analysis_sections") or {}
+    need = SECTION_NEEDS.get(kind)
+    if not need or not all(sections.get(k) for k in need):
+        return data["messages"][:2]
+    titles = "、".join(SECTION_TITLES[k] for k in need)
+    return [{"role": "user", "content": f"请执行【第1轮：全局提炼】（本次只需：{titles}）"},
+            {"role": "assistant", "content": render_sections(sections, need)}]
+
+def cards_fallback(data):
+    """解析不出驱动卡时 select_cards 截断用的文本：优先用拆分出的驱动卡部分"""
+    return (data.get("analysis_sections") or {}).get("cards") or data["global_analysis"]
@@ -0,0 +1,132 @@
+"""OpenAI兼容接口调用（不依赖Streamlit；失败时抛出异常，由调用方决定如何提示）"""
+import json
+import time
+import weakref
+
+import requests
+
+from .scenes import estimate_tokens
+from .scheduler import CACHE_MAX_TEMPERATURE, RESPONSE_CACHE, SCHEDULER, request_tokens
+
+DEFAULT_API_BASE = "https://yunwu.ai/v1/"
+DEFAULT_MODEL = "deepseek-chat"
+RATE_LIMIT_RETRIES = 3
+# 非流式请求被限流时（不在这里重试），让调度器暂停放行新请求的秒数
+RATE_LIMIT_PAUSE = 30
+
+class RateLimited(Exception):
+    """多次重试后仍被限流"""
+
+def make_config(api_base, api_key, model=None, user=""):
+    """接口配置快照：后台线程/命令行只通过它访问接口；user 决定调度配额归属"""
+    return {"api_base": (api_base or DEFAULT_API_BASE).rstrip("/"), "api_key": api_key, "model": model or DEFAULT_MODEL,
+            "user": user}
+
+def _headers(cfg):
+    return {"Authorization": f"Bearer {cfg['api_key']}", "Content-Type": "application/json"}
+
+def _payload(cfg, messages, system_prompt, stream, temperature, max_tokens):
+    return {
+        "model": cfg["model"],
+        "messages": [{"role": "system", "content": system_prompt}] + messages,
+        "stream": stream, "temperature": temperature, "max_tokens": max_tokens
+    }
+
+def request_completion(cfg, messages, system_prompt, temperature=0.7, max_tokens=16384, timeout=120):
+    """非流式调用；失败时抛出异常。低温度请求的回复进程内共用缓存"""
+    data = _payload(cfg, messages, system_prompt, False, temperature, max_tokens)
+    key = RESPONSE_CACHE.key(cfg, data) if temperature <= CACHE_MAX_TEMPERATURE else None
+    if key:
+        hit = RESPONSE_CACHE.get(key)
+        if hit is not None:
+            return hit
+    with SCHEDULER.slot(cfg, request_tokens(messages, system_prompt)) as lease:
+        resp = requests.post(f"{cfg['api_base']}/chat/completions", headers=_headers(cfg), json=data, timeout=timeout)
+        if resp.status_code == 429:
+            SCHEDULER.pause(RATE_LIMIT_PAUSE)
+        resp.raise_for_status()
+        result = resp.json()
+        choices = result.get("choices")
+        if not choices or len(choices) == 0:
+            return None
+        content = choices[0].get("message", {}).get("content", "")
+        lease["output"] = estimate_tokens(content)
+    if key and content:
+        RESPONSE_CACHE.put(key, content)
+    return content
+
+def open_stream(cfg, messages, system_prompt, temperature=0.7, max_tokens=16384, timeout=300,
+                retries=RATE_LIMIT_RETRIES, on_retry=None):
+    """发起流式请求并返回响应；遇到429按 30s/60s/90s 退避重试，on_retry(等待秒数, 第几次) 用于提示
+
+    调度名额一直占到 iter_stream 读完（或响应被回收）为止。
+    """
+    data = _payload(cfg, messages, system_prompt, True, temperature, max_tokens)
+    lease = SCHEDULER.acquire(cfg, request_tokens(messages, system_prompt))
+    try:
+        for attempt in range(retries):
+            resp = requests.post(f"{cfg['api_base']}/chat/completions", headers=_headers(cfg), json=data,
+                                 stream=True, timeout=timeout)
+            if resp.status_code == 429:
+                wait_time = (attempt + 1) * 30
+                SCHEDULER.pause(wait_time)
+                if on_retry:
+                    on_retry(wait_time, attempt + 1)
+                time.sleep(wait_time)
+                continue
+            resp.raise_for_status()
+            resp.fenjin_lease = lease
+            weakref.finalize(resp, SCHEDULER.release, lease)
+            return resp
+    except BaseException:
+        SCHEDULER.release(lease)
+        raise
+    SCHEDULER.release(lease)
+    raise RateLimited(f"重试{retries}次仍被限流")
+
+def iter_stream(response):
+    """解析SSE流，逐块产出文本；连接中断等异常直接抛出。结束时归还调度名额"""
+    lease = getattr(response, "fenjin_lease", None)
+    try:
+        yield from _iter_chunks(response, lease)
+    finally:
+        if lease is not None:
+            SCHEDULER.release(lease, lease.get("output", 0))
+
+def _iter_chunks(response, lease):
+    for line in response.iter_lines():
+        if not line:
+            continue
+        try:
+            line_str = line.decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        if not line_str.startswith("data: "):
+            continue
+        data_str = line_str[6:].strip()
+        if data_str == "[DONE]":
+            break
+        if not data_str:
+            continue
+        try:
+            data = json.loads(data_str)
+        except json.JSONDecodeError:
+            continue
+        choices = data.get("choices")
+        if not choices or not isinstance(choices, list) or len(choices) == 0:
+            continue
+        first = choices[0]
+        if not isinstance(first, dict):
+            continue
+        delta = first.get("delta")
+        if not delta or not isinstance(delta, dict):
+            continue
+        content = delta.get("content")
+        if content:
+            if lease is not None:
+                lease["output"] = lease.get("output", 0) + estimate_tokens(content)
+            yield content
+
+def stream_completion(cfg, messages, system_prompt, temperature=0.7, max_tokens=16384, on_retry=None):
+    """流式调用并拼接全文"""
+    return "".join(iter_stream(open_stream(cfg, messages, system_prompt, temperature, max_tokens, on_retry=on_retry)))
@@ -0,0 +1,160 @@
+"""项目归档：zip内每章/每集/每份质检一个文件 + manifest.json，逐文件写入与恢复
+
+剧本版本历史和转存到磁盘的早期对话只在项目里存索引，正文在章节存储里；归档时把索引存进 history.json，
+引用到的正文按哈希各存一个 blobs/ 文件（同内容只存一份），导入时写回存储。
+"""
+import json
+import os
+import re
+import zipfile
+from datetime import datetime
+
+from .history import restore_versions
+from .store import content_hash, get_blob, has_blob, put_blob
+
+ARCHIVE_FORMAT = "fenjin-project"
+ARCHIVE_VERSION = 1
+EXPORT_DIR = "exports"
+EXPORT_KEEP = 5         # 每个前缀在 exports/ 下保留的最近归档数
+# 体积小、整体保存为 state.json 的字段
+ARCHIVE_STATE_KEYS = ("current_step", "current_episode", "memory", "messages", "chat_history", "chat_summary",
+                      "analysis_sections", "opening_items", "selected_opening", "build_inputs", "prompt_versions", "prompt_stats")
+# 大段文本单独成文件
+ARCHIVE_TEXT_FILES = {"global_analysis": "analysis.md", "opening_designs": "openings.md"}
+
+def _safe_name(name):
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", name).strip("_")[:60] or "chapter"
+
+def write_archive(data, path):
+    """把项目（session_state同构dict）写成zip归档，返回manifest
+
+    章节逐章从章节存储读出写入，不在内存里拼出整个项目；先写临时文件再替换。
+    """
+    manifest = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION,
+                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "chapters": [], "episodes": {}, "reviews": {}, "alternates": {}, "files": {}, "blobs": {}}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i, name in enumerate(data.get("chapter_order", []), 1):
+            meta = data.get("chapters", {}).get(name)
+            if not meta:
+                continue
+            fn = f"chapters/{i:04d}_{_safe_name(name)}.txt"
+            zf.writestr(fn, get_blob(meta["hash"]))
+            manifest["chapters"].append({"name": name, "file": fn, "hash": meta["hash"], "length": meta["length"]})
+        for ep, text in sorted((data.get("episodes") or {}).items()):
+            fn = f"episodes/{ep:03d}.md"
+            zf.writestr(fn, text)
+            manifest["episodes"][str(ep)] = {"file": fn, "hash": content_hash(text)}
+        for ep, text in sorted((data.get("review_results") or {}).items()):
+            fn = f"reviews/{ep:03d}.md"
+            zf.writestr(fn, text)
+            manifest["reviews"][str(ep)] = {"file": fn}
+        for ep, alts in sorted((data.get("episode_alternates") or {}).items()):
+            if alts:
+                fn = f"alternates/{ep:03d}.json"
+                zf.writestr(fn, json.dumps(alts, ensure_ascii=False))
+                manifest["alternates"][str(ep)] = {"file": fn}
+        for key, fn in ARCHIVE_TEXT_FILES.items():
+            if data.get(key):
+                zf.writestr(fn, data[key])
+                manifest["files"][key] = fn
+        history = {"episode_history": {str(ep): vs for ep, vs in (data.get("episode_history") or {}).items()},
+                   "history_archive": data.get("history_archive") or {}}
+        for h in _history_hashes(history):
+            if h in manifest["blobs"]:
+                continue
+            try:
+                text = get_blob(h)
+            except OSError:
+                continue
+            fn = f"blobs/{h}.txt"
+            zf.writestr(fn, text)
+            manifest["blobs"][h] = fn
+        zf.writestr("history.json", json.dumps(history, ensure_ascii=False))
+        manifest["files"]["history"] = "history.json"
+        zf.writestr("state.json", json.dumps({k: data.get(k) for k in ARCHIVE_STATE_KEYS if k in data},
+                                             ensure_ascii=False, indent=2))
+        manifest["files"]["state"] = "state.json"
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    os.replace(tmp, path)
+    return manifest
+
+def read_archive(src):
+    """读取归档（路径或文件对象），章节写入章节存储，返回session_state同构dict
+
+    章节按哈希去重：存储中已有的章节不再解压。
+    """
+    with zipfile.ZipFile(src) as zf:
+        try:
+            manifest = json.loads(zf.read("manifest.json"))
+        except KeyError:
+            raise ValueError("归档缺少 manifest.json")
+        if manifest.get("format") != ARCHIVE_FORMAT:
+            raise ValueError("不是分镜项目归档")
+        if manifest.get("version", 0) > ARCHIVE_VERSION:
+            raise ValueError(f"归档版本 {manifest.get('version')} 高于当前支持的 {ARCHIVE_VERSION}，请升级")
+        data = {"chapters": {}, "chapter_order": [], "episodes": {}, "review_results": {}, "episode_alternates": {}}
+        for c in manifest["chapters"]:
+            h = c["hash"]
+            if not has_blob(h):
+                h = put_blob(zf.read(c["file"]).decode("utf-8"))
+            data["chapters"][c["name"]] = {"hash": h, "length": c["length"]}
+            data["chapter_order"].append(c["name"])
+        for ep, e in manifest["episodes"].items():
+            data["episodes"][int(ep)] = zf.read(e["file"]).decode("utf-8")
+        for ep, e in manifest["reviews"].items():
+            data["review_results"][int(ep)] = zf.read(e["file"]).decode("utf-8")
+        for ep, e in manifest.get("alternates", {}).items():
+            data["episode_alternates"][int(ep)] = json.loads(zf.read(e["file"]))
+        files = manifest.get("files", {})
+        for key in ARCHIVE_TEXT_FILES:
+            data[key] = zf.read(files[key]).decode("utf-8") if key in files else ""
+        if "state" in files:
+            data.update(json.loads(zf.read(files["state"])))
+        if "history" in files:
+            blobs = manifest.get("blobs", {})
+
+            def read(h):
+                return zf.read(blobs[h]).decode("utf-8") if h in blobs else None
+
+            history = json.loads(zf.read(files["history"]))
+            data["episode_history"] = {int(ep): vs for ep, vs in history.get("episode_history", {}).items()}
+            for vs in data["episode_history"].values():
+                restore_versions(vs, read)
+            data["history_archive"] = history.get("history_archive", {})
+            for refs in data["history_archive"].values():
+                for r in refs:
+                    text = read(r["hash"])
+                    if text is not None and not has_blob(r["hash"]):
+                        put_blob(text)
+    return data
+
+def _history_hashes(history):
+    """history.json 里引用到的全部正文哈希（按版本顺序）"""
+    for vs in history["episode_history"].values():
+        for v in vs:
+            yield v["hash"]
+    for refs in history["history_archive"].values():
+        for r in refs:
+            yield r["hash"]
+
+def export_path(prefix="项目"):
+    return os.path.join(EXPORT_DIR, f"{prefix}_{datetime.now().strftime('%m%d_%H%M%S')}.zip")
+
+def prune_exports(prefix="项目", keep=EXPORT_KEEP):
+    """删除 exports/ 下同一前缀较早的归档，只保留最近 keep 个；返回删除的路径"""
+    if not os.path.isdir(EXPORT_DIR):
+        return []
+    pat = re.compile(rf'^{re.escape(prefix)}_\d{{4}}_\d{{6}}\.zip$')
+    old = sorted((fn for fn in os.listdir(EXPORT_DIR) if pat.match(fn)),
+                 key=lambda fn: os.path.getmtime(os.path.join(EXPORT_DIR, fn)))[:-keep or None]
+    removed = []
+    for fn in old:
+        try:
+            os.remove(os.path.join(EXPORT_DIR, fn))
+            removed.append(os.path.join(EXPORT_DIR, fn))
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,23 @@
+"""多人模式的身份来源：反向代理传来的认证头，或每个用户一个访问令牌
+
+两者都没配置时，用户名只是浏览器里自报的名字，任何人都能打开别人的项目，只适合可信内网。
+"""
+import hmac
+
+def parse_user_tokens(spec):
+    """「alice:令牌1,bob:令牌2」→ {用户名: 令牌}；格式不对的条目跳过"""
+    tokens = {}
+    for part in (spec or "").split(","):
+        user, sep, token = part.strip().partition(":")
+        if sep and user.strip() and token.strip():
+            tokens[user.strip()] = token.strip()
+    return tokens
+
+def check_token(tokens, user, token):
+    """令牌与该用户的配置一致时返回True（定长比较）"""
+    expected = tokens.get(user)
+    return bool(expected and token) and hmac.compare_digest(expected.encode("utf-8"), token.encode("utf-8"))
+
+def header_user(headers, name):
+    """从请求头取反向代理认证过的用户名；没有该头时返回空串"""
+    return ((headers or {}).get(name) or "").strip()
@@ -0,0 +1,104 @@
+"""离线批处理：OpenAI Batch API 格式的输入/输出与本地模拟执行"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .api import RATE_LIMIT_PAUSE
+from .scenes import estimate_tokens
+from .scheduler import SCHEDULER, request_tokens
+
+BATCH_DIR = "batch_jobs"
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+def batch_request(custom_id, model, system_prompt, messages, temperature=0.7, max_tokens=16384):
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+            "body": {"model": model, "messages": [{"role": "system", "content": system_prompt}] + messages,
+                     "temperature": temperature, "max_tokens": max_tokens}}
+
+def write_batch_file(reqs, job_id):
+    """把请求序列化为Batch输入JSONL，返回文件路径"""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    path = os.path.join(BATCH_DIR, f"{job_id}_input.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for r in reqs:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return path
+
+def submit_remote_batch(cfg, path):
+    """上传输入文件并创建batch，返回batch对象"""
+    headers = {"Authorization": f"Bearer {cfg['api_key']}"}
+    with open(path, "rb") as f:
+        r = requests.post(f"{cfg['api_base']}/files", headers=headers, data={"purpose": "batch"},
+                          files={"file": (os.path.basename(path), f, "application/jsonl")}, timeout=300)
+    r.raise_for_status()
+    r = requests.post(f"{cfg['api_base']}/batches", headers=headers, timeout=60,
+                      json={"input_file_id": r.json()["id"], "endpoint": BATCH_ENDPOINT, "completion_window": "24h"})
+    r.raise_for_status()
+    return r.json()
+
+def poll_remote_batch(cfg, batch_id):
+    r = requests.get(f"{cfg['api_base']}/batches/{batch_id}", headers={"Authorization": f"Bearer {cfg['api_key']}"}, timeout=60)
+    r.raise_for_status()
+    return r.json()
+
+def download_remote_output(cfg, file_id, out_path):
+    """流式下载结果文件到本地"""
+    with requests.get(f"{cfg['api_base']}/files/{file_id}/content", headers={"Authorization": f"Bearer {cfg['api_key']}"},
+                      stream=True, timeout=300) as r:
+        r.raise_for_status()
+        with open(out_path, "wb") as f:
+            for chunk in r.iter_content(64 * 1024):
+                f.write(chunk)
+
+def run_local_batch(cfg, in_path, out_path, concurrency=4):
+    """本地模拟Batch API：逐条调用 chat/completions，按Batch输出格式写结果文件
+
+    每条请求和在线调用一样经调度器排队，受全局/每人并发上限和 cfg["user"] 的Token配额约束。
+    """
+    with open(in_path, "r", encoding="utf-8") as f:
+        reqs = [json.loads(ln) for ln in f if ln.strip()]
+    headers = {"Authorization": f"Bearer {cfg['api_key']}", "Content-Type": "application/json"}
+
+    def one(req):
+        try:
+            with SCHEDULER.slot(cfg, request_tokens(req["body"]["messages"])) as lease:
+                resp = requests.post(f"{cfg['api_base']}/chat/completions", headers=headers,
+                                     json={**req["body"], "stream": False}, timeout=300)
+                if resp.status_code == 429:
+                    SCHEDULER.pause(RATE_LIMIT_PAUSE)
+                body = resp.json() if resp.ok else {"error": resp.text[:500]}
+                choices = body.get("choices") or []
+                lease["output"] = estimate_tokens(choices[0].get("message", {}).get("content", "")) if choices else 0
+            return {"id": f"local-{req['custom_id']}", "custom_id": req["custom_id"],
+                    "response": {"status_code": resp.status_code, "body": body}, "error": None}
+        except Exception as e:
+            return {"id": f"local-{req['custom_id']}", "custom_id": req["custom_id"], "response": None,
+                    "error": {"message": f"{type(e).__name__}: {e}"}}
+
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex, open(out_path, "w", encoding="utf-8") as f:
+        for res in ex.map(one, reqs):
+            ok = res["response"] is not None and res["response"]["status_code"] == 200
+            done += ok
+            failed += not ok
+            f.write(json.dumps(res, ensure_ascii=False) + "\n")
+    return {"completed": done, "failed": failed, "total": len(reqs)}
+
+def read_batch_output(path):
+    """逐行读取Batch结果，产出 (custom_id, 文本或None, 错误信息)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for ln in f:
+            if not ln.strip():
+                continue
+            res = json.loads(ln)
+            resp = res.get("response") or {}
+            if resp.get("status_code") != 200:
+                err = (res.get("error") or {}).get("message") or str(resp.get("body", ""))[:200]
+                yield res.get("custom_id"), None, err
+                continue
+            choices = (resp.get("body") or {}).get("choices") or []
+            text = choices[0].get("message", {}).get("content", "") if choices else ""
+            yield res.get("custom_id"), text or None, None if text else "空结果"
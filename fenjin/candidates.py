@@ -0,0 +1,48 @@
+"""多候选生成（best of N）与LLM批量评审"""
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .api import request_completion
+from .prompts import JUDGE_SYSTEM_PROMPT, SYSTEM_PROMPT, build_judge_prompt, prompt_id
+from .templates import record_usage
+
+CANDIDATE_VARIANTS = [
+    (0.7, ""),
+    (0.9, "（本候选：用一个强烈的视觉特写开场）"),
+    (1.0, "（本候选：用一句角色台词或一个声音开场）"),
+    (0.8, "（本候选：从动作冲突的中段直接切入）"),
+    (0.6, "（本候选：严格贴合原著节奏，开场即抛出疑问）"),
+    (1.1, "（本候选：开场制造一次情绪反转）"),
+]
+
+def generate_candidates(cfg, cx, n):
+    """并发生成n个候选（不同温度/开场提示），返回按完成顺序的结果列表"""
+    base = cx[-1]["content"]
+    jobs = []
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        for i in range(n):
+            temp, hint = CANDIDATE_VARIANTS[i % len(CANDIDATE_VARIANTS)]
+            msgs = cx[:-1] + [{"role": "user", "content": f"{base}\n\n{hint}" if hint else base}]
+            fut = ex.submit(request_completion, cfg, msgs, SYSTEM_PROMPT, temp, 16384, 300)
+            jobs.append((fut, temp, hint))
+        for fut in as_completed([j[0] for j in jobs]):
+            yield next(j for j in jobs if j[0] is fut), fut
+
+def judge_candidates(cfg, ep, candidates, stats=None):
+    """一次批量LLM评审，返回最佳候选下标；回复无法解析时返回None，请求失败时抛出异常
+
+    传入 stats（项目的 prompt_stats）时按评审模板版本累计用量。
+    """
+    t = time.perf_counter()
+    r = request_completion(cfg, [{"role": "user", "content": build_judge_prompt(ep, candidates)}],
+                           JUDGE_SYSTEM_PROMPT, temperature=0.2, max_tokens=512)
+    if stats is not None:
+        record_usage(stats, prompt_id("judge"), time.perf_counter() - t, r)
+    m = re.search(r'\{.*\}', r or "", re.S)
+    try:
+        best = int(json.loads(m.group(0))["best"]) - 1 if m else -1
+    except (ValueError, KeyError, TypeError, json.JSONDecodeError):
+        return None
+    return best if 0 <= best < len(candidates) else None
@@ -0,0 +1,93 @@
+"""角色索引：从全局提炼解析驱动卡，统计角色在文本中的出场"""
+import re
+
+CARD_FIELD_RE = re.compile(r'^(核心人格|说话DNA|行为DNA|红线|关系动态|示范原句|口头禅|句式)')
+
+CARD_SECTION_END_RE = re.compile(r'^\s*(?:#+\s*)?(?:\*\*)?\s*(?:[3-7][\.、．]|[三四五六七][、．.])')
+
+ALIAS_RE = re.compile(r'(?:外号|绰号|别称|又称|昵称|称呼|别名)[：:]\s*([^\n]+)')
+
+QUOTE_RE = re.compile(r'[“"「]([^”"」\n]{2,80})[”"」]')
+
+CARD_BUDGET = 4000
+
+def _card_heading_name(line):
+    """从驱动卡标题行取出角色名和括号内别名，不是标题行时返回None"""
+    raw = line.strip()
+    is_heading = raw.startswith("#") or (raw.startswith("**") and raw.endswith("**")) or \
+        (raw.startswith("【") and raw.endswith("】")) or re.match(r'^角色\s*[0-9一二三四五六七八九十]+\s*[：:]', raw)
+    if not is_heading:
+        return None
+    t = re.sub(r'^[#\s]+|\*\*|【|】', '', raw)
+    t = re.sub(r'^(?:角色\s*[0-9一二三四五六七八九十]+\s*[：:]|[0-9]+[\.、．]\s*)', '', t).strip()
+    t = re.sub(r'的?驱动卡.*$', '', t).strip(" ：:-—·")
+    if not t or CARD_FIELD_RE.match(t) or t in ("角色", "主要角色", "人物", "主要人物"):
+        return None
+    m = re.match(r'^([\u4e00-\u9fffA-Za-z0-9·]{1,12})\s*(?:[（(]([^）)]*)[）)])?', t)
+    if not m:
+        return None
+    aliases = [a.strip() for a in re.split(r'[、,，/／]', m.group(2) or "") if len(a.strip()) >= 2]
+    return m.group(1), aliases
+
+def parse_character_cards(analysis):
+    """解析全局提炼中的【驱动卡】部分：{角色名: {aliases, card, quotes}}"""
+    chars = {}
+    if not analysis:
+        return chars
+    lines = analysis.splitlines()
+    start = next((i for i, ln in enumerate(lines) if "驱动卡" in ln), None)
+    if start is None:
+        return chars
+    cur, buf = None, []
+
+    def flush():
+        if cur and buf:
+            card = "\n".join(buf).strip()
+            aliases = list(cur[1])
+            for m in ALIAS_RE.finditer(card):
+                aliases += [a.strip() for a in re.split(r'[、,，/／]', m.group(1)) if len(a.strip()) >= 2]
+            chars[cur[0]] = {"aliases": list(dict.fromkeys(aliases)), "card": card,
+                             "quotes": QUOTE_RE.findall(card)[:5]}
+
+    for ln in lines[start + 1:]:
+        if CARD_SECTION_END_RE.match(ln) and not CARD_FIELD_RE.match(ln.strip("#* ")):
+            break
+        h = _card_heading_name(ln)
+        if h:
+            flush()
+            cur, buf = h, [ln.strip()]
+        elif cur:
+            buf.append(ln)
+    flush()
+    return chars
+
+def find_characters(text, chars):
+    """统计文本中各角色（含别名）出现次数，只返回出现过的"""
+    hits = {}
+    for name, c in chars.items():
+        n = sum(text.count(a) for a in [name] + c["aliases"])
+        if n:
+            hits[name] = n
+    return hits
+
+def select_cards(script, chars, fallback="", budget=CARD_BUDGET, ranking=None):
+    """只取本集实际出场角色的驱动卡（按出场次数排序，限定字数）；没有驱动卡时退回截断的 fallback
+
+    剧本里一个角色名都没认出来（只用了代称、别名没收录）时，按 ranking（{角色名: 章节里的出场次数}）取主要角色，
+    没有 ranking 再退回截断的 fallback，不让质检/台词优化拿不到任何角色信息。
+    """
+    if not chars:
+        return fallback[:budget]
+    hits = find_characters(script, chars)
+    if not hits:
+        hits = {n: c for n, c in (ranking or {}).items() if n in chars and c}
+        if not hits:
+            return fallback[:budget]
+    out, used = [], 0
+    for name, _ in sorted(hits.items(), key=lambda x: -x[1]):
+        card = chars[name]["card"]
+        if used + len(card) > budget and out:
+            break
+        out.append(card)
+        used += len(card)
+    return "\n\n".join(out)
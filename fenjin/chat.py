@@ -0,0 +1,30 @@
+"""对话记忆：最近几条消息原样带上，更早的由小模型滚动压缩成一段摘要"""
+from .api import request_completion
+from .prompts import build_chat_summary_prompt
+from .scenes import estimate_tokens
+
+CHAT_CONTEXT_BUDGET = 2000   # 检索段落的Token预算
+CHAT_HISTORY_BUDGET = 1500   # 原样带上的最近消息的Token预算
+CHAT_RECENT = 6              # 最多原样带上的消息条数
+CHAT_SUMMARY_BATCH = 4       # 窗口外攒够这么多条消息再压缩一次
+SUMMARY_SYSTEM_PROMPT = "你负责维护一段对话摘要，只输出摘要正文。"
+
+def recent_turns(history, upto, budget=CHAT_HISTORY_BUDGET):
+    """history[upto:] 中最近的消息，条数和Token都不超过上限（从最旧的开始丢）"""
+    turns = history[max(upto, len(history) - CHAT_RECENT):]
+    while turns and sum(estimate_tokens(m["content"]) for m in turns) > budget:
+        turns = turns[1:]
+    # 以用户消息开头，避免上下文从半轮回答开始
+    while turns and turns[0]["role"] != "user":
+        turns = turns[1:]
+    return turns
+
+def summary_due(history, upto):
+    """需要压缩时返回要并入摘要的区间 (起, 止)，否则 None"""
+    end = len(history) - CHAT_RECENT
+    return (upto, end) if end - upto >= CHAT_SUMMARY_BATCH else None
+
+def summarize_chat(cfg, summary, turns):
+    """后台任务：把 turns 并入摘要（不访问session_state）"""
+    return request_completion(cfg, [{"role": "user", "content": build_chat_summary_prompt(summary, turns)}],
+                              SUMMARY_SYSTEM_PROMPT, temperature=0.2, max_tokens=800, timeout=90).strip()
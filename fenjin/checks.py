@@ -0,0 +1,73 @@
+"""本地格式校验与启发式评分（不调用模型）"""
+import re
+
+from .scenes import parse_scenes
+
+DIALOGUE_LINE_RE = re.compile(r'^\s*(?P<head>[^"“：:\n]{1,60}?)\s*[：:]\s*(?P<quote>["“（(])')
+
+BARE_HEAD_RE = re.compile(r'^[\u4e00-\u9fffA-Za-z·]{1,8}(?:\s*OS)?$')
+
+SOUND_OUTSIDE_RE = re.compile(r'(?<![（(])音效\s*[：:]')
+
+PICTURE_LINE_RE = re.compile(r'^\s*画面\s*[：:]')
+
+FORMAT_RULES = {
+    "bare": "裸台词：台词前缺少情绪/表情/动作描写",
+    "split": "画面与台词分离（「画面：」单独成行）",
+    "sound": "音效未用（）标注在动作旁",
+    "duration": "缺少实算时长",
+    "numbering": "分镜编号不连续",
+}
+
+def dialogue_lines(text):
+    """找出台词/OS行，返回 [(行号, 行内容, 是否裸台词)]"""
+    out = []
+    for i, ln in enumerate(text.splitlines(), 1):
+        m = DIALOGUE_LINE_RE.match(ln)
+        if not m or ln.lstrip().startswith(("场景", "地点", "音效", "画面", "【")):
+            continue
+        out.append((i, ln.strip(), bool(BARE_HEAD_RE.match(m.group("head").strip()))))
+    return out
+
+def score_script(text):
+    """本地启发式评分（0-100）：分镜数、台词嵌入率、格式规范、总时长"""
+    scenes = parse_scenes(text)
+    n = len(scenes)
+    if not n:
+        return {"score": 0, "shots": 0, "embed": 0, "format": 0, "duration": 0}
+    shots = 1.0 if 8 <= n <= 25 else max(0.0, 1 - min(abs(n - 8), abs(n - 25)) / 10)
+    dl = dialogue_lines(text)
+    embed = 1 - sum(1 for _, _, bare in dl if bare) / len(dl) if dl else 0.5
+    nums = [sc["num"] for sc in scenes]
+    seq_ok = nums == list(range(1, n + 1))
+    timed = sum(1 for sc in scenes if sc["duration"]) / n
+    fmt = 0.5 * seq_ok + 0.5 * timed
+    total = sum(sc["duration"] or 0 for sc in scenes)
+    dur = 1.0 if 60 <= total <= 150 else (0.5 if total else 0.0)
+    score = round(100 * (0.2 * shots + 0.35 * embed + 0.3 * fmt + 0.15 * dur))
+    return {"score": score, "shots": n, "embed": round(embed, 2), "format": round(fmt, 2), "duration": round(total, 1)}
+
+def validate_script(text):
+    """按 build_episode_prompt 的硬性格式要求逐条检查，返回 [{rule, shot, line, msg}]"""
+    issues = []
+    scenes = parse_scenes(text)
+    expect = 1
+    for sc in scenes:
+        if sc["num"] != expect:
+            issues.append({"rule": "numbering", "shot": sc["num"], "line": None,
+                           "msg": f"期望【分镜{expect}】，实际【分镜{sc['num']}】"})
+        expect = sc["num"] + 1
+        if sc["duration"] is None:
+            issues.append({"rule": "duration", "shot": sc["num"], "line": None, "msg": FORMAT_RULES["duration"]})
+        for ln in sc["text"].splitlines():
+            if SOUND_OUTSIDE_RE.search(ln):
+                issues.append({"rule": "sound", "shot": sc["num"], "line": ln.strip(), "msg": FORMAT_RULES["sound"]})
+            elif PICTURE_LINE_RE.match(ln):
+                issues.append({"rule": "split", "shot": sc["num"], "line": ln.strip(), "msg": FORMAT_RULES["split"]})
+        for _, ln, bare in dialogue_lines(sc["text"]):
+            if bare:
+                issues.append({"rule": "bare", "shot": sc["num"], "line": ln, "msg": FORMAT_RULES["bare"]})
+    return issues
+
+def format_fix_shots(issues):
+    return sorted({i["shot"] for i in issues if i["rule"] != "numbering"})
@@ -0,0 +1,198 @@
+"""命令行入口：fenjin run --novel book.txt --episodes 1-40 --concurrency 4"""
+import argparse
+import os
+import sys
+
+from .api import DEFAULT_API_BASE, DEFAULT_MODEL, make_config
+from .archive import read_archive, write_archive
+from .deps import find_stale, node_label, untracked
+from .ingest import read_novel
+from .pipeline import analyze, rebuild_stale, run
+from .project import Project
+from .screenplay import EXPORT_FORMATS, export_series, format_for_path
+from .store import AUTOSAVE_FILE
+from .templates import PROMPT_DIR, rejected_overrides, set_active, template_table, usage_rows
+
+def parse_episodes(spec):
+    """「1-40」「3」「1-5,8,10-12」→ 升序集数列表"""
+    eps = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        a, _, b = part.partition("-")
+        try:
+            lo, hi = int(a), int(b or a)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无法解析集数：{part}")
+        if lo < 1 or hi < lo:
+            raise argparse.ArgumentTypeError(f"集数范围无效：{part}")
+        eps.update(range(lo, hi + 1))
+    if not eps:
+        raise argparse.ArgumentTypeError("集数为空")
+    return sorted(eps)
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="fenjin", description="影视化视觉翻译引擎（命令行版）")
+    sub = p.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="导入小说并批量生成分镜剧本")
+    r.add_argument("--novel", help="小说txt文件（自动识别编码并分章，已导入的章节会跳过）")
+    r.add_argument("--episodes", required=True, type=parse_episodes, help="集数，如 1-40 或 1-5,8")
+    r.add_argument("--concurrency", type=int, default=4, help="线程池大小（记忆提炼/质检；--no-chain 时也用于并发生成）")
+    r.add_argument("--project", default=AUTOSAVE_FILE, help=f"项目文件，与网页版备份同格式（默认 {AUTOSAVE_FILE}）")
+    r.add_argument("--api-base", default=os.environ.get("FENJIN_API_BASE", DEFAULT_API_BASE))
+    r.add_argument("--api-key", default=os.environ.get("FENJIN_API_KEY", ""), help="也可用环境变量 FENJIN_API_KEY")
+    r.add_argument("--model", default=os.environ.get("FENJIN_MODEL", DEFAULT_MODEL))
+    r.add_argument("--structured-analysis", action="store_true",
+                   help="全局提炼按JSON输出七个部分分别存储，后续生成只带需要的部分")
+    r.add_argument("--memory-model", default="", help="记忆提炼模型，默认与生成模型相同；off 关闭")
+    r.add_argument("--review", action="store_true", help="每集生成后在后台执行第4轮质检")
+    r.add_argument("--review-model", default="", help="质检模型，默认与生成模型相同")
+    r.add_argument("--no-chain", action="store_true", help="各集并发生成，不衔接本次新生成的上一集")
+    r.add_argument("--overwrite", action="store_true", help="重新生成已存在的集")
+    x = sub.add_parser("export", help="把项目导出为zip归档（每章/每集/每份质检一个文件）")
+    x.add_argument("out", help="输出的 .zip 路径")
+    x.add_argument("--project", default=AUTOSAVE_FILE)
+    i = sub.add_parser("import", help="从zip归档恢复项目")
+    i.add_argument("archive", help="fenjin export / 网页版导出的 .zip")
+    i.add_argument("--project", default=AUTOSAVE_FILE)
+    i.add_argument("--force", action="store_true", help="项目文件已有内容时仍然覆盖")
+    rb = sub.add_parser("rebuild", help="列出因章节/提炼/上集变化而过期的产物，并只重建这些")
+    rb.add_argument("--dry-run", action="store_true", help="只列出过期项及原因")
+    rb.add_argument("--check-models", action="store_true", help="生成时所用模型与当前不同也算过期")
+    rb.add_argument("--concurrency", type=int, default=4, help="互不依赖的节点并行重建的线程数")
+    rb.add_argument("--project", default=AUTOSAVE_FILE)
+    rb.add_argument("--api-base", default=os.environ.get("FENJIN_API_BASE", DEFAULT_API_BASE))
+    rb.add_argument("--api-key", default=os.environ.get("FENJIN_API_KEY", ""))
+    rb.add_argument("--model", default=os.environ.get("FENJIN_MODEL", DEFAULT_MODEL))
+    rb.add_argument("--review-model", default="", help="质检模型，默认与生成模型相同")
+    pt = sub.add_parser("prompts", help="列出Prompt模板版本、静态Token数和各版本的用量/质量统计")
+    pt.add_argument("--use", action="append", default=[], metavar="名称=版本",
+                    help="为项目启用某个模板版本（可重复），版本来自 prompt_templates/名称@版本.txt")
+    pt.add_argument("--project", default=AUTOSAVE_FILE)
+    sp = sub.add_parser("screenplay", help="导出 Fountain / FDX / DOCX / 分镜表CSV")
+    sp.add_argument("out", help="输出文件，格式默认按扩展名推断")
+    sp.add_argument("--format", choices=list(EXPORT_FORMATS))
+    sp.add_argument("--episodes", type=parse_episodes, help="集数，默认全部")
+    sp.add_argument("--title", default="剧本")
+    sp.add_argument("--project", default=AUTOSAVE_FILE)
+    return p
+
+def cmd_run(args):
+    if not args.api_key:
+        print("❌ 请通过 --api-key 或环境变量 FENJIN_API_KEY 提供 API Key", file=sys.stderr)
+        return 2
+    project = Project(args.project)
+    if args.novel:
+        name = os.path.splitext(os.path.basename(args.novel))[0]
+        with open(args.novel, "rb") as f:
+            enc, chapters = read_novel(f, name)
+            added = [n for n, c in chapters if project.add_chapter(n, c)]
+        print(f"📥 {args.novel}（{enc}）：新增{len(added)}章，共{len(project['chapter_order'])}章")
+        project.save()
+    if not project["chapter_order"]:
+        print("❌ 项目中没有章节，请用 --novel 导入小说", file=sys.stderr)
+        return 2
+    cfg = make_config(args.api_base, args.api_key, args.model)
+    if not project["global_analysis"]:
+        print("🧠 全局提炼中...")
+        analyze(project, cfg, on_retry=lambda w, a: print(f"⚠️ API限流，{w}秒后自动重试（第{a}次）"),
+                structured=args.structured_analysis)
+        project.save()
+        print(f"✅ 全局提炼完成，识别{len(project.characters)}个角色驱动卡")
+    memory_cfg = None if args.memory_model == "off" else make_config(args.api_base, args.api_key, args.memory_model or args.model)
+    review_cfg = make_config(args.api_base, args.api_key, args.review_model or args.model) if args.review else None
+    res = run(project, cfg, args.episodes, args.concurrency, review_cfg, memory_cfg,
+              chain=not args.no_chain, overwrite=args.overwrite)
+    print(f"🏁 完成{len(res['done'])}集，失败{len(res['failed'])}集，质检{len(res['reviewed'])}集 → {args.project}")
+    return 1 if res["failed"] else 0
+
+def cmd_export(args):
+    project = Project(args.project)
+    m = write_archive(project.data, args.out)
+    print(f"📦 {args.out}：{len(m['chapters'])}章 · {len(m['episodes'])}集 · {len(m['reviews'])}份质检")
+    return 0
+
+def cmd_import(args):
+    project = Project(args.project)
+    if (project["chapters"] or project["episodes"]) and not args.force:
+        print(f"❌ {args.project} 已有内容，加 --force 覆盖", file=sys.stderr)
+        return 2
+    project.replace(read_archive(args.archive))
+    project.save()
+    print(f"📂 已恢复到 {args.project}：{len(project['chapter_order'])}章 · {len(project['episodes'])}集")
+    return 0
+
+def cmd_rebuild(args):
+    project = Project(args.project)
+    cfg = make_config(args.api_base, args.api_key, args.model)
+    review_cfg = make_config(args.api_base, args.api_key, args.review_model or args.model)
+    models = {"main": cfg["model"], "review": review_cfg["model"]} if args.check_models else None
+    stale = find_stale(project.data, models)
+    for node, why in stale.items():
+        print(f"• {node_label(node)}：{'；'.join(why)}")
+    legacy = untracked(project.data)
+    if legacy:
+        print(f"ℹ️ {len(legacy)}个产物没有记录生成输入（旧版本生成），无法判断是否过期")
+    if not stale:
+        print("✅ 没有过期的产物")
+        return 0
+    if args.dry_run:
+        return 0
+    if not args.api_key:
+        print("❌ 请通过 --api-key 或环境变量 FENJIN_API_KEY 提供 API Key", file=sys.stderr)
+        return 2
+    res = rebuild_stale(project, cfg, review_cfg, args.concurrency, args.check_models)
+    print(f"🏁 重建{len(res['done'])}项，失败{len(res['failed'])}项 → {args.project}")
+    return 1 if res["failed"] else 0
+
+def cmd_prompts(args):
+    project = Project(args.project)
+    for spec in args.use:
+        name, _, ver = spec.partition("=")
+        try:
+            set_active(name, ver)
+        except KeyError:
+            print(f"❌ 没有模板版本 {name}@{ver}", file=sys.stderr)
+            return 2
+        project["prompt_versions"][name] = ver
+    if args.use:
+        project.save()
+    print("模板版本 | 字段 | 静态Token")
+    for r in template_table():
+        print(f"{'*' if r['active'] else ' '} {r['id']} | {','.join(r['fields']) or '—'} | {r['static_tokens']}")
+    for fn, why in rejected_overrides().items():
+        print(f"⚠️ {PROMPT_DIR}/{fn} 未载入：{why}", file=sys.stderr)
+    rows = usage_rows(project["prompt_stats"])
+    if rows:
+        print("\n用量（按Prompt标识） | 次数 | 平均耗时s | Token/s | 平均评分")
+        for r in rows:
+            score = f"{r['avg_score']:.1f}" if r["avg_score"] is not None else "—"
+            print(f"{r['id']} | {r['n']} | {r['avg_secs']:.1f} | {r['tok_per_sec']:.1f} | {score}")
+    return 0
+
+def cmd_screenplay(args):
+    fmt = args.format or format_for_path(args.out)
+    if not fmt:
+        print("❌ 无法从扩展名推断格式，请用 --format 指定", file=sys.stderr)
+        return 2
+    project = Project(args.project)
+    eps = [e for e in (args.episodes or sorted(project["episodes"])) if e in project["episodes"]]
+    if not eps:
+        print("❌ 没有可导出的剧本", file=sys.stderr)
+        return 2
+    export_series(fmt, ((e, project["episodes"][e]) for e in eps), args.out, args.title, project.characters)
+    print(f"🎞 {args.out}：{EXPORT_FORMATS[fmt][0]} · {len(eps)}集")
+    return 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return {"run": cmd_run, "export": cmd_export, "import": cmd_import, "screenplay": cmd_screenplay,
+                "rebuild": cmd_rebuild, "prompts": cmd_prompts}[args.command](args)
+    except KeyboardInterrupt:
+        print("\n⏹ 已中断，已完成的集已写入项目文件", file=sys.stderr)
+        return 130
+
+if __name__ == "__main__":
+    sys.exit(main())
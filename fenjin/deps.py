@@ -0,0 +1,202 @@
+"""产物依赖图：记录每个产物（全局提炼/开场/各集剧本/质检）由哪些输入生成，精确标出过期项，只重建过期项
+
+节点：analysis、openings、episode:N、review:N。输入记录在项目的 build_inputs 里：
+  analysis   ← 章节哈希、模型、Prompt版本（结构化提炼另记 structured）
+  openings   ← 全局提炼哈希、模型、Prompt版本（六条并发生成另记 parallel）
+  episode:N  ← 全局提炼哈希、参考章节哈希、所选开场哈希、第N-1集结尾指纹（生成时带了衔接才记录）、模型、Prompt版本
+  review:N   ← 剧本哈希、第N-1集结尾指纹、模型、Prompt版本
+没有记录输入的旧产物无法判断，不参与过期检查。
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from .prompts import prompt_id
+from .scenes import ENDING_TOKEN_BUDGET, build_ending_context
+from .store import content_hash
+
+KIND_ORDER = {"analysis": 0, "openings": 1, "episode": 2, "review": 3}
+# 各类节点对应的模型角色：main=生成模型，review=质检模型
+MODEL_ROLE = {"analysis": "main", "openings": "main", "episode": "main", "review": "review"}
+# 网页版每次刷新都要做过期检查：剧本/提炼的哈希和结尾指纹按正文缓存，未修改的集不再重新解析分镜
+FINGERPRINT_CACHE_SIZE = 512
+
+def node_id(kind, ep=None):
+    return kind if ep is None else f"{kind}:{ep}"
+
+def split_node(node):
+    kind, _, ep = node.partition(":")
+    return kind, int(ep) if ep else None
+
+def node_label(node):
+    kind, ep = split_node(node)
+    return {"analysis": "全局提炼", "openings": "开场设计",
+            "episode": f"第{ep}集", "review": f"第{ep}集质检"}[kind]
+
+def _order(node):
+    kind, ep = split_node(node)
+    return KIND_ORDER[kind], ep or 0
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _h(text):
+    return content_hash(text) if text else ""
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def ending_fingerprint(script):
+    """上集结尾的指纹：固定预算、不压缩，与界面上的衔接设置无关"""
+    return _h(build_ending_context(script, ENDING_TOKEN_BUDGET, False)) if script else ""
+
+def chapter_inputs(data, names=None):
+    names = data["chapter_order"] if not names else names
+    return {n: data["chapters"][n]["hash"] for n in names if n in data["chapters"]}
+
+# ---------- 记录输入（产物写入时调用） ----------
+def record_analysis(data, names, model, structured=False):
+    data["build_inputs"]["analysis"] = {"chapters": chapter_inputs(data, names), "model": model,
+                                        "prompt": prompt_id("analysis_json" if structured else "analysis")}
+    if structured:
+        data["build_inputs"]["analysis"]["structured"] = True
+
+def record_openings(data, model, parallel=False):
+    inp = {"analysis": _h(data["global_analysis"]), "model": model,
+           "prompt": prompt_id("opening_one" if parallel else "openings")}
+    if parallel:
+        inp["parallel"] = True
+    data["build_inputs"]["openings"] = inp
+
+def record_episode(data, ep, names, opening, prev_used, model):
+    prev = ending_fingerprint(data["episodes"].get(ep - 1, "")) if prev_used else ""
+    data["build_inputs"][node_id("episode", ep)] = {
+        "analysis": _h(data["global_analysis"]), "chapters": chapter_inputs(data, names),
+        "opening": _h(opening), "prev": prev, "model": model, "prompt": prompt_id("episode")}
+
+def record_review(data, ep, model):
+    data["build_inputs"][node_id("review", ep)] = {
+        "episode": _h(data["episodes"].get(ep, "")), "prev": ending_fingerprint(data["episodes"].get(ep - 1, "")),
+        "model": model, "prompt": prompt_id("review")}
+
+# ---------- 过期判断 ----------
+def _exists(data, node):
+    kind, ep = split_node(node)
+    if kind == "analysis":
+        return bool(data["global_analysis"])
+    if kind == "openings":
+        return bool(data["opening_designs"])
+    return ep in data["episodes" if kind == "episode" else "review_results"]
+
+def upstream(node, inp):
+    """节点的上游节点（重建时需要先完成的）"""
+    kind, ep = split_node(node)
+    prev = [node_id("episode", ep - 1)] if inp.get("prev") else []
+    if kind == "openings":
+        return ["analysis"]
+    if kind == "episode":
+        return ["analysis"] + prev
+    if kind == "review":
+        return [node_id("episode", ep)] + prev
+    return []
+
+def _prompt_kind(kind, inp):
+    """产物实际用的Prompt类别：结构化提炼、并发生成的开场方案各有自己的模板"""
+    if inp.get("structured"):
+        return "analysis_json"
+    if inp.get("parallel"):
+        return "opening_one"
+    return kind
+
+def _reasons(data, node, inp, models):
+    kind, ep = split_node(node)
+    out = []
+    for name, h in inp.get("chapters", {}).items():
+        meta = data["chapters"].get(name)
+        if meta is None:
+            out.append(f"章节「{name}」已删除")
+        elif meta["hash"] != h:
+            out.append(f"章节「{name}」已修改")
+    if "analysis" in inp and inp["analysis"] != _h(data["global_analysis"]):
+        out.append("全局提炼已变化")
+    # 旧项目没有保存所选开场，没有时不比较
+    if inp.get("opening") and data.get("selected_opening") and inp["opening"] != _h(data["selected_opening"]):
+        out.append("所选开场已变化")
+    if inp.get("prev") and inp["prev"] != ending_fingerprint(data["episodes"].get(ep - 1, "")):
+        out.append(f"第{ep - 1}集结尾已变化")
+    if "episode" in inp and inp["episode"] != _h(data["episodes"].get(ep, "")):
+        out.append("剧本已修改")
+    cur = (models or {}).get(MODEL_ROLE[kind])
+    if cur and inp.get("model") and inp["model"] != cur:
+        out.append(f"模型 {inp['model']} → {cur}")
+    if inp.get("prompt") != prompt_id(_prompt_kind(kind, inp)):
+        out.append("Prompt版本已更新")
+    return out
+
+def find_stale(data, models=None):
+    """返回 {节点: [过期原因...]}，按可重建的顺序排列
+
+    models 形如 {"main": 生成模型, "review": 质检模型}；传入时模型变化也算过期。
+    上游过期的节点一并标记（上游重建后它的输入必然变化）。
+    """
+    inputs = data.get("build_inputs") or {}
+    stale = {}
+    for node in sorted(inputs, key=_order):
+        if not _exists(data, node):
+            continue
+        inp = inputs[node]
+        why = _reasons(data, node, inp, models)
+        why += [f"上游「{node_label(u)}」需重建" for u in upstream(node, inp) if u in stale]
+        if why:
+            stale[node] = why
+    return stale
+
+def untracked(data):
+    """已存在但没有记录输入的产物（旧版本生成的）"""
+    inputs = data.get("build_inputs") or {}
+    nodes = (["analysis"] if data["global_analysis"] else []) + (["openings"] if data["opening_designs"] else [])
+    nodes += [node_id("episode", e) for e in sorted(data["episodes"])]
+    nodes += [node_id("review", e) for e in sorted(data["review_results"])]
+    return [n for n in nodes if n not in inputs]
+
+# ---------- 重建 ----------
+def rebuild(nodes, deps, prepare, commit, workers=4, log=print):
+    """按依赖顺序重建 nodes（已排好序），互不依赖的节点在线程池里并行
+
+    deps(node) 返回上游节点；只有在本次重建范围内的上游才需要等待。
+    prepare(node) 在调用线程里执行，读取最新的上游结果，返回不访问项目状态的任务函数；
+    commit(node, result) 也在调用线程里执行，负责写回项目。上游失败的节点跳过。
+    返回 {"done": [...], "failed": {节点: 错误}}。
+    """
+    pending = list(nodes)
+    blockers = {n: [d for d in deps(n) if d in pending] for n in pending}
+    result = {"done": [], "failed": {}}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fenjin-rebuild") as ex:
+        while pending or running:
+            for n in list(pending):
+                if any(b in result["failed"] for b in blockers[n]):
+                    pending.remove(n)
+                    result["failed"][n] = "上游重建失败"
+                    log(f"⏭ {node_label(n)}：上游重建失败，跳过")
+                elif all(b in result["done"] for b in blockers[n]):
+                    pending.remove(n)
+                    try:
+                        running[ex.submit(prepare(n))] = n
+                    except Exception as err:
+                        result["failed"][n] = f"{type(err).__name__}: {err}"
+                        log(f"❌ {node_label(n)}：{result['failed'][n]}")
+                        continue
+                    log(f"♻️ {node_label(n)}重建中...")
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                n = running.pop(fut)
+                try:
+                    out = fut.result()
+                    if not out:
+                        raise RuntimeError("返回为空")
+                    commit(n, out)
+                except Exception as err:
+                    result["failed"][n] = f"{type(err).__name__}: {err}"
+                    log(f"❌ {node_label(n)}：{result['failed'][n]}")
+                else:
+                    result["done"].append(n)
+                    log(f"✅ {node_label(n)}已重建")
+    return result
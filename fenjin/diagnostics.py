@@ -0,0 +1,108 @@
+"""会话内存诊断与对话历史转存
+
+- deep_size/state_sizes：按键估算 session_state 各项占用的内存（递归累加，共享对象只算一次）；
+- offload_history：把较早的对话消息写进章节存储（内容寻址、压缩），session 里只留最近的消息；
+- tracemalloc 快照：按需开启，对比两次快照看哪些代码行的分配在增长。
+"""
+import sys
+import tracemalloc
+import types
+
+from .scenes import estimate_tokens
+from .store import get_blob, put_blob
+
+# 全局提炼那一轮（前2条）始终保留，之后只保留最近的若干条
+MESSAGES_HEAD = 2
+MESSAGES_KEEP = 8
+CHAT_KEEP = 40
+TRACE_TOP = 15
+
+def deep_size(obj, seen=None):
+    """对象及其引用的容器/字符串的总字节数（近似值；同一对象只计一次）"""
+    seen = set() if seen is None else seen
+    stack, total = [obj], 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__") and not isinstance(o, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            stack.append(vars(o))
+    return total
+
+def state_sizes(state, skip=()):
+    """[(键, 字节数)]，按占用降序；各键之间共享的对象算在先统计到的键上"""
+    seen, rows = set(), []
+    for k in list(state.keys()):
+        if k in skip:
+            continue
+        try:
+            rows.append((k, deep_size(state[k], seen)))
+        except Exception:
+            continue
+    return sorted(rows, key=lambda r: -r[1])
+
+def history_tokens(history):
+    return sum(estimate_tokens(m.get("content", "")) for m in history)
+
+def offload_history(history, keep, head=0):
+    """把 history[head:-keep] 写进章节存储，返回 (保留在内存里的消息, 转存记录)
+
+    转存记录为 {"role", "hash", "length"}，用 load_offloaded 读回。
+    """
+    n = len(history) - head - keep
+    if n <= 0:
+        return history, []
+    moved = history[head:head + n]
+    refs = [{"role": m["role"], "hash": put_blob(m["content"]), "length": len(m["content"])} for m in moved]
+    return history[:head] + history[head + n:], refs
+
+def load_offloaded(refs):
+    """转存记录 → 消息列表（读不到或解不开的内容以占位文本代替）"""
+    out = []
+    for r in refs:
+        try:
+            content = get_blob(r["hash"])
+        except OSError:
+            content = f"（转存内容缺失：{r['hash'][:8]}）"
+        except Exception as e:
+            # 对象损坏（zlib.error、zstd/解码错误），或以zstd压缩存储而本机未安装 zstandard（RuntimeError）
+            content = f"（转存内容无法读取：{r['hash'][:8]}，{type(e).__name__}）"
+        out.append({"role": r["role"], "content": content})
+    return out
+
+def trace_snapshot(previous=None, top=TRACE_TOP):
+    """拍一张 tracemalloc 快照（未开启时先开启），返回 (快照, 展示行)
+
+    有上一张快照时按增长量排序，否则按当前占用排序；行为 (位置, 字节数, 增长字节数或None, 分配次数)。
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    snap = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    if previous is not None:
+        stats = snap.compare_to(previous, "lineno")[:top]
+        rows = [(str(s.traceback[0]), s.size, s.size_diff, s.count) for s in stats]
+    else:
+        stats = snap.statistics("lineno")[:top]
+        rows = [(str(s.traceback[0]), s.size, None, s.count) for s in stats]
+    return snap, rows
+
+def stop_tracing():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
@@ -0,0 +1,77 @@
+"""剧本版本历史：每次写入追加一个版本（内容寻址，相对上一版差分存储），支持回滚与对比"""
+import difflib
+from datetime import datetime
+
+from .store import delta_depth, get_blob, has_blob, put_blob, put_delta
+
+HISTORY_LIMIT = 50
+# 差分链超过这个长度时存一次完整快照，读取任一版本最多解 KEYFRAME_EVERY 层差分
+KEYFRAME_EVERY = 10
+
+def record_version(versions, text, source):
+    """把 text 追加为一个新版本（与最新版本相同时跳过），返回新版本条目或None
+
+    versions 是某一集的版本列表（按时间顺序），条目：{hash, source, time, chars, delta}
+    """
+    last = versions[-1] if versions else None
+    if last:
+        # 链长按存储里的实际对象算：回滚到旧版本时最新条目可能本身就是差分
+        try:
+            base = get_blob(last["hash"])
+            depth = delta_depth(last["hash"], KEYFRAME_EVERY)
+        except OSError:
+            base, depth = None, KEYFRAME_EVERY
+        if base == text:
+            return None
+        if base is not None and depth < KEYFRAME_EVERY:
+            h, is_delta = put_delta(text, base, last["hash"])
+            if is_delta and delta_depth(h, KEYFRAME_EVERY + 1) > KEYFRAME_EVERY:
+                # 同内容的旧差分对象挂在更长的链上：改存完整内容
+                h, is_delta = put_blob(text, keyframe=True), False
+        else:
+            h, is_delta = put_blob(text, keyframe=True), False
+    else:
+        h, is_delta = put_blob(text, keyframe=True), False
+    entry = {"hash": h, "source": source, "time": datetime.now().strftime("%m-%d %H:%M:%S"),
+             "chars": len(text), "delta": is_delta}
+    versions.append(entry)
+    # 只裁剪索引：被裁掉版本的对象可能仍是后续差分的基准，保留在存储中
+    del versions[:-HISTORY_LIMIT]
+    return entry
+
+def restore_versions(versions, read):
+    """归档导入：按版本顺序把正文写回存储，差分基准取前一个版本，链长同样受 KEYFRAME_EVERY 限制
+
+    read(哈希) 返回正文，归档里没有时返回None（该版本保留索引，读取时按缺失处理）。
+    """
+    prev = None
+    for v in versions:
+        text = read(v["hash"])
+        if text is None:
+            prev = None
+            continue
+        if not has_blob(v["hash"]):
+            if v.get("delta") and prev and delta_depth(prev[0], KEYFRAME_EVERY) < KEYFRAME_EVERY:
+                v["delta"] = put_delta(text, prev[1], prev[0])[1]
+            else:
+                put_blob(text)
+                v["delta"] = False
+        prev = (v["hash"], text)
+
+def version_text(entry):
+    return get_blob(entry["hash"])
+
+def diff_html(a, b, label_a, label_b, context=True):
+    """并排对比表（difflib.HtmlDiff），只显示改动附近的行"""
+    return difflib.HtmlDiff(wrapcolumn=48).make_table(
+        a.splitlines(), b.splitlines(), label_a, label_b, context=context, numlines=2)
+
+def diff_stats(a, b):
+    """(新增行, 删除行)"""
+    add = rem = 0
+    for ln in difflib.unified_diff(a.splitlines(), b.splitlines(), lineterm="", n=0):
+        if ln.startswith("+") and not ln.startswith("+++"):
+            add += 1
+        elif ln.startswith("-") and not ln.startswith("---"):
+            rem += 1
+    return add, rem
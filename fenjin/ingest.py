@@ -0,0 +1,73 @@
+"""流式导入：自动识别编码，分块解码并按章节标题切分"""
+import codecs
+import re
+
+IMPORT_CHUNK_SIZE = 256 * 1024
+
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+CHAPTER_HEADING_RE = re.compile(
+    r'^\s*(?:第\s*[0-9０-９零〇一二两三四五六七八九十百千万]+\s*[章回节卷]|序章|序言|楔子|引子|尾声|后记|番外)[^\n]{0,40}$'
+)
+
+def detect_encoding(sample):
+    """根据文件开头的字节推断编码：BOM > UTF-8 > GB18030（兼容GBK/GB2312）"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for enc in ("utf-8", "gb18030"):
+        try:
+            # final=False：容忍样本末尾被截断的多字节字符
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "gb18030"
+
+def iter_text_chunks(fileobj, encoding, chunk_size=IMPORT_CHUNK_SIZE):
+    """分块读取并增量解码，不把整个文件读进内存"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    while True:
+        raw = fileobj.read(chunk_size)
+        if not raw:
+            break
+        text = decoder.decode(raw)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def iter_lines(chunks):
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        lines = buf.split("\n")
+        buf = lines.pop()
+        for ln in lines:
+            yield ln.rstrip("\r")
+    if buf:
+        yield buf.rstrip("\r")
+
+def split_chapters(lines, default_name):
+    """按「第X章」等标题行切分，逐章产出 (标题, 正文)；无标题时整份文件为一章"""
+    title, body = None, []
+    for ln in lines:
+        if CHAPTER_HEADING_RE.match(ln):
+            content = "\n".join(body).strip()
+            if content:
+                yield (title or default_name, content)
+            title, body = ln.strip(), []
+        else:
+            body.append(ln)
+    content = "\n".join(body).strip()
+    if content:
+        yield (title or default_name, content)
+
+def read_novel(fileobj, default_name):
+    """识别编码后逐章产出，返回 (编码, (章节名, 正文) 生成器)"""
+    sample = fileobj.read(ENCODING_SAMPLE_SIZE)
+    fileobj.seek(0)
+    enc = detect_encoding(sample)
+    return enc, split_chapters(iter_lines(iter_text_chunks(fileobj, enc)), default_name)
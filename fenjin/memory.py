@@ -0,0 +1,69 @@
+"""全局记忆卡：提炼Prompt、JSON解析与紧凑展示"""
+import json
+import re
+
+from .api import request_completion
+
+MEMORY_SYSTEM_PROMPT = "你是微短剧的连续性场记。只根据给定内容更新记忆卡，只输出一个JSON对象，不要任何解释。"
+
+MEMORY_LABELS = [("storyline", "主线"), ("characters", "人物"), ("progress", "进度"),
+                 ("pending_foreshadow", "伏笔"), ("next_foreshadow", "引爆"), ("emotion_track", "情绪")]
+
+MEMORY_EXTRACT_KEYS = ["storyline", "characters", "pending_foreshadow", "next_foreshadow", "emotion_track"]
+
+MEMORY_FIELD_LIMIT = 300
+
+# 逐集生成时，下一集开始前最多等上一集的记忆提炼这么多秒
+MEMORY_WAIT = 60
+
+def build_memory_extraction_prompt(ep, script, mem):
+    old = {k: mem.get(k, "") for k in MEMORY_EXTRACT_KEYS}
+    return f"""以下是截至上一集的记忆卡：
+{json.dumps(old, ensure_ascii=False)}
+
+以下是刚生成的第{ep}集剧本：
+{script}
+
+请结合第{ep}集更新记忆卡，输出JSON，字段如下（每项不超过150字，写当前状态而不是流水账）：
+- storyline：主线到目前为止的一句话概括
+- characters：主要角色当前状态（位置/伤势/关系变化/持有关键道具），用"；"分隔
+- pending_foreshadow：已埋下、尚未回收的伏笔
+- next_foreshadow：下一集应当引爆或推进的伏笔/悬念
+- emotion_track：本集结束时的情绪走向"""
+
+def parse_memory_json(text):
+    """从模型输出中取出JSON记忆卡，只保留已知字段"""
+    if not text:
+        return {}
+    m = re.search(r'\{.*\}', text, re.S)
+    if not m:
+        return {}
+    try:
+        data = json.loads(m.group(0))
+    except json.JSONDecodeError:
+        return {}
+    out = {}
+    for k in MEMORY_EXTRACT_KEYS:
+        v = data.get(k)
+        if isinstance(v, list):
+            v = "；".join(str(x) for x in v)
+        elif isinstance(v, dict):
+            v = "；".join(f"{a}：{b}" for a, b in v.items())
+        if v:
+            out[k] = str(v)[:MEMORY_FIELD_LIMIT]
+    return out
+
+def extract_memory(cfg, ep, script, mem):
+    """后台任务：调用小模型提炼记忆卡（不访问session_state）"""
+    r = request_completion(cfg, [{"role": "user", "content": build_memory_extraction_prompt(ep, script, mem)}],
+                           MEMORY_SYSTEM_PROMPT, temperature=0.2, max_tokens=1024, timeout=90)
+    return parse_memory_json(r)
+
+def memory_card(mem):
+    """紧凑记忆卡：只列出非空字段"""
+    lines = []
+    for k, lb in MEMORY_LABELS:
+        v = (mem.get(k) or "").strip()
+        if v:
+            lines.append(f"📌 {lb}：{'第' + v + '集' if k == 'progress' else v[:MEMORY_FIELD_LIMIT]}")
+    return "\n".join(lines)
@@ -0,0 +1,117 @@
+"""开场方案：六条方案并发各用一次短调用生成（或从一次输出里拆分），按条存储，选择时把整条方案带进剧本Prompt
+
+opening_items 为 [{"n", "label", "text"}]；opening_designs 保存拼好的Markdown，供展示、检索、归档和依赖图使用。
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .api import request_completion
+from .prompts import SYSTEM_PROMPT, build_opening_item_prompt
+
+# 每条方案的开场类型（「：」前为标签）
+OPENING_STYLES = [
+    "悬念倒叙：先抛出最抓人的结果或危机，再回到起点",
+    "冲突直切：从一场正在进行的冲突中段直接切入",
+    "视觉奇观：用一个强烈、反常的画面镇住观众",
+    "台词钩子：用一句角色台词或一个声音先声夺人",
+    "情绪反转：开场营造一种情绪，十秒内翻转",
+    "日常异变：从平静的日常里露出第一个异常",
+]
+OPENING_COUNT = len(OPENING_STYLES)
+OPENING_TEMPERATURE = 0.9
+OPENING_MAX_TOKENS = 1500
+# 一次输出六条时的方案标题：先认「方案3｜…」「### 3. …」「**三、…**」这类明确的标题，认不出再退到行首编号
+OPENING_HEAD_RE = re.compile(
+    r'^[ \t]*(?:#+[ \t]*(?:\*\*)?|\*\*)?[ \t]*(?:开场)?方案[ \t]*([1-6一二三四五六])[ \t]*(?:[\.、．:：)）｜|]|\*\*|$)(.*)$'
+    r'|^[ \t]*(?:#+[ \t]*(?:\*\*)?|\*\*)[ \t]*([1-6一二三四五六])[ \t]*(?:[\.、．:：)）｜|]|\*\*)(.*)$', re.M)
+LOOSE_HEAD_RE = re.compile(r'^[ \t]*()()([1-6一二三四五六])[ \t]*[\.、．:：)）](.*)$', re.M)
+CN_NUM = {c: i for i, c in enumerate("一二三四五六", 1)}
+CHOICE_RE = re.compile(r'^(?:方案)?\s*([1-6])\s*$')
+
+def style_label(style):
+    return style.split("：", 1)[0]
+
+def generate_openings(cfg, context, n=OPENING_COUNT):
+    """并发发出n条方案的请求，按完成顺序返回 ((编号, 开场类型), future)"""
+    jobs = {}
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        for i in range(1, n + 1):
+            style = OPENING_STYLES[(i - 1) % len(OPENING_STYLES)]
+            msgs = context + [{"role": "user", "content": build_opening_item_prompt(i, style, n)}]
+            fut = ex.submit(request_completion, cfg, msgs, SYSTEM_PROMPT, OPENING_TEMPERATURE, OPENING_MAX_TOKENS)
+            jobs[fut] = (i, style)
+        for fut in as_completed(jobs):
+            yield jobs[fut], fut
+
+def design_openings(cfg, context, n=OPENING_COUNT):
+    """无界面版：并发生成并收齐，返回按编号排列的方案；失败的条目跳过，全部失败时抛出最后一个异常"""
+    items, err = [], None
+    for (i, style), fut in generate_openings(cfg, context, n):
+        try:
+            text = fut.result()
+        except Exception as e:
+            err = e
+            continue
+        if text:
+            items.append(make_item(i, style, text))
+    if not items and err:
+        raise err
+    return sorted(items, key=lambda it: it["n"])
+
+def make_item(n, style, text):
+    return {"n": n, "label": style_label(style), "text": text.strip()}
+
+def parse_openings(text):
+    """一次输出的六条方案 → 方案列表；认不出至少两条方案标题时返回空列表"""
+    for regex in (OPENING_HEAD_RE, LOOSE_HEAD_RE):
+        # 编号须依次递增，方案正文里的「1. 2.」小列表不会被当成下一条方案
+        picked = []
+        for m in regex.finditer(text or ""):
+            num = m.group(1) or m.group(3)
+            n = int(num) if num.isdigit() else CN_NUM[num]
+            if n == len(picked) + 1:
+                picked.append((n, m))
+        if len(picked) >= 2:
+            break
+    else:
+        return []
+    items = []
+    for k, (n, m) in enumerate(picked):
+        end = picked[k + 1][1].start() if k + 1 < len(picked) else len(text)
+        body = text[m.end():end].strip()
+        label = (m.group(2) or m.group(4) or "").strip(" *#：:|｜").strip()
+        if body or label:
+            items.append({"n": n, "label": label[:30] or f"方案{n}", "text": body or label})
+    return items
+
+def render_openings(items):
+    return "\n\n".join(f"### 方案{it['n']}｜{it['label']}\n{it['text']}" for it in items)
+
+def store_openings(data, items):
+    """写入方案列表和拼好的Markdown，返回Markdown"""
+    data["opening_items"] = items
+    data["opening_designs"] = render_openings(items)
+    return data["opening_designs"]
+
+def store_opening_text(data, text):
+    """一次调用的输出：拆得出方案就按条存，否则原文保存、不提供按条选择"""
+    items = parse_openings(text)
+    if items:
+        return store_openings(data, items)
+    data["opening_items"] = []
+    data["opening_designs"] = text
+    return text
+
+def opening_text(item):
+    """选中方案带进剧本Prompt的完整文本"""
+    return f"方案{item['n']}｜{item['label']}\n{item['text']}"
+
+def resolve_opening(items, choice):
+    """选择框/手填内容 → 带进剧本Prompt的文本：只填了编号时换成对应方案全文，其余原样返回"""
+    choice = (choice or "").strip()
+    m = CHOICE_RE.match(choice)
+    if m:
+        for it in items:
+            if it["n"] == int(m.group(1)):
+                return opening_text(it)
+    return choice
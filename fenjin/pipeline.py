@@ -0,0 +1,234 @@
+"""无界面生产流程：提炼 → 逐集生成 → 后台记忆提炼/质检，供命令行和脚本调用"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from .analysis import analysis_context, cards_fallback, store_analysis
+from .api import stream_completion
+from .characters import find_characters, select_cards
+from .checks import score_script
+from .deps import find_stale, rebuild, record_analysis, record_episode, record_openings, record_review, split_node, upstream
+from .memory import MEMORY_WAIT, extract_memory
+from .openings import design_openings, store_opening_text, store_openings
+from .prompts import (REVIEW_SYSTEM_PROMPT, SYSTEM_PROMPT, build_analysis_prompt, build_episode_prompt, build_opening_prompt,
+                      build_review_prompt, prompt_id)
+from .templates import record_usage
+
+def analyze(project, cfg, names=None, on_retry=None, structured=False):
+    """第1轮全局提炼，写入 global_analysis、拆分出的各部分和对话历史；structured=True 时要求JSON输出"""
+    ms = [{"role": "user", "content": build_analysis_prompt(project.combined_text(names), structured)}]
+    f, secs = timed(stream_completion, cfg, ms, SYSTEM_PROMPT, on_retry=on_retry)
+    if not f:
+        raise RuntimeError("全局提炼返回为空")
+    text = store_analysis(project.data, f)
+    project.data["messages"] = ms + [{"role": "assistant", "content": text}]
+    project.data["current_step"] = max(project.data["current_step"], 1)
+    record_analysis(project.data, names, cfg["model"], structured)
+    record_usage(project["prompt_stats"], prompt_id("analysis_json" if structured else "analysis"), secs, f)
+    return text
+
+def timed(fn, *args, **kwargs):
+    """在后台线程里计时：返回 (结果, 秒)"""
+    t = time.perf_counter()
+    return fn(*args, **kwargs), time.perf_counter() - t
+
+def generate_episode(cfg, cx, on_retry=None):
+    """后台任务：按给定上下文生成一集（不访问项目状态）"""
+    return stream_completion(cfg, cx, SYSTEM_PROMPT, on_retry=on_retry)
+
+def review_episode(cfg, ep, script, text, cards, prev_ending):
+    """后台任务：第4轮质检"""
+    ms = [{"role": "user", "content": build_review_prompt(ep, script, text, cards, prev_ending)}]
+    return stream_completion(cfg, ms, REVIEW_SYSTEM_PROMPT)
+
+def commit_episode(project, ep, script, cx, source="命令行生成"):
+    """与网页版 commit_episode 相同的收尾：剧本、对话历史、进度、上集末尾"""
+    project.set_episode(ep, script, source)
+    project.data["messages"] = cx + [{"role": "assistant", "content": script}]
+    project.data["current_step"] = max(project.data["current_step"], 3)
+    project.data["memory"]["progress"] = str(ep)
+    ending = project.ending(ep)
+    if ending:
+        project.data["memory"]["last_ending"] = ending
+
+def run(project, cfg, episodes, concurrency=4, review_cfg=None, memory_cfg=None, chain=True,
+        overwrite=False, log=print):
+    """生成指定集数，返回 {"done": [...], "failed": {集数: 错误}, "reviewed": [...]}
+
+    chain=True 时逐集生成，每集都衔接上一集刚生成的结尾，记忆提炼和质检在线程池里并行；
+    chain=False 时各集并发生成，只引用运行前已存在的结尾。每完成一集就写一次备份。
+    """
+    text = project.combined_text()
+    todo = [e for e in episodes if overwrite or e not in project["episodes"]]
+    for e in episodes:
+        if e not in todo:
+            log(f"⏭ 第{e}集已存在，跳过")
+    result = {"done": [], "failed": {}, "reviewed": []}
+    memory_jobs, review_jobs, prev_used = {}, {}, {}
+    # 剧本里认不出角色时，质检按原著里的出场次数取主要角色的驱动卡
+    ranking = find_characters(text, project.characters) if review_cfg else {}
+
+    def on_retry(wait, attempt):
+        log(f"⚠️ API限流，{wait}秒后自动重试（第{attempt}次）")
+
+    def merge_memory(block=False):
+        """按集数顺序合并已完成的记忆提炼结果"""
+        for ep in sorted(memory_jobs):
+            fut = memory_jobs[ep]
+            if not block and not fut.done():
+                continue
+            del memory_jobs[ep]
+            try:
+                upd = fut.result()
+            except Exception as e:
+                log(f"⚠️ 第{ep}集记忆提炼失败：{type(e).__name__}: {e}")
+                continue
+            if upd and ep >= project["memory"].get("extracted_ep", 0):
+                project["memory"].update(upd, extracted_ep=ep)
+
+    def wait_memory(ep):
+        """等第ep集的记忆提炼（最多 MEMORY_WAIT 秒）再合并，下一集才能用上包含它的记忆卡"""
+        if ep in memory_jobs:
+            wait([memory_jobs[ep]], MEMORY_WAIT)
+        merge_memory()
+
+    def opening_for(e):
+        # 网页版选定的开场方案只用于第1集
+        return project.data["selected_opening"] if e == 1 else ""
+
+    def prompt_for(e):
+        pe = project.ending(e - 1) if e - 1 in project["episodes"] else ""
+        if not pe and e == todo[0]:
+            pe = project["memory"].get("last_ending", "")
+        prev_used[e] = bool(pe)
+        pr = build_episode_prompt(e, text, opening_for(e), pe, project["memory"])
+        return project.episode_context(recent=bool(memory_jobs)) + [{"role": "user", "content": pr}]
+
+    def finish(e, cx, script, secs, ex):
+        if not script:
+            result["failed"][e] = "空结果"
+            log(f"❌ 第{e}集返回为空")
+            return
+        commit_episode(project, e, script, cx)
+        record_episode(project.data, e, None, opening_for(e), prev_used[e] and e - 1 in project["episodes"], cfg["model"])
+        record_usage(project["prompt_stats"], prompt_id("episode"), secs, script, score_script(script)["score"])
+        project.save()
+        result["done"].append(e)
+        log(f"✅ 第{e}集：{project.shots(e)}个分镜，{len(script):,}字")
+        if memory_cfg:
+            memory_jobs[e] = ex.submit(extract_memory, memory_cfg, e, script, dict(project["memory"]))
+        if review_cfg:
+            prev = project.ending(e - 1)
+            cards = select_cards(script, project.characters, cards_fallback(project.data), ranking=ranking)
+            review_jobs[e] = ex.submit(timed, review_episode, review_cfg, e, script, text, cards, prev)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="fenjin") as ex:
+        if chain:
+            for e in todo:
+                wait_memory(e - 1)
+                cx = prompt_for(e)
+                log(f"🎬 第{e}集生成中...")
+                try:
+                    script, secs = timed(generate_episode, cfg, cx, on_retry)
+                except Exception as err:
+                    result["failed"][e] = f"{type(err).__name__}: {err}"
+                    log(f"❌ 第{e}集失败：{result['failed'][e]}，停止（后续集需要衔接本集）")
+                    break
+                finish(e, cx, script, secs, ex)
+                if e in result["failed"]:
+                    break
+        else:
+            gen_jobs = {}
+            for e in todo:
+                cx = prompt_for(e)
+                gen_jobs[ex.submit(timed, generate_episode, cfg, cx, on_retry)] = (e, cx)
+            log(f"🎬 并发生成{len(gen_jobs)}集（并发{concurrency}）...")
+            for fut in as_completed(gen_jobs):
+                e, cx = gen_jobs[fut]
+                try:
+                    finish(e, cx, *fut.result(), ex)
+                except Exception as err:
+                    result["failed"][e] = f"{type(err).__name__}: {err}"
+                    log(f"❌ 第{e}集失败：{result['failed'][e]}")
+        for e in sorted(review_jobs):
+            try:
+                project["review_results"][e], secs = review_jobs[e].result()
+                record_review(project.data, e, review_cfg["model"])
+                record_usage(project["prompt_stats"], prompt_id("review"), secs, project["review_results"][e])
+                result["reviewed"].append(e)
+                log(f"🔍 第{e}集质检完成")
+            except Exception as err:
+                log(f"⚠️ 第{e}集质检失败：{type(err).__name__}: {err}")
+        merge_memory(block=True)
+    if result["reviewed"]:
+        project.data["current_step"] = max(project.data["current_step"], 4)
+    project.save()
+    return result
+
+def rebuild_stale(project, cfg, review_cfg=None, concurrency=4, check_models=False, log=print):
+    """只重建过期的产物：上游先完成，互不依赖的节点（各集质检、开场与后续剧本等）并行
+
+    review_cfg 为空时质检用生成模型。返回 rebuild() 的结果，附带本次判定的过期原因 "stale"。
+    """
+    review_cfg = review_cfg or cfg
+    models = {"main": cfg["model"], "review": review_cfg["model"]} if check_models else None
+    stale = find_stale(project.data, models)
+    inputs = project["build_inputs"]
+
+    def names_of(node):
+        return [n for n in inputs[node].get("chapters", {}) if n in project["chapters"]]
+
+    def prepare(node):
+        kind, ep = split_node(node)
+        if kind == "analysis":
+            names = names_of(node)
+            if not names:
+                raise RuntimeError("参与提炼的章节已全部删除")
+            ms = [{"role": "user", "content": build_analysis_prompt(project.combined_text(names), inputs[node].get("structured"))}]
+            return lambda: (stream_completion(cfg, ms, SYSTEM_PROMPT), ms)
+        if kind == "openings":
+            ctx = analysis_context(project.data, "openings")
+            if inputs[node].get("parallel"):
+                return lambda: (design_openings(cfg, ctx), None)
+            ms = ctx + [{"role": "user", "content": build_opening_prompt()}]
+            return lambda: (stream_completion(cfg, ms, SYSTEM_PROMPT), None)
+        if kind == "episode":
+            inp = inputs[node]
+            opening = project.data.get("selected_opening", "") if inp.get("opening") else ""
+            pe = project.ending(ep - 1) if inp.get("prev") else ""
+            pr = build_episode_prompt(ep, project.combined_text(names_of(node) or None), opening, pe, project["memory"])
+            cx = project.episode_context() + [{"role": "user", "content": pr}]
+            return lambda: (generate_episode(cfg, cx), cx)
+        script, text = project["episodes"][ep], project.combined_text()
+        cards = select_cards(script, project.characters, cards_fallback(project.data),
+                             ranking=find_characters(text, project.characters))
+        args = (review_cfg, ep, script, text, cards, project.ending(ep - 1))
+        return lambda: (review_episode(*args), None)
+
+    def commit(node, out):
+        text, ms = out
+        if not text:
+            raise RuntimeError("返回为空")
+        kind, ep = split_node(node)
+        inp = inputs[node]
+        if kind == "analysis":
+            text = store_analysis(project.data, text)
+            project.data["messages"] = ms + [{"role": "assistant", "content": text}]
+            record_analysis(project.data, names_of(node), cfg["model"], inp.get("structured"))
+        elif kind == "openings":
+            if inp.get("parallel"):
+                store_openings(project.data, text)
+            else:
+                store_opening_text(project.data, text)
+            record_openings(project.data, cfg["model"], inp.get("parallel"))
+        elif kind == "episode":
+            commit_episode(project, ep, text, ms, "重建")
+            record_episode(project.data, ep, names_of(node) or None, project.data.get("selected_opening", "") if inp.get("opening") else "",
+                           bool(inp.get("prev")), cfg["model"])
+        else:
+            project["review_results"][ep] = text
+            record_review(project.data, ep, review_cfg["model"])
+        project.save()
+
+    res = rebuild(list(stale), lambda n: upstream(n, inputs[n]), prepare, commit, concurrency, log)
+    res["stale"] = stale
+    return res
@@ -0,0 +1,98 @@
+"""无界面的项目状态：与网页版 session_state / 备份文件同构，可互相打开"""
+from .analysis import analysis_context, parse_analysis
+from .characters import parse_character_cards
+from .history import record_version
+from .openings import parse_openings
+from .scenes import ENDING_TOKEN_BUDGET, SHOT_RE, build_ending_context
+from .store import AUTOSAVE_FILE, content_hash, get_blob, load_project, put_blob, save_project
+from .templates import apply_versions
+
+PROJECT_DEFAULTS = {
+    "chapters": {}, "chapter_order": [], "current_step": 0, "current_episode": 1,
+    "global_analysis": "", "analysis_sections": {}, "opening_designs": "", "opening_items": [],
+    "selected_opening": "", "episodes": {}, "review_results": {},
+    "episode_alternates": {}, "episode_history": {}, "memory": {}, "messages": [], "chat_history": [], "chat_summary": {},
+    "batch_jobs": [], "batch_runs": [], "build_inputs": {}, "prompt_versions": {}, "prompt_stats": {}, "history_archive": {},
+}
+
+class Project:
+    """项目数据 + 备份文件路径；所有写入都在调用线程里完成，后台线程只拿纯数据"""
+
+    def __init__(self, path=AUTOSAVE_FILE):
+        self.path = path
+        self.replace(load_project(path))
+
+    def replace(self, data):
+        """整体换成 data（读入的备份或导入的归档）：缺的字段取默认值，不沿用之前项目的任何内容"""
+        self.data = {k: type(v)() for k, v in PROJECT_DEFAULTS.items()}
+        self.data.update(data)
+        if self.data["global_analysis"] and not self.data["analysis_sections"]:
+            self.data["analysis_sections"] = parse_analysis(self.data["global_analysis"])
+        if self.data["opening_designs"] and not self.data["opening_items"]:
+            self.data["opening_items"] = parse_openings(self.data["opening_designs"])
+        apply_versions(self.data["prompt_versions"])
+        self._chars = ("", {})
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def save(self):
+        save_project(self.data, self.path)
+
+    # ---------- 章节 ----------
+    def add_chapter(self, name, content):
+        """加入章节（重名时追加序号）；相同内容已存在时跳过，返回实际章节名或None"""
+        h = put_blob(content)
+        if any(m["hash"] == h for m in self.data["chapters"].values()):
+            return None
+        base, i = name, 2
+        while name in self.data["chapters"]:
+            name, i = f"{base}({i})", i + 1
+        self.data["chapters"][name] = {"hash": h, "length": len(content)}
+        self.data["chapter_order"].append(name)
+        return name
+
+    def chapter_text(self, name):
+        meta = self.data["chapters"].get(name)
+        return get_blob(meta["hash"]) if meta else ""
+
+    def combined_text(self, names=None):
+        names = self.data["chapter_order"] if names is None else names
+        return "\n\n".join(f"【{n}】\n{self.chapter_text(n)}" for n in names if n in self.data["chapters"])
+
+    # ---------- 剧本 ----------
+    @property
+    def characters(self):
+        """驱动卡索引，随全局提炼变化重建"""
+        ga = self.data["global_analysis"]
+        ah = content_hash(ga) if ga else ""
+        if self._chars[0] != ah:
+            self._chars = (ah, parse_character_cards(ga))
+        return self._chars[1]
+
+    def set_episode(self, ep, text, source="命令行生成"):
+        versions = self.data["episode_history"].setdefault(ep, [])
+        if not versions and ep in self.data["episodes"]:
+            record_version(versions, self.data["episodes"][ep], "初始")
+        record_version(versions, text, source)
+        self.data["episodes"][ep] = text
+
+    def shots(self, ep):
+        return len(SHOT_RE.findall(self.data["episodes"].get(ep, "")))
+
+    def ending(self, ep, budget=ENDING_TOKEN_BUDGET):
+        """第ep集的结尾分镜（供下一集衔接/质检）；该集不存在时返回空串"""
+        script = self.data["episodes"].get(ep)
+        return build_ending_context(script, budget, True, self.characters) if script else ""
+
+    def episode_context(self, recent=False):
+        """与网页版一致：已有自动记忆卡时只带全局提炼那一轮（已拆分时只带需要的部分）
+
+        recent=True 表示还有记忆提炼没完成（记忆卡落后于上一集），这时补上最近一轮生成对话。
+        """
+        head = analysis_context(self.data, "episode")
+        if not self.data["memory"].get("extracted_ep"):
+            return head + self.data["messages"][2:]
+        if recent and len(self.data["messages"]) >= 4:
+            return head + self.data["messages"][-2:]
+        return head
@@ -0,0 +1,685 @@
+"""Prompt模板：系统指令与各轮次的用户Prompt构建（不依赖Streamlit）"""
+from .checks import format_fix_shots
+from .memory import memory_card
+from .scenes import parse_scenes
+from .store import content_hash
+from .templates import load_overrides, register, render, template_id
+
+SYSTEM_PROMPT = """【微短剧生成 3.1 系统指令】
+
+═══════════════════════════════════════
+第零法则：视觉翻译（一切规则之上的规则）
+═══════════════════════════════════════
+
+小说是给眼睛的——读者靠文字在脑中自己生成画面。
+剧本是给画面的——观众只能看到或听到你拍给他看的东西。
+
+你的工作是——把小说用文字"告诉"读者的一切，全部翻译成摄像机能拍到的画面,并用人物的台词（声音）来增加代入感！
+
+禁止对角色OOC，人物的台词、行为、举止都必须符合小说里的人设！
+因此在给核心角色编写每一句台词的时候都要参考【角色驱动卡】
+
+═══════════════════════════════════════
+翻译铁律
+═══════════════════════════════════════
+
+铁律一：小说的"叙述"必须翻译为"动作流"
+铁律二：小说的"心理描写"必须翻译为"身体反应搭配角色内心独白"
+铁律三：小说的"设定/背景交代"必须翻译为"环境展示"
+铁律四：台词的正确用法——塑造起人物
+
+═══════════════════════════════════════
+台词的黄金法则
+═══════════════════════════════════════
+
+【核心原则：台词是角色性格的DNA标签，不是越短越好】
+
+不同角色必须有截然不同的说话方式，这比"精简"重要一万倍。
+
+举例——同样表达"危险，快走"：
+· 暴躁军人："都他妈愣着干嘛？撤！现在！"
+· 冷静医生："情况不对。我们需要立刻离开这里。"
+· 怂包少年："哥、哥哥……那个……咱能不能……先……"
+· 傲娇大小姐："谁要跟你们一起跑了。……哼，不过本小姐今天刚好也想换个地方。"
+· 老练杀手：（一言不发，直接拽起对方就走）
+· 话痨技术宅："等等等等，我算了一下，按它的速度和我们的距离，大概还有47秒——不对，43秒，快跑快跑快跑！"
+
+长短取决于角色性格，不取决于"精简原则"。
+
+【台词长短的真实规律】
+→ 角色性格决定基础句长
+→ 情绪类型决定变化方向：
+  · 暴怒/恐惧/震惊 → 比平时更短（但话痨的"短"可能仍然比沉默角色的"长"要长）
+  · 紧张/兴奋/炫耀 → 比平时更长更碎
+  · 压抑/隐忍/心碎 → 说一半吞回去、词不达意、答非所问
+→ 关系决定说话方式：同一角色面对不同人说话不同
+
+【绝对禁止的台词方式】
+❌ 把所有角色台词统一缩短到2-4个字——会让所有角色都像"高冷人设"
+❌ 删掉角色口头禅、语气词——那是角色灵魂
+❌ 把话痨改成惜字如金——那是OOC
+❌ 台词和画面分开写——必须嵌入画面流中
+
+═══════════════════════════════════════
+★★★ 分镜格式铁律（最重要的格式规范）★★★
+═══════════════════════════════════════
+
+【铁律A：台词必须嵌入画面动作流中】
+
+台词不是单独一行，台词必须出现在它被说出的那个精确时间位置上，
+和此刻正在发生的动作、表情、身体状态写在一起。
+
+❌ 绝对禁止的格式（台词与画面分离）：
+```
+画面：[秦洛打响指，电流在指尖炸开，许多多被吓得后弹]
+秦洛："看，技能点。"
+许多多OS：（他有异能？！）
+音效：电流滋滋声
+```
+问题：读者/导演不知道"看，技能点"这句话是在打响指前说的？还是后弹之后说的？
+
+✅ 正确格式（台词嵌入动作流的精确时间点）：
+```
+秦洛带着战术手套的手指伸进毯子边缘——
+啪！响指。一簇幽蓝电流在指尖炸开（音效：尖锐滋滋声），
+电光照亮整个角落。
+秦洛（得意挑眉，嘴角歪向左边）："看。哥的技能点。"
+许多多灰白的瞳孔骤然收缩——身体本能后弹，
+后背撞在车厢壁上。
+许多多一脸诧异，OS：（异能？！他……真的有异能？！）
+```
+
+规则：
+1. 台词出现在它被说出的精确时间点——在哪个动作之后、哪个动作之前
+2. 台词前面必须紧跟说话时的【情绪状态+面部表情+身体动作】
+3. 内心OS出现在角色产生这个想法的精确时刻
+4. 音效出现在发出声音的那个动作旁边，用（）标注
+
+【铁律B：说台词时必须描写说话者的完整状态】
+
+每一句台词前面，必须包含以下三要素中的至少两个：
+
+① 情绪/语气标签：（低沉、暴怒、故作轻松、嘴硬但声音发颤、咬牙切齿……）
+② 面部表情：（挑眉、眼神躲闪、下颌收紧、瞳孔放大、嘴角抽搐……）
+③ 身体动作：（双手插兜、指尖点桌面、侧过头不看对方、攥紧拳头……）
+
+❌ 禁止的写法（裸台词）：
+秦洛："抱紧点。"
+
+✅ 正确的写法：
+秦洛低头看她，故意把表情板得很凶（但声音不自觉放软了）："抱紧点。掉下去被变异兽叼走，真就是一口一个小丧尸。"
+
+✅ 更好的写法：
+秦洛低头——本来想摆出教训小孩的凶脸，
+但看到她灰白大眼睛滴溜溜乱转的样子，
+喉结不自觉滚了一下，声音硬拽着往下压：
+"抱紧点。掉下去被变异兽叼走，真就是一口一个小丧尸。"
+他说完下意识把手臂往上紧了紧——
+这个动作和他嘴里的威胁完全矛盾。
+→ 观众同时看到：凶脸+放软的声音+收紧的手臂 = 嘴硬心软，全员心动。
+
+
+【铁律D：好莱坞级动作奇观与镜头语法（视觉爆发力法则）】
+当遇到射击、异能释放、巨兽袭击等战斗时刻，绝对禁止平铺直叙！
+必须调用以下“高级镜头调度语法”，制造强烈的视觉冲击力：
+
+1. 【子弹时间（Bullet Time）与微距跟踪】：
+必须写出时间膨胀感。例如：慢动作特写子弹出膛，枪口震荡出扭曲的空气涟漪（空气阻力），镜头死死死贴着高速旋转的弹头（跟踪镜头），随后瞬间恢复正常语速，子弹狠狠掼入目标。
+2. 【快慢速切（升降格）】：
+动作极静与极动的瞬间切换。例如：上一秒是缓慢滴落的汗水或慢动作的后坐力震颤（升格），下一秒瞬间切为巨兽轰然倒塌的极速狂暴画面（降格/正常速）。
+3. 【极速推镜（Crash Zoom）】：
+瞬间拉近距离制造压迫感。例如：镜头从全景瞬间推至变异大象充满血丝的浑浊巨眼特写。
+4. 【感官剥夺与音效反差】：
+在最爆裂的动作前，先制造死寂。例如：枪响后，所有环境音瞬间消失，只剩尖锐的耳鸣声，随后再爆发巨兽砸地的震天轰鸣。
+
+❌ 错误的干瘪描述：
+白述开枪。子弹射中大象。大象倒下（2s）。
+
+✅ 完美的动作奇观分镜示范（实算时长依然只要2-3秒）：
+【镜头极速推近】特写白述扣下扳机的食指——砰！
+【慢动作/子弹时间】枪口喷出炽热的火舌，巨大的后坐力震起他发梢的灰尘。一颗大口径穿甲弹撕裂夜风，弹头挤压空气形成一圈圈扭曲的水波纹阻力（1.5s）。
+【镜头死死跟踪弹头】子弹在半空划出致命的红线，瞬间加速（快慢切）——噗嗤！精准绞碎变异巨象布满血丝的右眼！（1s）
+
+【铁律F：真实三维物理与空间逻辑法则（反降智/反常识预警）】
+AI经常因为追求“动作酷炫”而写出违背人体工学和物理常识的动作（例如：坐在越野车副驾驶的人，由于腿部空间受限，绝对不可能用脚直接踹回头顶的天窗！这属于毫无常识的低级漏洞）。
+
+在编写任何动作前，必须在脑中运行【三维物理模拟器】：
+1. 【空间与人体工学】：角色所处的空间有多大？姿势是什么？（狭窄车厢内无法挥舞长柄武器；坐姿无法向正上方高抬腿踹门；打开车顶天窗在真实情况中只能是用手砸/推）。
+2. 【动线与发力逻辑】：动作必须符合真实的物理发力方式。
+3. 【重力与惯性】：高速行驶的车辆上，人探出车外会被狂风吹得极难稳定，必须有明确的物理支撑点（如：一手死死抓住窗框边缘）。
+4. 【道具溯源】：角色手里拿的道具、开枪的子弹，必须有明确的来源和合理的存放位置，严禁凭空变出物品。
+
+🚨 强制指令：如果小说原著的描写本身违背了物理常识或逻辑漏洞，你必须在影视化翻译时，【自动将其修正】为符合真实物理逻辑的动作！绝对不允许照搬原著的降智设定！
+
+【铁律G：反应镜头与“活体”法则（严禁角色道具化）】
+AI常犯的致命错误：只描写正在说话或打斗的人，把旁边不说话、或者处于“被抱着/背着/牵着”的角色写成没有生命的“木头”或“背包”，导致角色看起来极度空洞、像个假人。
+在影视剧中，只要角色在画面内，哪怕是背景板，哪怕不说话，也必须有属于角色性格的描述！
+
+🚨 强制指令：
+1. 【非说话者的反应镜头】：当A在长篇大论或激烈行动时，必须给画面内的B（尤其是核心角色）穿插0.5-1.5秒的【反应镜头】（微表情、翻白眼、手指抓紧、眼神躲闪或呼吸变化）。
+2. 【被动状态的微细节】：如果角色处于“被抱着/拉着”的被动状态（如丧尸许多多），必须描写她/他的身体反馈和感官动作。
+❌ 错误的空洞描写（像抱了个道具）：秦洛单臂托抱着许多多，大步流星走着。陈小飞跑过来说话。
+✅ 正确的活体描写（鲜活感拉满）：秦洛单臂托抱着许多多往前走。许多多像无尾熊一样死死搂着他的脖子，灰蒙蒙的眼睛滴溜溜地四下乱转，听到陈小飞激动的声音时，她迟钝地歪了歪脑袋，咬了咬自己的手指（1.5s）。
+
+═══════════════════════════════════════
+灵魂锚定
+═══════════════════════════════════════
+你不是在"把小说改成剧本"。你是在替这些角色活一遍。
+产品规格：每集分镜数量自由抉择 | 无第三人称旁白 | 集集强钩子。
+
+═══════════════════════════════════════
+五条创作铁律
+═══════════════════════════════════════
+①【人设即法律】角色的性格、说话方式、行为逻辑必须95%忠于原著。
+②【外化】一切"想、觉得、心痛、暗爽"必须转化为可拍摄的具体画面。允许第一人称内心OS，严禁第三人称旁白。
+③【伏笔】每一个重大转折之前，必须存在至少一个视觉/听觉微伏笔。
+④【潜台词】角色嘴上说的话与真实意图之间必须存在缝隙。台词传递表面意思，身体泄露真相。
+⑤【钩子铁律】前15秒必须制造具体的疑问或情绪冲击。每集结尾必须制造悬念。集内至少一次情绪急转。
+
+═══════════════════════════════════════
+角色驱动卡系统
+═══════════════════════════════════════
+为每个主要角色建立驱动卡，每次写台词/行为时必须调用：
+· 核心人格（一句话定义）
+· 说话DNA：句式习惯/口头禅/绝对不说的话/示范原句
+· 行为DNA：愤怒/心软/恐惧/说谎/得意时的物理反应
+· 红线（绝对不做的事）
+· 关系动态
+
+校验：每句台词→"遮住角色名能猜出是谁？"→不能→重写。
+
+═══════════════════════════════════════
+画面描写规律
+═══════════════════════════════════════
+→ 必须有一个"不寻常的具体细节"
+→ 用声音锚定空间（沉默场景更需要微小声音来放大沉默）
+→ 光源必须具体
+→ 身体失控比表情形容词有力一万倍
+→ 反差动作比直球动作有力
+
+═══════════════════════════════════════
+完整剧本格式示范
+═══════════════════════════════════════
+白天
+秦洛带着战术手套的手指伸进毯子边缘——
+啪！响指。一簇幽蓝电流在指尖炸开，
+电光瞬间照亮整个角落（音效：尖锐滋滋声）。
+秦洛得意地挑起左边眉毛，嘴角歪出一个欠揍的弧度：
+"看。哥的技能点。生存手册上没这玩意儿吧？"
+许多多灰白的瞳孔骤然收缩——
+身体本能地向后一弹，后背撞在车厢铁壁上，
+发出沉闷的一声响（音效：后背撞击闷响）。
+她的手指不自觉攥紧了毯子边缘，指甲陷进绒毛里。
+许多多OS：（异能……是真的存在的？
+那他们能活到现在……就是靠这个？）
+
+格式要点：
+1. 台词嵌入在动作流的精确时间位置
+2. 台词前紧跟说话者的表情+情绪+身体状态
+3. 内心OS在角色产生想法的时刻出现
+4. 音效用（）标注在发声的动作旁边
+
+═══════════════════════════════════════
+题材引擎
+═══════════════════════════════════════
+【需要观众爽】→ 弹簧法
+【需要观众心动】→ 磁铁法
+【需要观众虐】→ 错位法
+【需要观众紧张】→ 橡皮筋法
+【需要观众笑】→ 错位法
+
+═══════════════════════════════════════
+工作流
+═══════════════════════════════════════
+【第1轮：全局提炼】故事核心、角色驱动卡、大纲、核心节点、逻辑链、氛围基调、视觉强场景
+【第2轮：开场手法设计】6条不同方案，含前30秒逐秒画面
+【第3轮：剧本生成】编剧内心独白+结构速写+角色调用+影视化排雷+完整分镜
+【第4轮：自检与优化】五个敌对视角+量化打分+细节清单"""
+
+REVIEW_SYSTEM_PROMPT = """你是一个专业的微短剧分镜质检专家。对照小说原文，对每一条分镜进行严格的质量检查。
+
+必须切换为以下五个敌对视角，逐一对整集发起攻击：
+
+【视角1：普通观众（刷短视频的路人）】
+- 哪里看不懂？哪里无聊想跳过？
+- 我能不能在完全不知道原著的情况下看懂这一集？
+- 结尾够不够让我点"下一集"？
+- 输出：作为路人观众，我会在第X秒划走，因为______
+
+【视角2：竞品编剧与逻辑警察（想找你毛病的同行）】
+- 【常识与物理排雷】：哪个动作描写是毫无常识、违背物理定律或人体工学的？（例如坐着高抬腿踹天窗、狭窄空间挥舞大剑、重力环境下的反牛顿动作等低级错误）
+- 哪些分镜是"偷懒"的？（用台词代替画面、用旁白交代信息）
+- 哪些情绪转折是"硬拗"的？（缺少铺垫就突然转变）
+- 整体节奏有没有拖沓或跳跃？
+- 输出：如果我是竞品，我会狠狠嘲笑你第X分镜的______动作完全违背了物理常识，在现实拍摄中应该修改为______。
+
+【视角3：原著粉（对人设极度敏感的读者）】
+- 哪个角色被OOC了？具体哪句话/哪个行为违背原著？
+- 哪些核心情节被改掉了？改得合不合理？
+- 角色关系的化学反应够不够？
+- 原著中最打动人的情感核心有没有被保留？
+- 输出：作为原著粉，我最不能接受的是______，因为原著中______
+
+【视角4：剪辑师（负责后期剪辑的技术人员）】
+- 哪些分镜时长虚标？（标10秒但内容只够5秒，或标10秒但内容需要20秒）
+- 哪些分镜之间缺少衔接点？（上一镜结尾画面和下一镜开头画面接不上）
+- 哪些分镜的动作描写不够精确，导致我无法判断镜头怎么拍？
+- 有没有分镜的画面信息过载（一个镜头里塞了太多东西）？
+- 台词和画面的时间关系清楚吗？我能判断台词在哪个动作时说出吗？
+- 输出：作为剪辑师，我剪不动的地方是______，因为______
+
+【视角5：导演（对整体质量负责的决策者）】
+- 这集的"记忆点"是什么？观众看完能记住的画面是什么？
+- 情绪曲线画出来是什么形状？有没有平坦段？
+- 演员拿到这个剧本，能不能直接演？还是会来问我"这里怎么演"？
+- 整集的视觉风格统一吗？有没有某个分镜画风突变？
+- 如果只能保留3个分镜，我保留哪3个？其余的有没有可以合并或删除的？
+- 画面里的“不说话”或处于“被动（被抱/被牵/）”的角色，是否被忽略，没有给符合（剧情/性格）的（微表情/动作）和反应镜头？
+- 输出：作为导演，我最想重拍的是分镜______，最满意的是分镜______
+
+【重点检查项：台词三合一】
+对每句台词检查：
+- 嵌入位置：这句话在动作流的哪个时间点说出？读者能否判断？
+- 说话状态：说这句话时人物的表情、情绪、身体动作是否描写了？
+- 角色DNA：这句话符合角色的说话习惯吗？
+
+
+对每条分镜逐一输出检查报告，最后给出整集汇总。
+7分以下必须给出具体修改方案。"""
+
+# ---------- 用户Prompt模板（注册到模板表，修改措辞请注册新版本或递增版本号） ----------
+register("analysis", 1, """【微短剧3.1启动】
+
+以下是需要改编的小说原文：
+
+{text}
+
+请执行【第1轮：全局提炼】，输出：
+1. 一句话故事核心
+2. 每个主要角色的【驱动卡】（必须从原著提取原句作为说话DNA示范，特别注意每个角色的说话习惯差异）
+3. 故事大纲（分阶段）+ 各阶段核心情绪类型
+4. 必须保留的核心情节节点（10-20个）
+5. 需要补充的逻辑链节点
+6. 全剧环境/氛围基调 + 天气光影变化建议
+7. 视觉强场景与短剧记忆点（5-8个瞬间，每个3-5句具体画面描述）""")
+
+register("analysis_json", 1, """【微短剧3.1启动】
+
+以下是需要改编的小说原文：
+
+{text}
+
+请执行【第1轮：全局提炼】，只输出一个JSON对象（不要任何解释），字段如下：
+- core：一句话故事核心
+- cards：主要角色驱动卡数组，每项 {{"name": 角色名, "card": 驱动卡正文}}（必须从原著提取原句作为说话DNA示范，特别注意每个角色的说话习惯差异）
+- outline：故事大纲（分阶段）+ 各阶段核心情绪类型
+- beats：必须保留的核心情节节点数组（10-20个）
+- logic：需要补充的逻辑链节点
+- tone：全剧环境/氛围基调 + 天气光影变化建议
+- visuals：视觉强场景与短剧记忆点数组（5-8个瞬间，每个3-5句具体画面描述）""")
+
+register("openings", 1, """请执行【第2轮：开场手法设计】
+
+输出6条完全不同的第1集开场方案，每条包含：
+- 开场类型标签
+- 前30秒逐秒画面描述
+- 30秒后如何衔接主线""")
+
+register("opening_one", 1, """请执行【第2轮：开场手法设计】—— 第{n}/{total}条方案
+
+只设计1条第1集开场方案，开场类型：{style}
+包含：
+- 开场类型标签
+- 前30秒逐秒画面描述
+- 30秒后如何衔接主线
+
+直接输出这一条方案的正文，不要写其他方案。""")
+
+register("episode_prev", 1, """
+═══════════════════════════════════════
+🔗 上集末尾（必须衔接）
+═══════════════════════════════════════
+以下是上一集的结尾分镜，本集第一个分镜必须与之自然衔接：
+- 画面衔接：本集开场画面必须接上上集最后的"衔接点"
+- 情绪衔接：延续上集结尾的情绪氛围（可以延续也可以反转，但不能无视）
+- 时空衔接：注意角色的物理位置、状态、穿着与上集保持一致
+- 如果上集结尾有悬念钩子，本集需要在合适时机回应
+
+上集末尾内容：
+{prev_ending}
+""")
+
+register("episode", 1, """请执行【第3轮：剧本生成】—— 第{ep}集
+{memory}
+{prev}
+{opening}
+
+参考小说原文：
+{text}
+
+严格执行前置ABCD，然后输出完整分镜剧本。
+
+【分镜格式强制要求——必须严格遵守】
+
+1. 台词必须嵌入画面动作流中，出现在它被说出的精确时间位置
+   不允许把台词单独放在画面描写下面！
+
+2. 每句台词前面必须紧跟说话者的：
+   - 情绪/语气（低沉/暴怒/故作轻松/嘴硬但声音发颤……）
+   - 面部表情（挑眉/眼神躲闪/下颌收紧/嘴角抽搐……）
+   - 身体动作（双手插兜/侧过头/攥拳……）
+   至少写两个。
+
+3. 内心OS出现在角色产生想法的那个时刻
+
+4. 音效用（）标注在发声动作旁边
+
+5.遇到动作戏/危机爆发，必须写出专业镜头语句，并强制调用【好莱坞级镜头语法】：
+   - 必须出现“特写”、“跟踪镜头”、“慢动作/子弹时间”、“极速推拉”等导演术语！
+   - 必须描写空气扭曲、后坐力、弹道轨迹、巨兽体型压迫感等视觉奇观！
+   - 你可以用100-200字去极致描绘一发子弹破空的空气阻力，即使这段描写的实算时长只有2-3秒。
+
+6.动作生成前置排雷（物理与常识校验）：
+   - 写每一个动作前，检查是否符合物理常识（副驾驶怎么踹天窗？手被绑在背后怎么开枪？）。
+   - 发现原著有逻辑硬伤，必须自动用符合常识的合理动作替换，并在内心独白的【影视化排雷】中注明修改原因
+
+7.严禁角色“道具化”发呆：
+   - 画面中如果不说话的核心角色（特别是被抱着/牵引着的角色/站着背景的角色），绝对不能变成空洞的背景板！
+   - 必须强制穿插他们的【反应镜头】（微表情/眼神乱转/小动作/身体反馈），赋予他们鲜活的生命感！
+
+示范格式：
+【分镜x】
+[角色动作描写]——
+[继续动作/变化]（音效：xxx）。
+角色A（情绪描写+表情+身体状态）："台词内容"
+[另一角色的反应动作]。
+角色B（情绪描写+表情+身体状态） OS：（内心独白内容）""")
+
+register("review", 2, """请对第{ep}集剧本执行完整的【第4轮：自检与优化】。
+
+【小说原文】
+{text}
+{cards}{prev}
+【剧本分镜】
+{script}
+
+请严格按照以下内容逐一执行，不得遗漏任何部分：
+
+【重点2：台词嵌入度】
+每句台词是否嵌入在画面动作流的精确位置？
+还是单独另起一行与画面分离？
+
+【重点3：台词情绪描写】
+每句台词前面是否描写了说话者当时的情绪+表情+身体状态？
+还是"裸台词"（只有角色名+台词内容）？
+
+【第二部分：五个敌对视角攻击】
+质检完所有分镜后，切换为以下五个视角逐一攻击整集：
+
+视角1——普通观众（刷短视频的路人）：
+不看原著能看懂吗？有代入感吗？
+→ 输出："我会在第X秒划走，因为______"
+
+视角2——竞品编剧（找毛病的同行）：
+哪些情节不连贯？哪些情绪硬拗？哪些台词不符合角色人设？
+→ 输出："我会攻击你的______，并用______做得更好"
+
+视角3——原著粉（人设敏感的读者）：
+哪个角色OOC？核心情节被改了吗？主角戏份有变少吗？情感核心保留了吗？
+→ 输出："最不能接受______，因为原著中______"
+
+视角4——剪辑师（后期技术人员）：
+时长虚标？缺衔接点？动作不够精确？画面信息过载？台词时间关系清楚吗？
+→ 输出："剪不动的地方是______，因为______"
+
+视角5——导演（整体质量负责人）：
+记忆点是什么？情绪曲线形状？演员能直接演吗？视觉风格统一吗？
+→ 输出："最想重拍分镜______，最满意分镜______"
+
+【逐分镜评分格式（必须遵守，自动修改据此定位）】
+每条分镜的检查报告单独成节，第一行写「【分镜N】评分：X/10」，紧跟该分镜的问题和修改方案；
+所有分镜之后再输出五个视角和整集汇总。
+
+输出检查报告+汇总。7分以下必须给修改方案。""")
+
+register("review_fix", 1, """根据质检意见修改第{ep}集中评分不达标的分镜，其余分镜不需要输出。
+
+【质检意见】
+{notes}
+
+【修改格式要求】
+1. 台词必须嵌入画面动作流（不能单独分行）
+2. 每句台词前必须有情绪+表情+身体描写
+3. 时长必须实算
+4. 台词个性化（不能统一精简）
+5. 保持分镜编号不变，与前后分镜的画面、情绪自然衔接
+{context}
+【待修改分镜】
+{shots}
+
+只输出修改后的这些分镜，每个以【分镜N】开头，不要输出其他内容。""")
+
+register("review_shots", 1, """第{ep}集以下分镜已按质检意见修改，请只复检这些分镜。
+{cards}
+【上次质检意见】
+{notes}
+
+【修改后的分镜】
+{shots}
+
+逐条输出：第一行「【分镜N】评分：X/10」，然后说明上次的问题是否已解决、仍存在的问题；7分以下必须给修改方案。
+不要输出五个视角和整集汇总。""")
+
+register("format_fix", 1, """第{ep}集以下分镜存在格式问题，请只修正这些分镜。
+
+【问题清单】
+{notes}
+
+【修正要求】
+1. 每句台词前写出说话者的情绪/表情/身体动作（至少两个），台词嵌入动作流
+2. 音效用（音效：xxx）标注在发声动作旁边，不单独成行
+3. 不使用「画面：」单独成行，把画面写进动作流
+4. 每个分镜标题带（实算Xs）
+5. 保持分镜编号、剧情、台词内容不变，只改格式
+
+【待修正分镜】
+{shots}
+
+只输出修正后的这些分镜，每个以【分镜N】开头，不要输出其他内容。""")
+
+JUDGE_SYSTEM_PROMPT = "你是微短剧总编审。比较多个候选剧本，只输出JSON。"
+
+register("judge", 1, """以下是第{ep}集的{count}个候选剧本。
+按：开场15秒冲击力、台词是否符合角色DNA、画面是否可拍、结尾钩子，选出最好的一个。
+
+{candidates}
+
+只输出JSON：{{"best": 候选编号, "reason": "一句话理由"}}""")
+
+register("dialogue", 1, """台词优化第{ep}集。
+
+{character_info}
+
+【核心：台词优化≠精简！而是个性化+潜台词化+情绪匹配】
+
+优化步骤：
+1. 确认每个角色的说话DNA
+2. 逐句检查：个性标签、情绪匹配、潜台词深度、关系动态
+3. 补充台词前的情绪/表情/身体描写（如果缺失）
+4. 确保台词嵌入在画面动作流的正确时间位置
+
+❌ 禁止：统一缩短/删口头禅/让话痨变沉默/台词与画面分离
+✅ 要求：每处修改标注原因+关联角色DNA
+
+当前剧本：
+{script}
+
+输出优化后完整剧本。""")
+
+register("visual", 1, """画面优化第{ep}集。
+
+要求：
+1. 不寻常具体细节（声音/光影/微动作）
+2. 声音锚定空间
+3. 光源具体化
+4. 身体失控＞表情形容词
+5. 反差动作＞直球动作
+6. 每分镜≥5个动作事件（有时间流动感）
+7. 台词保持嵌入式格式不变
+8. 实算时长不变
+
+当前剧本：
+{script}
+
+输出优化后完整剧本，修改处标注【🎨】。""")
+
+register("emotion", 1, """情绪优化第{ep}集。
+
+要求：
+1. 开场15秒足够冲击
+2. 集内至少一次情绪急转
+3. 结尾悬念钩子
+4. 情绪曲线有起伏
+5. 题材引擎（弹簧法/磁铁法/错位法/橡皮筋法）
+6. ≥65%转折来自互动
+7. 台词格式和嵌入方式不变
+
+当前剧本：
+{script}
+
+输出优化后完整剧本，修改处标注【❤️】。""")
+
+register("chat", 1, """{summary}{passages}
+【问题】
+{question}
+
+请结合以上资料回答；资料里没有的内容直接说明，不要编造剧情。""")
+
+register("chat_summary", 1, """把下面的新对话并入已有摘要，输出更新后的摘要（不超过300字）。
+保留：用户的偏好与决定、已确认的修改方向、尚未解决的问题；省略寒暄和已过时的细节。
+
+【已有摘要】
+{summary}
+
+【新对话】
+{turns}
+
+只输出摘要正文。""")
+
+# 工作目录下 prompt_templates/ 里的额外版本（名称@版本.txt）
+load_overrides()
+
+# 依赖图里各类产物用到的模板；系统指令不走模板表，哈希一并计入
+KIND_TEMPLATES = {
+    "analysis": (SYSTEM_PROMPT, ("analysis",)),
+    "analysis_json": (SYSTEM_PROMPT, ("analysis_json",)),
+    "openings": (SYSTEM_PROMPT, ("openings",)),
+    "opening_one": (SYSTEM_PROMPT, ("opening_one",)),
+    "episode": (SYSTEM_PROMPT, ("episode", "episode_prev")),
+    "review": (REVIEW_SYSTEM_PROMPT, ("review",)),
+    "dialogue": (SYSTEM_PROMPT, ("dialogue",)),
+    "visual": (SYSTEM_PROMPT, ("visual",)),
+    "emotion": (SYSTEM_PROMPT, ("emotion",)),
+    "review_fix": (SYSTEM_PROMPT, ("review_fix",)),
+    "review_shots": (REVIEW_SYSTEM_PROMPT, ("review_shots",)),
+    "format_fix": (SYSTEM_PROMPT, ("format_fix",)),
+    "judge": (JUDGE_SYSTEM_PROMPT, ("judge",)),
+    "chat": (SYSTEM_PROMPT, ("chat",)),
+}
+
+def prompt_id(kind):
+    """某类产物当前的Prompt标识（启用的模板ID + 系统指令哈希），记录在产物的生成输入里"""
+    system, names = KIND_TEMPLATES[kind]
+    return "+".join([template_id(n) for n in names] + [f"system#{content_hash(system)[:8]}"])
+
+def build_analysis_prompt(text, structured=False):
+    """structured=True 时要求按七个字段输出JSON（见 fenjin.analysis）"""
+    return render("analysis_json" if structured else "analysis", text=text)
+
+def build_opening_prompt():
+    return render("openings")
+
+def build_opening_item_prompt(n, style, total=6):
+    """并发生成时单条方案的请求（见 fenjin.openings）"""
+    return render("opening_one", n=n, total=total, style=style)
+
+def build_episode_prompt(ep, text, opening="", prev_ending="", memory=None):
+    card = memory_card(memory or {})
+    mem_str = f"\n【全局记忆卡】\n{card}" if card else ""
+    if prev_ending and prev_ending.strip():
+        prev_str = render("episode_prev", prev_ending=prev_ending)
+    else:
+        prev_str = "\n（本集为第一集或新篇章开始，无需衔接上集）\n"
+    return render("episode", ep=ep, memory=mem_str, prev=prev_str, text=text,
+                  opening="选择的开场方案：" + opening if opening else "")
+
+def build_review_prompt(ep, script, text, character_cards="", prev_ending=""):
+    cards = f"\n【出场角色驱动卡】\n{character_cards}\n" if character_cards else ""
+    prev = f"\n【上集末尾（检查本集开场是否衔接）】\n{prev_ending}\n" if prev_ending else ""
+    return render("review", ep=ep, text=text, cards=cards, prev=prev, script=script)
+
+def build_dialogue_optimization_prompt(ep, script, character_cards=""):
+    character_info = f"\n【角色驱动卡参考】\n{character_cards}\n" if character_cards else ""
+    return render("dialogue", ep=ep, character_info=character_info, script=script)
+
+def build_visual_optimization_prompt(ep, script):
+    return render("visual", ep=ep, script=script)
+
+def build_emotion_optimization_prompt(ep, script):
+    return render("emotion", ep=ep, script=script)
+
+def _shot_edges(scenes, num):
+    """分镜 num 的前一镜结尾两行 + 后一镜开头两行（只作衔接参考）"""
+    nums = sorted(scenes)
+    i = nums.index(num)
+    before = scenes[nums[i - 1]].strip().splitlines()[-2:] if i > 0 else []
+    after = scenes[nums[i + 1]].strip().splitlines()[:3] if i + 1 < len(nums) else []
+    return before, after
+
+def build_review_fix_prompt(ep, script, failing):
+    """定向修改：只发送不达标的分镜、它们的质检意见和相邻分镜的衔接行"""
+    scenes = {sc["num"]: sc["text"] for sc in parse_scenes(script)}
+    bad = [n for n in sorted(failing) if n in scenes]
+    ctx = []
+    for n in bad:
+        before, after = _shot_edges(scenes, n)
+        if before and n - 1 not in failing:
+            ctx.append(f"（分镜{n}之前）\n" + "\n".join(before))
+        if after and n + 1 not in failing:
+            ctx.append(f"（分镜{n}之后）\n" + "\n".join(after))
+    context = "\n【相邻分镜（只作衔接参考，不要输出）】\n" + "\n\n".join(ctx) + "\n" if ctx else ""
+    return render("review_fix", ep=ep, notes="\n\n".join(failing[n] for n in bad), context=context,
+                  shots="\n\n".join(scenes[n] for n in bad))
+
+def build_format_fix_prompt(ep, script, issues):
+    """格式修复：只把有问题的分镜和对应问题发给模型（issues 见 fenjin.checks.validate_script）"""
+    bad = format_fix_shots(issues)
+    scenes = {sc["num"]: sc["text"] for sc in parse_scenes(script)}
+    notes = "\n".join(f"- 分镜{i['shot']}：{i['msg']}" + (f"｜{i['line']}" if i["line"] else "") for i in issues if i["shot"] in bad)
+    return render("format_fix", ep=ep, notes=notes, shots="\n\n".join(scenes[n] for n in bad if n in scenes))
+
+def build_judge_prompt(ep, candidates):
+    """多候选评审：过长的候选只带开头和结尾"""
+    parts = []
+    for i, c in enumerate(candidates, 1):
+        t = c["text"]
+        excerpt = t if len(t) <= 3000 else t[:2500] + "\n……\n" + t[-500:]
+        parts.append(f"【候选{i}】（本地评分{c['score']['score']}）\n{excerpt}")
+    return render("judge", ep=ep, count=len(candidates), candidates="\n\n".join(parts))
+
+def build_shot_review_prompt(ep, shots, notes, character_cards=""):
+    """复检：shots 为 {分镜号: 新文本}，notes 为 {分镜号: 上次意见}"""
+    cards = f"\n【出场角色驱动卡】\n{character_cards}\n" if character_cards else ""
+    return render("review_shots", ep=ep, cards=cards, notes="\n\n".join(notes[n] for n in sorted(shots) if n in notes),
+                  shots="\n\n".join(shots[n] for n in sorted(shots)))
+
+def build_chat_prompt(question, passages, summary=""):
+    """passages 为检索到的段落（含 label/text）"""
+    summary = f"【此前对话摘要】\n{summary}\n" if summary else ""
+    ctx = "\n\n".join(f"〔{p['label']}〕\n{p['text']}" for p in passages)
+    return render("chat", summary=summary, question=question,
+                  passages=f"\n【相关资料（按问题检索）】\n{ctx}\n" if ctx else "")
+
+def build_chat_summary_prompt(summary, turns):
+    lines = "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}：{m['content']}" for m in turns)
+    return render("chat_summary", summary=summary or "（无）", turns=lines)
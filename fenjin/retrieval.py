@@ -0,0 +1,148 @@
+"""项目内检索：把全局提炼、各集剧本、质检报告切成段落，用中文二元组 + BM25 打分，按Token预算取最相关的段落
+
+索引按来源增量维护：来源内容哈希不变就不重新切分，只在有来源变化时重算文档频率。
+"""
+import math
+import re
+from collections import Counter
+
+from .analysis import ANALYSIS_SECTIONS
+from .scenes import SCENE_SPLIT_RE, estimate_tokens
+from .store import content_hash
+
+PASSAGE_CHARS = 600
+BM25_K1, BM25_B = 1.2, 0.75
+# 提问里点名「第N集」时，该集的段落额外加权
+EPISODE_BOOST = 1.5
+WORD_RE = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]+')
+EPISODE_REF_RE = re.compile(r'第\s*(\d+)\s*集')
+
+def tokenize(text):
+    """英文/数字按词，中文按相邻二字（单字词保留单字）"""
+    out = []
+    for w in WORD_RE.findall(text.lower()):
+        if w[0].isascii():
+            out.append(w)
+        elif len(w) == 1:
+            out.append(w)
+        else:
+            out.extend(w[i:i + 2] for i in range(len(w) - 1))
+    return out
+
+def _pack(blocks, limit=PASSAGE_CHARS):
+    """把小块按顺序合并成不超过 limit 字的段落，超长的块单独成段再按字数切开"""
+    out, cur = [], ""
+    for b in blocks:
+        b = b.strip()
+        if not b:
+            continue
+        if cur and len(cur) + len(b) + 2 > limit:
+            out.append(cur)
+            cur = ""
+        if len(b) > limit:
+            out.extend(b[i:i + limit] for i in range(0, len(b), limit))
+        else:
+            cur = f"{cur}\n\n{b}" if cur else b
+    if cur:
+        out.append(cur)
+    return out
+
+def split_passages(kind, text):
+    """剧本按分镜、其余按空行分段，再合并到合适长度"""
+    if kind == "episode":
+        blocks = SCENE_SPLIT_RE.split(text)
+    else:
+        blocks = re.split(r'\n\s*\n|(?=\n#+ )|(?=\n【)', text)
+    return _pack(blocks)
+
+class PassageIndex:
+    """BM25 段落索引；sources 为 {来源键: (类别, 集数或None, 标签, 文本)}"""
+
+    def __init__(self):
+        self._sources = {}   # 来源键 → (内容哈希, [段落dict])
+        self._docs = []
+        self._postings = {}  # 词 → [(段落序号, 词频)]
+        self._avgdl = 0.0
+
+    def sync(self, sources):
+        """按来源哈希增量更新，返回是否有变化"""
+        changed = False
+        for key in list(self._sources):
+            if key not in sources:
+                del self._sources[key]
+                changed = True
+        for key, (kind, ep, label, text) in sources.items():
+            h = content_hash(text)
+            if key in self._sources and self._sources[key][0] == h:
+                continue
+            passages = []
+            for i, p in enumerate(split_passages(kind, text)):
+                tf = Counter(tokenize(p))
+                passages.append({"id": f"{key}#{i}", "kind": kind, "ep": ep, "label": label, "text": p,
+                                 "tf": tf, "len": sum(tf.values())})
+            self._sources[key] = (h, passages)
+            changed = True
+        if changed:
+            self._docs = [p for _, ps in self._sources.values() for p in ps]
+            self._postings = {}
+            for i, p in enumerate(self._docs):
+                for t, f in p["tf"].items():
+                    self._postings.setdefault(t, []).append((i, f))
+            self._avgdl = sum(p["len"] for p in self._docs) / len(self._docs) if self._docs else 0.0
+        return changed
+
+    def __len__(self):
+        return len(self._docs)
+
+    def search(self, query, k=8):
+        """[(分数, 段落)]，按分数降序；点名的集即使没有命中词也会入选"""
+        if not self._docs:
+            return []
+        n, avgdl = len(self._docs), self._avgdl or 1.0
+        scores = {}
+        for t in set(tokenize(query)):
+            post = self._postings.get(t)
+            if not post:
+                continue
+            idf = math.log(1 + (n - len(post) + 0.5) / (len(post) + 0.5))
+            for i, f in post:
+                dl = self._docs[i]["len"]
+                scores[i] = scores.get(i, 0.0) + idf * f * (BM25_K1 + 1) / (f + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+        eps = {int(x) for x in EPISODE_REF_RE.findall(query)}
+        if eps:
+            for i, p in enumerate(self._docs):
+                if p["ep"] in eps:
+                    scores[i] = scores.get(i, 0.0) * EPISODE_BOOST + 1.0
+        top = sorted(scores.items(), key=lambda x: -x[1])[:k]
+        return [(s, self._docs[i]) for i, s in top]
+
+    def context(self, query, budget, k=12):
+        """在Token预算内取最相关的段落，返回 [段落]（按来源顺序排列，便于阅读）"""
+        picked, used = [], 0
+        for _, p in self.search(query, k):
+            cost = estimate_tokens(p["text"])
+            if used + cost > budget:
+                continue
+            picked.append(p)
+            used += cost
+        order = {p["id"]: i for i, p in enumerate(self._docs)}
+        return sorted(picked, key=lambda p: order[p["id"]])
+
+def project_sources(data):
+    """项目里可检索的来源：全局提炼、开场方案、各集剧本与质检"""
+    src = {}
+    sections = data.get("analysis_sections") or {}
+    if sections:
+        # 已拆分时按部分建来源，检索结果能标出出自哪一部分
+        for key, title in ANALYSIS_SECTIONS:
+            if sections.get(key):
+                src[f"analysis:{key}"] = ("analysis", None, f"全局提炼·{title}", sections[key])
+    elif data["global_analysis"]:
+        src["analysis"] = ("analysis", None, "全局提炼", data["global_analysis"])
+    if data["opening_designs"]:
+        src["openings"] = ("openings", None, "开场方案", data["opening_designs"])
+    for e, text in data["episodes"].items():
+        src[f"episode:{e}"] = ("episode", e, f"第{e}集", text)
+    for e, text in data["review_results"].items():
+        src[f"review:{e}"] = ("review", e, f"第{e}集质检", text)
+    return src
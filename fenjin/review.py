@@ -0,0 +1,53 @@
+"""质检报告解析：按分镜切分报告、取出评分，供定向修改只处理不达标的分镜"""
+import re
+
+PASS_SCORE = 7
+# 分镜小节的开头：行首的「【分镜N】」「分镜N：」「### 分镜N」「**分镜N**」等
+SECTION_HEAD_RE = re.compile(r'^[ \t]*(?:#+[ \t]*)?(?:\*\*)?[【\[]?分镜[ \t]*(\d+)[】\]]?', re.M)
+# 分镜小节之后的整集部分（汇总/五视角等），到这里为止
+SECTION_END_RE = re.compile(r'^[ \t]*(?:#+[ \t]*)?(?:\*\*)?[【\[]?(?:整集|汇总|总评|第二部分|视角\d)', re.M)
+# 评分：先认「评分：8」「得分 7.5/10」这类带标签的，没有再退到「8/10」；单独的「N分」可能是时长（1分30秒），不算评分
+SCORE_RE = re.compile(r'(?:评分|得分|分数)[ \t]*[:：]?[ \t]*(\d+(?:\.\d+)?)')
+OUT_OF_TEN_RE = re.compile(r'(?<![\d.])(\d+(?:\.\d+)?)[ \t]*/[ \t]*10(?![\d.])')
+
+def parse_review(report):
+    """{分镜号: {"score": 分数或None, "text": 小节原文, "span": (起, 止)}}；同一分镜出现多次时取第一节"""
+    heads = list(SECTION_HEAD_RE.finditer(report or ""))
+    out = {}
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(report)
+        tail = SECTION_END_RE.search(report, m.end(), end)
+        if tail:
+            end = tail.start()
+        num = int(m.group(1))
+        if num in out:
+            continue
+        text = report[m.start():end].rstrip()
+        pos = m.end() - m.start()
+        sm = SCORE_RE.search(text, pos) or OUT_OF_TEN_RE.search(text, pos)
+        score = float(sm.group(1)) if sm else None
+        out[num] = {"score": score if score is None or score <= 10 else None, "text": text,
+                    "span": (m.start(), m.start() + len(text))}
+    return out
+
+def failing_shots(report, threshold=PASS_SCORE):
+    """{分镜号: 该分镜的质检意见}，只含有评分且低于 threshold 的分镜"""
+    return {n: s["text"] for n, s in sorted(parse_review(report).items())
+            if s["score"] is not None and s["score"] < threshold}
+
+def merge_review(report, partial, shots):
+    """把复检报告中 shots 的小节替换进原报告；原报告里找不到的小节追加在末尾"""
+    new = parse_review(partial)
+    old = parse_review(report)
+    out, extra = report, []
+    for n in sorted(shots, key=lambda n: -old[n]["span"][0] if n in old else 0):
+        if n not in new:
+            continue
+        if n in old:
+            a, b = old[n]["span"]
+            out = out[:a] + new[n]["text"] + out[b:]
+        else:
+            extra.append(new[n]["text"])
+    if extra:
+        out = out.rstrip() + "\n\n" + "\n\n".join(extra)
+    return out
@@ -0,0 +1,73 @@
+"""批量生成的运行清单：记录范围、已完成/失败的集和每集耗时，中断后按清单续跑
+
+清单是普通dict，存在项目的 batch_runs 里随备份一起保存（集数键存成字符串，与JSON一致）；每完成一集就落盘一次。
+"""
+import time
+from datetime import datetime
+
+RUN_RETRIES = 3         # 每集最多尝试次数
+RETRY_BASE_DELAY = 5    # 第n次重试前等待 5·2^(n-1) 秒
+RETRY_MAX_DELAY = 60
+RUN_HISTORY = 10        # 项目里保留的运行清单数
+
+def _now():
+    return datetime.now().strftime("%m-%d %H:%M:%S")
+
+def new_run(episodes, chapters=None, model=""):
+    now = _now()
+    return {"id": datetime.now().strftime("%m%d_%H%M%S"), "episodes": list(episodes), "chapters": list(chapters or []),
+            "model": model, "created": now, "updated": now, "status": "running",
+            "completed": [], "failed": {}, "timing": {}}
+
+def add_run(runs, run):
+    """追加清单，只保留最近 RUN_HISTORY 个"""
+    runs.append(run)
+    del runs[:-RUN_HISTORY]
+    return run
+
+def pending(run):
+    """还没完成的集（含失败过的），按清单顺序"""
+    done = set(run["completed"])
+    return [e for e in run["episodes"] if e not in done]
+
+def mark_done(run, ep, secs, attempts=1):
+    if ep not in run["completed"]:
+        run["completed"].append(ep)
+    run["failed"].pop(str(ep), None)
+    run["timing"][str(ep)] = {"secs": round(secs, 1), "attempts": attempts}
+    run["updated"] = _now()
+
+def mark_failed(run, ep, error, attempts):
+    run["failed"][str(ep)] = {"error": error, "attempts": attempts, "at": _now()}
+    run["updated"] = _now()
+
+def finish_run(run):
+    """本轮跑完：全部完成为 done，否则 partial（可续跑）"""
+    run["status"] = "partial" if pending(run) else "done"
+    run["updated"] = _now()
+
+def retry_delay(attempt):
+    return min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+
+def with_retries(fn, retries=RUN_RETRIES, on_retry=None, sleep=time.sleep):
+    """调用 fn()，抛异常时按指数退避重试；返回 (结果, 尝试次数)，全部失败时抛出最后一次的异常
+
+    on_retry(等待秒数, 第几次失败, 异常) 用于提示。
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait = retry_delay(attempt)
+            if on_retry:
+                on_retry(wait, attempt, e)
+            sleep(wait)
+
+def run_summary(run):
+    """{"total", "done", "failed", "left", "secs", "avg"}：进度与耗时汇总"""
+    secs = sum(t["secs"] for t in run["timing"].values())
+    done = len(run["completed"])
+    return {"total": len(run["episodes"]), "done": done, "failed": len(run["failed"]), "left": len(pending(run)),
+            "secs": secs, "avg": secs / done if done else 0.0}
@@ -0,0 +1,159 @@
+"""分镜解析（场景索引）、上集末尾选取与本地连续性检查"""
+import re
+
+from .characters import find_characters
+
+SHOT_RE = re.compile(r'【分镜\s*\d+】')
+
+SCENE_SPLIT_RE = re.compile(r'(?=【分镜\s*\d+】)')
+
+SCENE_HEAD_RE = re.compile(r'【分镜\s*(\d+)】([^\n]*)')
+
+DURATION_RE = re.compile(r'实算\s*[:：]?\s*(\d+(?:\.\d+)?)\s*(?:s|S|秒)')
+
+LOCATION_RE = re.compile(r'^\s*[\[［]?(?:场景|地点)\s*[:：]\s*(.+?)[\]］]?\s*$', re.M)
+
+SPEAKER_RE = re.compile(r'^\s*([\u4e00-\u9fffA-Za-z·]{1,8})(?:[（(][^）)\n]{0,60}[）)])?[^：:"“\n]{0,40}?(?:OS)?\s*[：:]\s*[（("“]', re.M)
+
+PROP_RE = re.compile(r'(?:握着|拿着|攥着|抱着|背着|扛着|端着|提着|举着|捏着|拎着)([\u4e00-\u9fff]{1,6})')
+
+LOCATION_HINT_RE = re.compile(r'[·•]|(?:内|外|日|夜|白天|夜晚|清晨|早晨|傍晚|黄昏|深夜|凌晨|午后)$')
+
+TRANSITION_RE = re.compile(r'转场|次日|第二天|翌日|隔天|数小时后|几小时后|片刻后|与此同时|另一边|闪回|回忆|梦境|黑屏|字幕[:：]')
+
+def _place(location):
+    """地点归一：「车厢内 · 夜」→「车厢内」"""
+    return re.split(r'\s*[·•|｜/，,]\s*', location.strip())[0] if location else ""
+
+def parse_scenes(script, chars=None):
+    """把剧本解析成分镜列表：编号/时长/地点/出场角色/说话人/持有道具"""
+    chars = chars or {}
+    scenes = []
+    for block in SCENE_SPLIT_RE.split(script or ""):
+        m = SCENE_HEAD_RE.search(block)
+        if not m:
+            continue
+        body = block[m.end():].strip()
+        dm = DURATION_RE.search(m.group(2)) or DURATION_RE.search(body)
+        lm = LOCATION_RE.search(body)
+        location = lm.group(1).strip() if lm else ""
+        if not location:
+            # 没有「场景：」行时，把形如「车厢内 · 夜」的首行当作地点
+            first = body.split("\n", 1)[0].strip().strip("[]［］")
+            if first and len(first) <= 20 and LOCATION_HINT_RE.search(first) and not re.search(r'[：:"“。！？]', first) \
+                    and not any(n in first for n in chars):
+                location = first
+        speakers = list(dict.fromkeys(re.sub(r'\s*OS$', '', n) for n in SPEAKER_RE.findall(body)))
+        present = find_characters(body, chars) if chars else {n: body.count(n) for n in speakers}
+        props = {}
+        for sent in re.split(r'[。！？!?\n]', body):
+            for pm in PROP_RE.finditer(sent):
+                # 道具归属于动词前最近出现的角色
+                before = sent[:pm.start()]
+                who = max(present, key=lambda n: before.rfind(n), default=None)
+                if who and before.rfind(who) >= 0 and pm.group(1) not in props.get(who, []):
+                    props.setdefault(who, []).append(pm.group(1))
+        scenes.append({
+            "num": int(m.group(1)), "text": block.strip(),
+            "duration": float(dm.group(1)) if dm else None,
+            "location": location, "place": _place(location),
+            "characters": present, "speakers": speakers, "props": props,
+            "transition": bool(TRANSITION_RE.search(body[:80])),
+        })
+    return scenes
+
+def splice_scenes(script, replacements):
+    """用 {分镜号: 新文本} 替换剧本中对应分镜，其余原样保留"""
+    out = []
+    for part in SCENE_SPLIT_RE.split(script):
+        m = SCENE_HEAD_RE.match(part)
+        if m and int(m.group(1)) in replacements:
+            out.append(replacements[int(m.group(1))].strip() + "\n\n")
+        else:
+            out.append(part)
+    return "".join(out).strip()
+
+ENDING_TOKEN_BUDGET = 1200
+
+CJK_RE = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """粗估Token：中文及全角标点约1字1 token，其余约4字符1 token"""
+    if not text:
+        return 0
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def summarize_scenes(scenes):
+    """把较早的分镜压缩成一行概要（本地生成，不调用模型）"""
+    if not scenes:
+        return ""
+    places = list(dict.fromkeys(s["place"] for s in scenes if s["place"]))
+    who = list(dict.fromkeys(n for s in scenes for n in (s["characters"] or s["speakers"])))
+    parts = [f"分镜{scenes[0]['num']}-{scenes[-1]['num']}"]
+    if places:
+        parts.append("地点：" + "→".join(places[-4:]))
+    if who:
+        parts.append("出场：" + "、".join(who[:6]))
+    return " · ".join(parts)
+
+def build_ending_context(script, budget=ENDING_TOKEN_BUDGET, summarize=True, chars=None):
+    """从结尾往前取分镜直到用完预算；更早的分镜可压缩成一行概要"""
+    scenes = parse_scenes(script, chars)
+    if not scenes:
+        return ""
+    picked, used = [], 0
+    for sc in reversed(scenes):
+        t = estimate_tokens(sc["text"])
+        if picked and used + t > budget:
+            break
+        picked.insert(0, sc)
+        used += t
+    body = "\n\n".join(sc["text"] for sc in picked)
+    if len(picked) == 1 and used > budget:
+        # 单个分镜就超预算：保留它的后半段（钩子一般在结尾）
+        body = "……" + body[-budget:]
+    earlier = scenes[:len(scenes) - len(picked)]
+    if summarize and earlier:
+        body = f"【本集前段概要】{summarize_scenes(earlier)}\n\n{body}"
+    return body
+
+def check_continuity(scene_map, absence_gap=3):
+    """本地连续性检查（不调用模型）。scene_map: {集数: 分镜列表}，返回问题列表"""
+    issues = []
+    eps = sorted(scene_map)
+    for a, b in zip(eps, eps[1:]):
+        if b != a + 1:
+            gap = f"第{a + 1}集" if b - a == 2 else f"第{a + 1}-{b - 1}集"
+            issues.append({"ep": b, "level": "warn", "msg": f"{gap}缺失，无法校验与第{a}集的衔接"})
+            continue
+        if not scene_map[a] or not scene_map[b]:
+            continue
+        end, start = scene_map[a][-1], scene_map[b][0]
+        if start["transition"]:
+            continue
+        if end["place"] and start["place"] and end["place"] != start["place"]:
+            issues.append({"ep": b, "level": "warn",
+                           "msg": f"地点跳变：第{a}集结尾在「{end['location']}」，第{b}集开场在「{start['location']}」，且无转场交代"})
+        gone = [n for n, c in end["characters"].items() if c >= 2 and n not in start["characters"]]
+        if gone:
+            issues.append({"ep": b, "level": "warn",
+                           "msg": f"人物断档：{'、'.join(gone)} 在第{a}集结尾在场，第{b}集开场未出现"})
+        for who, items in end["props"].items():
+            lost = [i for i in items if i not in start["text"]]
+            if lost and who in start["characters"]:
+                issues.append({"ep": b, "level": "info",
+                               "msg": f"道具：第{a}集结尾{who}持有「{'、'.join(lost)}」，第{b}集开场未交代"})
+    # 全剧：主要角色长时间缺席后再出现
+    present = {e: set().union(*(s["characters"] for s in scene_map[e])) if scene_map[e] else set() for e in eps}
+    counts = {}
+    for e in eps:
+        for n in present[e]:
+            counts[n] = counts.get(n, 0) + 1
+    mains = [n for n, c in counts.items() if c >= max(2, len(eps) * 0.3)]
+    for n in mains:
+        seen = [e for e in eps if n in present[e]]
+        for x, y in zip(seen, seen[1:]):
+            if y - x - 1 >= absence_gap:
+                issues.append({"ep": y, "level": "info", "msg": f"{n} 缺席第{x + 1}-{y - 1}集后在第{y}集重新出场，注意交代去向"})
+    return issues
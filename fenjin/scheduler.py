@@ -0,0 +1,195 @@
+"""进程级请求调度与响应缓存：多人共用一个网页进程（和同一个 API Key）时，所有请求在这里排队
+
+- 全局并发、每用户并发、每用户每小时Token配额（0 表示不限制），按到达顺序放行；
+- 任一请求遇到429时整体暂停放行新请求，避免各会话同时重试把接口打得更死；
+- 低温度的非流式请求（记忆提炼、评审、对话摘要）按完整请求内容缓存，跨会话共用。
+
+配额归属看接口配置里的 "user"；命令行和单人网页版没有 user，只受全局并发限制。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from .scenes import estimate_tokens
+
+QUOTA_WINDOW = 3600
+CACHE_MAX_TEMPERATURE = 0.3
+CACHE_ENTRIES = 512
+
+class QuotaExceeded(Exception):
+    """用户在配额窗口内的Token用量已满"""
+
+def _env_int(name, default=0):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class RequestScheduler:
+    """按到达顺序放行的请求闸门；acquire/release 可跨线程配对（流式请求在读完流的线程里释放）"""
+
+    def __init__(self, max_concurrency=0, user_concurrency=0, user_tokens=0, window=QUOTA_WINDOW):
+        self.max_concurrency, self.user_concurrency = max_concurrency, user_concurrency
+        self.user_tokens, self.window = user_tokens, window
+        self._cond = threading.Condition()
+        self._queue = deque()   # 排队中的 (序号, 用户)
+        self._running = {}      # 用户 → 进行中的请求数
+        self._usage = {}        # 用户 → deque[(时间, Token)]
+        self._paused_until = 0.0
+        self._seq = 0
+        self._stats = {"served": 0, "rejected": 0, "rate_limited": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(_env_int("FENJIN_MAX_CONCURRENCY"), _env_int("FENJIN_USER_CONCURRENCY"),
+                   _env_int("FENJIN_USER_TOKENS"))
+
+    def configure(self, max_concurrency=None, user_concurrency=None, user_tokens=None):
+        with self._cond:
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+            if user_concurrency is not None:
+                self.user_concurrency = user_concurrency
+            if user_tokens is not None:
+                self.user_tokens = user_tokens
+            self._cond.notify_all()
+
+    def _tokens_used(self, user, now):
+        q = self._usage.get(user)
+        if not q:
+            return 0
+        while q and q[0][0] < now - self.window:
+            q.popleft()
+        return sum(t for _, t in q)
+
+    def _blocked(self, user, now):
+        """该用户此刻不能开始新请求的原因（None 表示可以）"""
+        if now < self._paused_until:
+            return "paused"
+        if self.max_concurrency and sum(self._running.values()) >= self.max_concurrency:
+            return "global"
+        if user and self.user_concurrency and self._running.get(user, 0) >= self.user_concurrency:
+            return "user"
+        return None
+
+    def _turn(self, ticket, now):
+        """排在前面、且自身没被每用户并发挡住的请求先走，被挡住的不占队头"""
+        for t in self._queue:
+            if t == ticket:
+                return self._blocked(t[1], now) is None
+            if self._blocked(t[1], now) is None:
+                return False
+        return False
+
+    def acquire(self, cfg, tokens=0):
+        """排队直到可以发出请求，返回租约；超出Token配额时抛 QuotaExceeded"""
+        user = cfg.get("user") or ""
+        t0 = time.monotonic()
+        with self._cond:
+            if user and self.user_tokens and self._tokens_used(user, time.time()) + tokens > self.user_tokens:
+                self._stats["rejected"] += 1
+                raise QuotaExceeded(f"{user} 近{self.window // 60}分钟已用满 {self.user_tokens} Token 配额")
+            self._seq += 1
+            ticket = (self._seq, user)
+            self._queue.append(ticket)
+            try:
+                while not self._turn(ticket, time.time()):
+                    self._cond.wait(max(self._paused_until - time.time(), 0.05) if time.time() < self._paused_until else None)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+            self._running[user] = self._running.get(user, 0) + 1
+            wait = time.monotonic() - t0
+            self._stats["served"] += 1
+            self._stats["wait_total"] += wait
+            self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+        return {"user": user, "tokens": tokens, "released": False}
+
+    def release(self, lease, output_tokens=0):
+        """结束请求并记入Token用量；重复调用无副作用"""
+        with self._cond:
+            if lease["released"]:
+                return
+            lease["released"] = True
+            user = lease["user"]
+            self._running[user] -= 1
+            if not self._running[user]:
+                del self._running[user]
+            if user:
+                self._usage.setdefault(user, deque()).append((time.time(), lease["tokens"] + output_tokens))
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cfg, tokens=0):
+        lease = self.acquire(cfg, tokens)
+        try:
+            yield lease
+        finally:
+            self.release(lease, lease.get("output", 0))
+
+    def pause(self, seconds):
+        """接口返回429：在 seconds 秒内不再放行新请求"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+            self._stats["rate_limited"] += 1
+
+    def metrics(self):
+        """管理面板用：排队数、进行中、等待时间、每用户用量"""
+        now = time.time()
+        with self._cond:
+            users = set(self._running) | set(self._usage)
+            s = dict(self._stats)
+            return {
+                "queued": len(self._queue), "running": sum(self._running.values()),
+                "served": s["served"], "rejected": s["rejected"], "rate_limited": s["rate_limited"],
+                "avg_wait": s["wait_total"] / s["served"] if s["served"] else 0.0, "max_wait": s["wait_max"],
+                "paused_for": max(self._paused_until - now, 0.0),
+                "limits": {"max_concurrency": self.max_concurrency, "user_concurrency": self.user_concurrency,
+                           "user_tokens": self.user_tokens},
+                "users": {u: {"running": self._running.get(u, 0), "tokens": self._tokens_used(u, now)}
+                          for u in sorted(users) if u},
+            }
+
+class ResponseCache:
+    """完整请求（接口地址/模型/消息/参数）→ 回复 的LRU，进程内共用"""
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(cfg, payload):
+        raw = json.dumps([cfg["api_base"], payload], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+def request_tokens(messages, system_prompt=""):
+    return estimate_tokens(system_prompt) + sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+SCHEDULER = RequestScheduler.from_env()
+RESPONSE_CACHE = ResponseCache()
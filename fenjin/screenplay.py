@@ -0,0 +1,206 @@
+"""剧本格式导出：基于分镜解析结果渲染 Fountain / Final Draft FDX / DOCX / 分镜表CSV
+
+所有格式都逐集解析、逐段写盘：传入的 episodes 可以是惰性生成器，整部剧的输出不会同时驻留内存。
+"""
+import csv
+import io
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from .checks import DIALOGUE_LINE_RE
+from .scenes import SCENE_HEAD_RE, parse_scenes
+
+EXPORT_FORMATS = {
+    "fountain": ("Fountain", ".fountain", "text/plain"),
+    "fdx": ("Final Draft (FDX)", ".fdx", "application/xml"),
+    "docx": ("Word (DOCX)", ".docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "csv": ("分镜表 (CSV)", ".csv", "text/csv"),
+}
+SPEAKER_NAME_RE = re.compile(r'^([\u4e00-\u9fffA-Za-z·]{1,8})')
+PAREN_RE = re.compile(r'[（(]([^）)]*)[）)]')
+QUOTE_PAIRS = {'"': '"', "“": "”", "「": "」", "（": "）", "(": ")"}
+SKIP_LINE_RE = re.compile(r'^\s*[\[［]?(?:场景|地点)\s*[:：]')
+CSV_HEADER = ["集", "分镜", "时长(s)", "地点", "出场角色", "台词"]
+
+def _split_speech(rest):
+    """把冒号后的部分拆成 (台词, 同行后续动作)"""
+    rest = rest.strip()
+    close = QUOTE_PAIRS.get(rest[:1])
+    if close:
+        end = rest.find(close, 1)
+        if end > 0:
+            return rest[1:end].strip(), rest[end + 1:].strip(" 。")
+        return rest[1:].strip(), ""
+    return rest, ""
+
+def parse_line(line):
+    """一行分镜正文 → 元素列表：[("action", 文本)] 或 角色/括注/台词"""
+    m = DIALOGUE_LINE_RE.match(line)
+    if m:
+        head = m.group("head").strip()
+        nm = SPEAKER_NAME_RE.match(head)
+        if nm:
+            name = re.sub(r'\s*OS$', '', nm.group(1))
+            ext = " (V.O.)" if "OS" in head else ""
+            notes = "，".join(p.strip() for p in PAREN_RE.findall(head) if p.strip())
+            speech, after = _split_speech(line[m.start("quote"):])
+            out = [("character", name + ext)]
+            if notes:
+                out.append(("parenthetical", notes))
+            out.append(("dialogue", speech))
+            if after:
+                out.append(("action", after))
+            return out
+    return [("action", line.strip())]
+
+def iter_elements(episodes, chars=None):
+    """(集数, 剧本) 序列 → 元素流：episode / heading / action / character / parenthetical / dialogue"""
+    for ep, script in episodes:
+        yield ("episode", f"第{ep}集")
+        for sc in parse_scenes(script, chars):
+            parts = [f"分镜{sc['num']}"]
+            if sc["location"]:
+                parts.append(sc["location"])
+            if sc["duration"]:
+                parts.append(f"{sc['duration']:g}s")
+            yield ("heading", " - ".join(parts))
+            body = SCENE_HEAD_RE.sub("", sc["text"], count=1)
+            for ln in body.splitlines():
+                # 地点已写进场景标题，不再重复成动作行
+                if ln.strip() and not SKIP_LINE_RE.match(ln) and ln.strip().strip("[]［］") != sc["location"]:
+                    yield from parse_line(ln)
+
+# ---------- Fountain ----------
+def render_fountain(elements, title="剧本"):
+    """Fountain 纯文本；中文没有大小写，场景标题和角色名用 . / @ 强制标记"""
+    yield f"Title: {title}\n\n"
+    first = True
+    for kind, text in elements:
+        if kind == "episode":
+            yield ("" if first else "\n===\n") + f"\n# {text}\n\n"
+            first = False
+        elif kind == "heading":
+            yield f".{text}\n\n"
+        elif kind == "action":
+            yield f"!{text}\n\n"
+        elif kind == "character":
+            yield f"@{text}\n"
+        elif kind == "parenthetical":
+            yield f"({text})\n"
+        elif kind == "dialogue":
+            yield f"{text}\n\n"
+
+# ---------- Final Draft ----------
+FDX_TYPES = {"heading": "Scene Heading", "action": "Action", "character": "Character",
+             "parenthetical": "Parenthetical", "dialogue": "Dialogue"}
+
+def render_fdx(elements, title="剧本"):
+    yield '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n'
+    yield '<FinalDraft DocumentType="Script" Template="No" Version="5">\n<Content>\n'
+    first = True
+    for kind, text in elements:
+        if kind == "episode":
+            page = "" if first else ' StartsNewPage="Yes"'
+            yield f'<Paragraph Type="Action"{page}><Text Style="Bold">{escape(text)}</Text></Paragraph>\n'
+            first = False
+            continue
+        if kind == "parenthetical":
+            text = f"({text})"
+        yield f'<Paragraph Type="{FDX_TYPES[kind]}"><Text>{escape(text)}</Text></Paragraph>\n'
+    yield f'</Content>\n<TitlePage><Content><Paragraph Type="Action" Alignment="Center"><Text>{escape(title)}</Text></Paragraph></Content></TitlePage>\n'
+    yield '</FinalDraft>\n'
+
+# ---------- DOCX（手写最小 WordprocessingML，不依赖 python-docx） ----------
+DOCX_CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                      '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                      '</Types>')
+DOCX_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+             '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+             'Target="word/document.xml"/></Relationships>')
+# 段落格式：(段落属性, 文字属性)；pPr 子元素必须按架构顺序 keepNext → spacing → ind → jc，否则 Word 判定文件损坏
+DOCX_STYLES = {
+    "episode": ('<w:spacing w:after="240"/><w:jc w:val="center"/>', '<w:b/><w:sz w:val="32"/>'),
+    "heading": ('<w:spacing w:before="240" w:after="120"/>', '<w:b/>'),
+    "action": ('<w:spacing w:after="120"/>', ''),
+    "character": ('<w:keepNext/><w:ind w:left="3600"/>', '<w:b/>'),
+    "parenthetical": ('<w:keepNext/><w:ind w:left="2880" w:right="2160"/>', '<w:i/>'),
+    "dialogue": ('<w:spacing w:after="120"/><w:ind w:left="2160" w:right="1440"/>', ''),
+}
+
+def render_docx_body(elements, title="剧本"):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+    yield f'<w:p><w:pPr><w:jc w:val="center"/></w:pPr><w:r><w:rPr><w:b/><w:sz w:val="40"/></w:rPr><w:t>{escape(title)}</w:t></w:r></w:p>'
+    for kind, text in elements:
+        ppr, rpr = DOCX_STYLES[kind]
+        if kind == "episode":
+            yield '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        if kind == "parenthetical":
+            text = f"（{text}）"
+        yield (f'<w:p><w:pPr>{ppr}</w:pPr><w:r>{f"<w:rPr>{rpr}</w:rPr>" if rpr else ""}'
+               f'<w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>')
+    yield '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/><w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" ' \
+          'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr></w:body></w:document>'
+
+def write_docx(path, elements, title="剧本"):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        zf.writestr("_rels/.rels", DOCX_RELS)
+        with zf.open("word/document.xml", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8") as f:
+            for chunk in render_docx_body(elements, title):
+                f.write(chunk)
+
+# ---------- 分镜表 ----------
+def iter_shot_rows(episodes, chars=None):
+    """每个分镜一行：集、编号、时长、地点、出场角色、台词"""
+    for ep, script in episodes:
+        for sc in parse_scenes(script, chars):
+            lines = []
+            for ln in SCENE_HEAD_RE.sub("", sc["text"], count=1).splitlines():
+                els = parse_line(ln)
+                if els[0][0] == "character":
+                    lines.append(f"{els[0][1]}：{next(t for k, t in els if k == 'dialogue')}")
+            who = list(sc["characters"]) or sc["speakers"]
+            yield [ep, sc["num"], f"{sc['duration']:g}" if sc["duration"] else "", sc["location"],
+                   "、".join(who), "\n".join(lines)]
+
+def write_shot_csv(path, episodes, chars=None):
+    # utf-8-sig：Excel 直接打开不乱码
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        n = 0
+        for row in iter_shot_rows(episodes, chars):
+            w.writerow(row)
+            n += 1
+    return n
+
+def export_series(fmt, episodes, path, title="剧本", chars=None):
+    """把 (集数, 剧本) 序列导出为一个文件，返回输出路径；先写临时文件再替换"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的格式：{fmt}")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    if fmt == "csv":
+        write_shot_csv(tmp, episodes, chars)
+    elif fmt == "docx":
+        write_docx(tmp, iter_elements(episodes, chars), title)
+    else:
+        render = render_fountain if fmt == "fountain" else render_fdx
+        with open(tmp, "w", encoding="utf-8") as f:
+            for chunk in render(iter_elements(episodes, chars), title):
+                f.write(chunk)
+    os.replace(tmp, path)
+    return path
+
+def format_for_path(path):
+    """按扩展名推断导出格式"""
+    ext = os.path.splitext(path)[1].lower()
+    return next((k for k, v in EXPORT_FORMATS.items() if v[1] == ext), None)
@@ -0,0 +1,187 @@
+"""章节存储（内容寻址 + 压缩）与项目备份文件读写
+
+章节存储目录记录在项目文件里（store_dir，相对项目文件所在目录），load_project 读项目时切换到该目录，
+所以在任何工作目录下用 --project 打开项目都能读到章节、历史版本和转存的对话。
+"""
+import difflib
+import hashlib
+import json
+import os
+import re
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import zstandard  # 可选依赖：安装后章节存储使用zstd压缩，否则退回zlib
+except ImportError:
+    zstandard = None
+
+AUTOSAVE_FILE = "autosave_data.json"
+CHAPTER_STORE_DIR = "chapter_store"
+# 多人模式：每个用户一份项目文件，章节存储（内容寻址）仍然共用
+USERS_DIR = "users"
+USER_NAME_RE = re.compile(r'^[\w\u4e00-\u9fff-]{1,32}$')
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+_store_dir = CHAPTER_STORE_DIR
+
+def use_store(path):
+    """切换当前进程使用的章节存储目录（内容寻址，已缓存的读取结果仍然有效）"""
+    global _store_dir
+    _store_dir = path
+
+def store_dir():
+    return _store_dir
+
+def resolve_store_dir(project_path, data=None):
+    """项目的章节存储目录：项目里记录的 store_dir（相对项目文件所在目录），没有记录时为项目文件旁的 chapter_store
+
+    旧项目没有记录、项目旁也没有存储目录时，沿用工作目录下的 chapter_store（旧版本的位置）。
+    """
+    base = os.path.dirname(os.path.abspath(project_path))
+    rel = (data or {}).get("store_dir")
+    if rel:
+        return os.path.normpath(os.path.join(base, rel))
+    path = os.path.join(base, CHAPTER_STORE_DIR)
+    if data and not os.path.isdir(path) and os.path.isdir(CHAPTER_STORE_DIR):
+        return os.path.abspath(CHAPTER_STORE_DIR)
+    return path
+
+def _blob_path(h):
+    return os.path.join(_store_dir, h[:2], h)
+
+def _compress(raw):
+    if zstandard is not None:
+        return b"Z" + zstandard.ZstdCompressor(level=9).compress(raw)
+    return b"L" + zlib.compress(raw, 6)
+
+def _write_object(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def put_blob(text, keyframe=False):
+    """压缩写入章节存储，返回内容哈希；相同内容只存一份
+
+    keyframe=True 时保证存的是完整内容：已有的同内容对象是差分时改写成完整存储（内容不变，以它为基准的差分仍然有效）。
+    """
+    h = content_hash(text)
+    path = _blob_path(h)
+    if not os.path.exists(path) or (keyframe and _header(h)[:1] == b"D"):
+        _write_object(path, _compress(text.encode("utf-8")))
+    return h
+
+def _header(h):
+    """对象开头：类型字节，差分对象还带基准哈希"""
+    with open(_blob_path(h), "rb") as f:
+        return f.read(41)
+
+def delta_depth(h, limit=None):
+    """读取 h 要解开的差分层数（到 limit 为止）"""
+    depth = 0
+    while True:
+        head = _header(h)
+        if head[:1] != b"D" or (limit is not None and depth >= limit):
+            return depth
+        depth += 1
+        h = head[1:41].decode("ascii")
+
+def put_delta(text, base_text, base_hash):
+    """以 base 为参照按行差分存储（b"D" + 基准哈希 + 压缩的操作列表），差分不划算时退回完整存储
+
+    返回 (哈希, 是否以差分存储)；同内容的对象已存在时按它实际的存储方式返回。
+    """
+    h = content_hash(text)
+    path = _blob_path(h)
+    if os.path.exists(path):
+        return h, _header(h)[:1] == b"D"
+    a, b = base_text.splitlines(keepends=True), text.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append("".join(b[j1:j2]))
+    delta = b"D" + base_hash.encode("ascii") + zlib.compress(json.dumps(ops, ensure_ascii=False).encode("utf-8"), 9)
+    full = _compress(text.encode("utf-8"))
+    _write_object(path, delta if len(delta) < len(full) else full)
+    return h, len(delta) < len(full)
+
+def has_blob(h):
+    return os.path.exists(_blob_path(h))
+
+@lru_cache(maxsize=64)
+def get_blob(h):
+    """按哈希读取并解压（进程内缓存最近使用的章节）"""
+    with open(_blob_path(h), "rb") as f:
+        data = f.read()
+    if data[:1] == b"D":
+        base = get_blob(data[1:41].decode("ascii")).splitlines(keepends=True)
+        ops = json.loads(zlib.decompress(data[41:]))
+        return "".join("".join(base[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+    if data[:1] == b"Z":
+        if zstandard is None:
+            raise RuntimeError("章节以zstd压缩存储，请安装 zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(data[1:])
+    else:
+        raw = zlib.decompress(data[1:])
+    return raw.decode("utf-8")
+
+def normalize_chapters(chapters):
+    """兼容旧备份：章节值为全文字符串时迁移进章节存储，只保留元数据"""
+    out = {}
+    for name, v in chapters.items():
+        if isinstance(v, str):
+            out[name] = {"hash": put_blob(v), "length": len(v)}
+        elif isinstance(v, dict) and v.get("hash"):
+            out[name] = v
+    return out
+
+def user_project_path(user):
+    """多人模式下用户的项目文件路径；用户名不合法时抛 ValueError"""
+    if not USER_NAME_RE.match(user or ""):
+        raise ValueError(f"用户名不合法：{user!r}")
+    os.makedirs(os.path.join(USERS_DIR, user), exist_ok=True)
+    return os.path.join(USERS_DIR, user, AUTOSAVE_FILE)
+
+# 以集数为键的字段：JSON里存字符串键，读回时还原为int
+INT_KEYED_FIELDS = ("episodes", "review_results", "episode_alternates", "episode_history")
+
+def load_project(path=AUTOSAVE_FILE):
+    """读取备份文件，返回与 session_state 同构的dict；文件不存在时返回空dict
+
+    同时切换到该项目的章节存储目录（见 resolve_store_dir）。
+    """
+    if not os.path.exists(path):
+        use_store(resolve_store_dir(path))
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    use_store(resolve_store_dir(path, data))
+    for k in INT_KEYED_FIELDS:
+        if data.get(k):
+            data[k] = {int(e): v for e, v in data[k].items()}
+    if data.get("chapters"):
+        data["chapters"] = normalize_chapters(data["chapters"])
+    return data
+
+def save_project(data, path=AUTOSAVE_FILE):
+    """写入备份文件（先写临时文件再替换，避免写到一半被中断）"""
+    out = dict(data)
+    for k in INT_KEYED_FIELDS:
+        out[k] = {str(e): v for e, v in (data.get(k) or {}).items()}
+    out["save_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        out["store_dir"] = os.path.relpath(os.path.abspath(_store_dir), os.path.dirname(os.path.abspath(path)))
+    except ValueError:
+        # Windows 上不在同一个盘符时没有相对路径
+        out["store_dir"] = os.path.abspath(_store_dir)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,160 @@
+"""Prompt模板注册表：带版本号的预编译模板、静态Token统计、按版本累计的用量/质量统计（A/B对比）
+
+模板正文用 {字段} 占位（字面花括号写成 {{ }}，支持 {ep:>4}、{ep!r} 这类格式说明），注册时预先拆好，渲染时只做拼接。
+每个版本的 ID 形如 episode@1#3fa2c1d0：版本号之外附带正文哈希，改了措辞却忘了递增版本号也能被发现。
+prompt_templates/ 目录下的 名称@版本.txt 会作为额外版本载入，可在界面或命令行切换启用的版本做A/B；
+额外版本只能用内置版本有的字段（调用方只传这些），用了别的字段的文件不载入，记在 rejected_overrides() 里。
+"""
+import keyword
+import os
+import re
+import string
+import threading
+
+from .scenes import estimate_tokens
+from .store import content_hash
+
+PROMPT_DIR = "prompt_templates"
+OVERRIDE_RE = re.compile(r'^([a-z_]+)@(\w+)\.txt$')
+_FORMATTER = string.Formatter()
+
+class PromptTemplate:
+    """一个模板版本：注册时拆成（字面文本, 字段, 转换, 格式）片段，render() 不再解析正文"""
+    __slots__ = ("name", "version", "text", "id", "fields", "static_tokens", "_parts")
+
+    def __init__(self, name, version, text):
+        self.name, self.version, self.text = name, str(version), text
+        parts = list(_FORMATTER.parse(text))
+        bad = [f for _, f, spec, _ in parts if f is not None and (not f.isidentifier() or keyword.iskeyword(f) or "{" in spec)]
+        if bad:
+            raise ValueError(f"模板 {name}@{version} 的字段名无效：{bad}")
+        self.fields = tuple(dict.fromkeys(f for _, f, _, _ in parts if f))
+        self.static_tokens = estimate_tokens("".join(lit for lit, _, _, _ in parts))
+        self.id = f"{name}@{self.version}#{content_hash(text)[:8]}"
+        self._parts = tuple((lit, f, conv, spec) for lit, f, spec, conv in parts)
+
+    def render(self, **values):
+        """按字段填值；多传的字段忽略（同一名称的各版本可以只用内置版本字段的一部分）"""
+        out = []
+        for lit, f, conv, spec in self._parts:
+            out.append(lit)
+            if f is None:
+                continue
+            v = values[f]
+            out.append(str(v) if not (conv or spec) else _FORMATTER.format_field(_FORMATTER.convert_field(v, conv), spec))
+        return "".join(out)
+
+_REGISTRY = {}  # 名称 → {版本: PromptTemplate}
+_ACTIVE = {}    # 名称 → 启用的版本
+_DEFAULT = {}   # 名称 → 内置版本（第一个注册的版本）
+_REJECTED = {}  # 没有载入的额外版本文件 → 原因
+# 网页版多人共用一个进程时，每个会话在自己的脚本线程里切换版本，互不影响；没有切换过的线程用进程级选择
+_local = threading.local()
+
+def _active():
+    return getattr(_local, "active", None) or _ACTIVE
+
+def register(name, version, text, active=False):
+    """注册一个模板版本；该名称的第一个版本自动启用"""
+    t = PromptTemplate(name, version, text)
+    _REGISTRY.setdefault(name, {})[t.version] = t
+    _DEFAULT.setdefault(name, t.version)
+    if active or name not in _ACTIVE:
+        _ACTIVE[name] = t.version
+    return t
+
+def get_template(name, version=None):
+    return _REGISTRY[name][str(version) if version is not None else _active()[name]]
+
+def render(name, /, **values):
+    return get_template(name).render(**values)
+
+def template_id(name):
+    return get_template(name).id
+
+def versions(name):
+    return list(_REGISTRY[name])
+
+def active_versions():
+    return dict(_active())
+
+def set_active(name, version):
+    """切换启用的版本（进程级，当前线程有自己的选择时也一并切换）；未注册的名称/版本抛 KeyError"""
+    version = str(version)
+    if version not in _REGISTRY[name]:
+        raise KeyError(f"{name}@{version}")
+    _ACTIVE[name] = version
+    if getattr(_local, "active", None) is not None:
+        _local.active[name] = version
+
+def apply_versions(selected, thread_local=False):
+    """按项目里保存的选择切换版本（未选择的恢复内置版本），跳过已不存在的版本；返回实际生效的选择
+
+    thread_local=True 时只对当前线程生效（网页版每个会话各用各的版本）。
+    """
+    applied = {name: str(version) for name, version in (selected or {}).items()
+               if name in _REGISTRY and str(version) in _REGISTRY[name]}
+    if thread_local:
+        _local.active = {**_DEFAULT, **applied}
+    else:
+        _ACTIVE.update(_DEFAULT)
+        _ACTIVE.update(applied)
+    return applied
+
+def load_overrides(path=PROMPT_DIR):
+    """载入 path 下的 名称@版本.txt（只接受已注册的名称），返回载入的模板ID
+
+    文件用了内置版本没有的字段、或正文无法解析时不载入，原因见 rejected_overrides()。
+    """
+    if not os.path.isdir(path):
+        return []
+    loaded = []
+    for fn in sorted(os.listdir(path)):
+        m = OVERRIDE_RE.match(fn)
+        if not m or m.group(1) not in _REGISTRY:
+            continue
+        name = m.group(1)
+        with open(os.path.join(path, fn), encoding="utf-8") as f:
+            text = f.read()
+        try:
+            t = PromptTemplate(name, m.group(2), text)
+        except ValueError as e:
+            _REJECTED[fn] = str(e)
+            continue
+        extra = [x for x in t.fields if x not in get_template(name, _DEFAULT[name]).fields]
+        if extra:
+            _REJECTED[fn] = f"内置版本没有这些字段：{'、'.join(extra)}"
+            continue
+        _REJECTED.pop(fn, None)
+        loaded.append(register(name, t.version, text).id)
+    return loaded
+
+def rejected_overrides():
+    """{文件名: 原因}：没有载入的额外版本"""
+    return dict(_REJECTED)
+
+def template_table():
+    """每个模板版本一行：名称、版本、ID、字段、静态Token数、是否启用"""
+    return [{"name": t.name, "version": t.version, "id": t.id, "fields": t.fields,
+             "static_tokens": t.static_tokens, "active": _active()[t.name] == t.version}
+            for vs in _REGISTRY.values() for t in vs.values()]
+
+# ---------- 用量统计（存在项目的 prompt_stats 里，按模板ID累计） ----------
+def record_usage(stats, pid, secs, output, score=None):
+    """累计一次调用：耗时、输出Token、可选的质量分（本地评分）"""
+    s = stats.setdefault(pid, {"n": 0, "secs": 0.0, "tokens": 0, "score": 0.0, "scored": 0})
+    s["n"] += 1
+    s["secs"] += secs or 0.0
+    s["tokens"] += estimate_tokens(output)
+    if score is not None:
+        s["score"] += score
+        s["scored"] += 1
+
+def usage_rows(stats):
+    """按模板ID汇总：次数、平均耗时、吞吐（Token/秒）、平均质量分"""
+    rows = []
+    for pid, s in sorted(stats.items()):
+        rows.append({"id": pid, "n": s["n"], "avg_secs": s["secs"] / s["n"] if s["n"] else 0.0,
+                     "tok_per_sec": s["tokens"] / s["secs"] if s["secs"] else 0.0,
+                     "avg_score": s["score"] / s["scored"] if s["scored"] else None})
+    return rows
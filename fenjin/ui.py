@@ -0,0 +1,150 @@
+"""网页版静态资源与渲染计时（模块只导入一次，Streamlit重跑时不再重建）"""
+import time
+
+APP_CSS = """
+<style>
+    .block-container { padding: 1.5rem 2rem 2rem 2rem; max-width: 1200px; }
+    .header-bar {
+        background: linear-gradient(135deg, #1e3a5f 0%, #2c5282 50%, #2b6cb0 100%);
+        border-radius: 12px; padding: 20px 28px; margin-bottom: 24px;
+        color: white; display: flex; justify-content: space-between; align-items: center;
+        flex-wrap: wrap; gap: 10px;
+    }
+    .header-left .header-title { font-size: 1.6rem; font-weight: 700; margin: 0; letter-spacing: 1px; }
+    .header-left .header-sub { font-size: 0.78rem; opacity: 0.8; margin-top: 4px; }
+    .header-badge {
+        background: rgba(255,255,255,0.15); border: 1px solid rgba(255,255,255,0.25);
+        border-radius: 20px; padding: 6px 16px; font-size: 0.75rem; color: white;
+    }
+    .step-indicator {
+        display: flex; gap: 0; margin: 0 0 20px 0; background: #f7f8fa;
+        border-radius: 10px; overflow: hidden; border: 1px solid #e2e8f0;
+    }
+    .step-item {
+        flex: 1; text-align: center; padding: 12px 8px; font-size: 0.8rem;
+        font-weight: 500; color: #718096; border-right: 1px solid #e2e8f0; transition: all 0.3s;
+    }
+    .step-item:last-child { border-right: none; }
+    .step-item.active { background: #ebf4ff; color: #2b6cb0; font-weight: 600; }
+    .step-item.done { background: #f0fff4; color: #276749; }
+    .step-num {
+        display: inline-block; width: 22px; height: 22px; border-radius: 50%;
+        background: #cbd5e0; color: white; font-size: 0.7rem; line-height: 22px;
+        text-align: center; margin-right: 6px; vertical-align: middle;
+    }
+    .step-item.active .step-num { background: #3182ce; }
+    .step-item.done .step-num { background: #38a169; }
+    .card {
+        background: #ffffff; border: 1px solid #e2e8f0; border-radius: 10px;
+        padding: 20px; margin-bottom: 16px; box-shadow: 0 1px 3px rgba(0,0,0,0.04);
+    }
+    .card:hover { box-shadow: 0 4px 12px rgba(0,0,0,0.08); }
+    .card-header {
+        display: flex; align-items: center; gap: 8px; margin-bottom: 14px;
+        padding-bottom: 10px; border-bottom: 1px solid #edf2f7;
+    }
+    .card-icon { font-size: 1.2rem; }
+    .card-title { font-size: 0.95rem; font-weight: 600; color: #2d3748; margin: 0; }
+    .card-subtitle { font-size: 0.75rem; color: #a0aec0; margin-left: auto; }
+    .chapter-item {
+        display: flex; align-items: center; padding: 10px 14px; background: #f7fafc;
+        border: 1px solid #e2e8f0; border-radius: 8px; margin: 6px 0; transition: all 0.2s;
+    }
+    .chapter-item:hover { border-color: #90cdf4; background: #ebf8ff; }
+    .chapter-icon {
+        width: 32px; height: 32px; border-radius: 8px;
+        background: linear-gradient(135deg, #667eea, #764ba2); color: white;
+        display: flex; align-items: center; justify-content: center;
+        font-size: 0.8rem; font-weight: 600; margin-right: 12px; flex-shrink: 0;
+    }
+    .chapter-info { flex: 1; }
+    .chapter-name { font-size: 0.88rem; font-weight: 500; color: #2d3748; }
+    .chapter-meta { font-size: 0.72rem; color: #a0aec0; margin-top: 2px; }
+    .stats-bar { display: flex; gap: 16px; margin: 12px 0; }
+    .stat-item {
+        flex: 1; background: #f7fafc; border: 1px solid #e2e8f0;
+        border-radius: 8px; padding: 12px 16px; text-align: center;
+    }
+    .stat-value { font-size: 1.4rem; font-weight: 700; color: #2b6cb0; }
+    .stat-label { font-size: 0.72rem; color: #a0aec0; margin-top: 2px; }
+    .tag {
+        display: inline-block; padding: 3px 10px; border-radius: 12px;
+        font-size: 0.7rem; font-weight: 600;
+    }
+    .tag-blue { background: #ebf8ff; color: #2b6cb0; }
+    .tag-green { background: #f0fff4; color: #276749; }
+    .tag-yellow { background: #fffff0; color: #975a16; }
+    .tag-red { background: #fff5f5; color: #c53030; }
+    .tag-purple { background: #faf5ff; color: #6b46c1; }
+    .empty-state { text-align: center; padding: 40px 20px; color: #a0aec0; }
+    .empty-state .empty-icon { font-size: 2.5rem; margin-bottom: 12px; }
+    .empty-state .empty-text { font-size: 0.9rem; margin-bottom: 4px; }
+    .empty-state .empty-hint { font-size: 0.78rem; color: #cbd5e0; }
+    .memory-panel {
+        background: linear-gradient(135deg, #fffff0, #fefcbf);
+        border: 1px solid #ecc94b; border-radius: 10px; padding: 16px; margin: 8px 0;
+    }
+    .memory-item { display: flex; gap: 8px; margin: 6px 0; font-size: 0.82rem; }
+    .memory-item .memory-key { color: #975a16; font-weight: 600; white-space: nowrap; }
+    .memory-item .memory-val { color: #744210; }
+    .sidebar-group-title {
+        font-size: 0.78rem; font-weight: 600; color: #4a5568;
+        text-transform: uppercase; letter-spacing: 0.5px; margin-bottom: 10px;
+        display: flex; align-items: center; gap: 6px;
+    }
+    section[data-testid="stSidebar"] { background: #f8fafc; }
+    .stButton > button { border-radius: 8px; font-weight: 500; font-size: 0.82rem; padding: 0.4rem 1rem; }
+    .stTabs [data-baseweb="tab-list"] {
+        gap: 4px; background: #f7fafc; padding: 4px; border-radius: 10px; border: 1px solid #e2e8f0;
+    }
+    .stTabs [data-baseweb="tab"] { border-radius: 8px; padding: 8px 20px; font-size: 0.82rem; }
+    .stTabs [aria-selected="true"] { background: white !important; box-shadow: 0 1px 3px rgba(0,0,0,0.08); }
+    .restore-banner {
+        background: linear-gradient(135deg, #f0fff4, #c6f6d5);
+        border: 1px solid #68d391; border-radius: 10px; padding: 12px 16px;
+        margin-bottom: 16px; display: flex; align-items: center; gap: 10px;
+    }
+    @media (max-width: 768px) {
+        .header-bar { flex-direction: column; text-align: center; }
+        .stats-bar { flex-direction: column; }
+    }
+    .diff-wrap { max-height: 480px; overflow: auto; font-size: 0.78rem; }
+    .diff-wrap table.diff { width: 100%; border-collapse: collapse; }
+    .diff-wrap td { vertical-align: top; white-space: pre-wrap; }
+    .diff-wrap .diff_header { color: #a0aec0; padding: 0 4px; }
+    .diff-wrap .diff_next { display: none; }
+    .diff-wrap .diff_add { background: #e6ffed; }
+    .diff-wrap .diff_chg { background: #fff5b1; }
+    .diff-wrap .diff_sub { background: #ffeef0; }
+    #MainMenu {visibility: hidden;}
+    footer {visibility: hidden;}
+    header {visibility: hidden;}
+</style>
+"""
+
+MODEL_OPTIONS = [
+    "deepseek-chat", "deepseek-reasoner",
+    "claude-sonnet-4-20250514", "claude-opus-4-20250514",
+    "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "o3-mini",
+    "gemini-2.5-pro-preview-06-05", "自定义模型"
+]
+REVIEW_MODEL_OPTIONS = ["与生成模型相同"] + MODEL_OPTIONS
+MEMORY_MODEL_OPTIONS = ["关闭", "与生成模型相同"] + MODEL_OPTIONS[:-1]
+STEP_NAMES = ["导入章节", "全局提炼", "开场设计", "生成剧本", "质检优化"]
+PROFILE_HISTORY = 20
+
+class SectionTimer:
+    """按检查点分段计时：mark(名称) 记录自上一个检查点以来的耗时"""
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.sections = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.sections.append((name, now - self.last))
+        self.last = now
+
+    @property
+    def total(self):
+        return self.last - self.start
@@ -0,0 +1,13 @@
+import pytest
+
+from fenjin import store
+
+@pytest.fixture
+def blob_store(tmp_path):
+    """章节存储切到临时目录，结束后恢复"""
+    old = store.store_dir()
+    store.use_store(str(tmp_path / "chapter_store"))
+    store.get_blob.cache_clear()
+    yield tmp_path / "chapter_store"
+    store.use_store(old)
+    store.get_blob.cache_clear()
@@ -0,0 +1,54 @@
+import json
+
+from fenjin.analysis import analysis_context, cards_fallback, parse_analysis, store_analysis
+from fenjin.characters import parse_character_cards
+
+MARKDOWN = """## 1. 一句话故事核心
+末世里嘴硬的哥哥护着丧尸妹妹。
+
+## 2. 角色驱动卡
+### 秦洛
+嘴硬心软。
+
+## 3. 故事大纲与情绪
+开端→逃亡
+
+## 4. 核心情节节点
+1. 车厢断电
+2. 站台遇袭
+
+## 5. 逻辑链补充
+许多多为何不咬人
+
+## 6. 环境氛围与光影
+冷色夜景
+
+## 7. 视觉强场景与记忆点
+车厢灯闪
+"""
+
+def test_markdown_sections_ignore_numbered_lists():
+    sections = parse_analysis(MARKDOWN)
+    assert len(sections) == 7
+    assert sections["beats"] == "1. 车厢断电\n2. 站台遇袭"
+
+def test_json_analysis_rendered_and_cards_parse():
+    raw = json.dumps({"core": "核心", "cards": [{"name": "秦洛", "card": "嘴硬心软"}], "outline": "大纲",
+                      "beats": ["甲", "乙"], "logic": "逻辑", "tone": "冷色", "visuals": ["灯闪"]}, ensure_ascii=False)
+    data = {}
+    text = store_analysis(data, f"```json\n{raw}\n```")
+    assert len(data["analysis_sections"]) == 7
+    assert "秦洛" in parse_character_cards(text)
+
+def test_analysis_context_uses_only_needed_sections():
+    data = {"messages": [{"role": "user", "content": "小说原文" * 100}, {"role": "assistant", "content": MARKDOWN}]}
+    store_analysis(data, MARKDOWN)
+    ctx = analysis_context(data, "dialogue")
+    assert "小说原文" not in ctx[0]["content"]
+    assert ctx[1]["content"].startswith("## 2. 角色驱动卡")
+    assert cards_fallback(data) == "### 秦洛\n嘴硬心软。"
+
+def test_analysis_context_falls_back_when_section_missing():
+    data = {"messages": [{"role": "user", "content": "原文"}, {"role": "assistant", "content": "自由格式"}],
+            "analysis_sections": {"cards": "卡"}}
+    assert analysis_context(data, "episode") == data["messages"][:2]
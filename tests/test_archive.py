@@ -0,0 +1,53 @@
+import os
+
+from fenjin import archive, cli, store
+from fenjin.analysis import store_analysis
+from fenjin.diagnostics import load_offloaded, offload_history
+from fenjin.history import record_version, version_text
+from fenjin.project import Project
+
+def test_prune_exports_keeps_latest_per_prefix(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(archive.EXPORT_DIR)
+    for i in range(7):
+        p = os.path.join(archive.EXPORT_DIR, f"项目_0101_00000{i}.zip")
+        open(p, "w").close()
+        os.utime(p, (i, i))
+    open(os.path.join(archive.EXPORT_DIR, "alice_0101_000000.zip"), "w").close()
+    removed = archive.prune_exports("项目", keep=5)
+    assert sorted(os.path.basename(p) for p in removed) == ["项目_0101_000000.zip", "项目_0101_000001.zip"]
+    assert os.path.exists(os.path.join(archive.EXPORT_DIR, "alice_0101_000000.zip"))
+
+def test_history_round_trip(blob_store, tmp_path):
+    body = "".join(f"【分镜{k}】秦洛握着手电，低声说第{k}句台词。\n" for k in range(1, 40))
+    versions = []
+    for i in range(4):
+        record_version(versions, body + f"【分镜40】第{i}版结尾\n", f"v{i}")
+    texts = [version_text(v) for v in versions]
+    moved, refs = offload_history([{"role": "user", "content": f"早期消息{i}"} for i in range(3)], 1)
+    data = {"chapter_order": [], "chapters": {}, "episodes": {1: version_text(versions[-1])},
+            "episode_history": {1: versions}, "history_archive": {"chat_history": refs}}
+    path = str(tmp_path / "p.zip")
+    archive.write_archive(data, path)
+
+    store.use_store(str(tmp_path / "other_store"))
+    store.get_blob.cache_clear()
+    got = archive.read_archive(path)
+    assert [version_text(v) for v in got["episode_history"][1]] == texts
+    assert any(v["delta"] for v in got["episode_history"][1])
+    assert [m["content"] for m in load_offloaded(got["history_archive"]["chat_history"])] == ["早期消息0", "早期消息1"]
+
+def test_cli_import_replaces_the_whole_project(blob_store, tmp_path):
+    src = Project(str(tmp_path / "a.json"))
+    src.add_chapter("第一章", "秦洛抱着许多多。")
+    store_analysis(src.data, "## 1. 一句话故事核心\n哥哥护着妹妹。\n\n## 2. 角色驱动卡\n### 秦洛\n嘴硬心软。")
+    archive.write_archive(src.data, str(tmp_path / "a.zip"))
+
+    dst = Project(str(tmp_path / "b.json"))
+    store_analysis(dst.data, "## 1. 一句话故事核心\n另一本书。")
+    dst["batch_runs"].append({"id": "旧批次"})
+    dst.save()
+    assert cli.main(["import", str(tmp_path / "a.zip"), "--project", str(tmp_path / "b.json"), "--force"]) == 0
+    got = Project(str(tmp_path / "b.json"))
+    assert got["analysis_sections"] == src["analysis_sections"]
+    assert got["batch_runs"] == []
@@ -0,0 +1,15 @@
+from fenjin.auth import check_token, header_user, parse_user_tokens
+
+def test_parse_user_tokens_skips_bad_entries():
+    assert parse_user_tokens(" alice:t1, bob : t2 ,broken,:x,carol:") == {"alice": "t1", "bob": "t2"}
+
+def test_check_token():
+    tokens = {"alice": "s3cret"}
+    assert check_token(tokens, "alice", "s3cret")
+    assert not check_token(tokens, "alice", "wrong")
+    assert not check_token(tokens, "mallory", "s3cret")
+    assert not check_token(tokens, "alice", "")
+
+def test_header_user():
+    assert header_user({"X-Forwarded-User": " alice "}, "X-Forwarded-User") == "alice"
+    assert header_user(None, "X-Forwarded-User") == ""
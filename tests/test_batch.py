@@ -0,0 +1,50 @@
+import json
+import threading
+import time
+
+from fenjin import batch
+from fenjin.batch import batch_request, read_batch_output, run_local_batch, write_batch_file
+from fenjin.scheduler import RequestScheduler
+
+class FakeResponse:
+    status_code, ok, text = 200, True, ""
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return {"choices": [{"message": {"content": self.content}}]}
+
+def test_local_batch_goes_through_the_scheduler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sched = RequestScheduler(user_concurrency=1)
+    monkeypatch.setattr(batch, "SCHEDULER", sched)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def post(url, headers, json, timeout):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return FakeResponse("第" + json["messages"][-1]["content"])
+
+    monkeypatch.setattr(batch.requests, "post", post)
+    reqs = [batch_request(f"ep-{i}", "m", "系统", [{"role": "user", "content": f"{i}集"}]) for i in range(6)]
+    path = write_batch_file(reqs, "t")
+    res = run_local_batch({"api_base": "http://x", "api_key": "k", "user": "alice"}, path, str(tmp_path / "out.jsonl"), 4)
+    assert res == {"completed": 6, "failed": 0, "total": 6}
+    assert peak[0] == 1
+    assert sched.metrics()["users"]["alice"]["tokens"] > 0
+    assert [t for _, t, _ in read_batch_output(str(tmp_path / "out.jsonl"))][:2] == ["第0集", "第1集"]
+
+def test_local_batch_respects_the_token_quota(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(batch, "SCHEDULER", RequestScheduler(user_tokens=1))
+    monkeypatch.setattr(batch.requests, "post", lambda *a, **k: FakeResponse("不该发出"))
+    path = write_batch_file([batch_request("ep-1", "m", "系统提示", [{"role": "user", "content": "很长的请求"}])], "q")
+    res = run_local_batch({"api_base": "http://x", "api_key": "k", "user": "bob"}, path, str(tmp_path / "out.jsonl"))
+    assert res["failed"] == 1
+    with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+        assert "QuotaExceeded" in json.loads(f.readline())["error"]["message"]
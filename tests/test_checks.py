@@ -0,0 +1,35 @@
+from fenjin.checks import format_fix_shots, score_script, validate_script
+
+GOOD = """【分镜1】（实算3s）
+场景：车厢内 · 夜
+秦洛（压低声音，眼神警惕）："别出声。"（音效：铁轨轰鸣）
+
+【分镜2】（实算4s）
+许多多（歪头，抱紧布偶）："哥哥？"
+"""
+
+BAD = """【分镜1】（实算3s）
+秦洛："别出声。"
+音效：铁轨轰鸣
+
+【分镜3】
+画面：站台空无一人
+"""
+
+def test_clean_script_has_no_issues():
+    assert validate_script(GOOD) == []
+
+def test_each_rule_is_reported_on_its_shot():
+    issues = validate_script(BAD)
+    assert sorted((i["rule"], i["shot"]) for i in issues) == [
+        ("bare", 1), ("duration", 3), ("numbering", 3), ("sound", 1), ("split", 3)]
+    bare = next(i for i in issues if i["rule"] == "bare")
+    assert bare["line"] == '秦洛："别出声。"'
+
+def test_numbering_alone_needs_no_fix():
+    issues = [{"rule": "numbering", "shot": 3}, {"rule": "duration", "shot": 2}, {"rule": "bare", "shot": 2}]
+    assert format_fix_shots(issues) == [2]
+
+def test_score_prefers_well_formed_scripts():
+    assert score_script(GOOD)["score"] > score_script(BAD)["score"]
+    assert score_script("")["score"] == 0
@@ -0,0 +1,27 @@
+from fenjin import deps
+from fenjin.deps import find_stale, record_episode
+
+SCRIPT = "【分镜1】实算 3s\n场景：车厢内 · 夜\n秦洛握着手电，低声：（\"别出声。\"）\n"
+
+def make_data(n=3):
+    data = {"chapter_order": [], "chapters": {}, "global_analysis": "提炼", "opening_designs": "",
+            "selected_opening": "", "episodes": {e: f"{SCRIPT}第{e}集" for e in range(1, n + 1)},
+            "review_results": {}, "build_inputs": {}}
+    for e in range(1, n + 1):
+        record_episode(data, e, None, "", e > 1, "m")
+    return data
+
+def test_unchanged_episodes_are_not_reparsed(monkeypatch):
+    data = make_data()
+    find_stale(data)
+    calls = []
+    monkeypatch.setattr(deps, "build_ending_context", lambda *a: calls.append(a) or "")
+    assert find_stale(data) == {}
+    assert calls == []
+
+def test_edited_episode_marks_next_stale():
+    data = make_data()
+    data["episodes"][2] = SCRIPT.replace("别出声", "快跑")
+    stale = find_stale(data)
+    assert list(stale) == ["episode:3"]
+    assert stale["episode:3"] == ["第2集结尾已变化"]
@@ -0,0 +1,23 @@
+from fenjin import store
+from fenjin.diagnostics import load_offloaded, offload_history
+
+def test_offload_and_load_back(blob_store):
+    history = [{"role": "user", "content": f"消息{i}"} for i in range(5)]
+    kept, refs = offload_history(history, 2, head=1)
+    assert [m["content"] for m in kept] == ["消息0", "消息3", "消息4"]
+    assert [m["content"] for m in load_offloaded(refs)] == ["消息1", "消息2"]
+
+def test_unreadable_blobs_become_placeholders(blob_store, monkeypatch):
+    _, refs = offload_history([{"role": "user", "content": "损坏"}, {"role": "user", "content": "zstd"},
+                               {"role": "user", "content": "最近"}], 1)
+    store.get_blob.cache_clear()
+    with open(store._blob_path(refs[0]["hash"]), "wb") as f:
+        f.write(b"Lnot-zlib")
+    with open(store._blob_path(refs[1]["hash"]), "wb") as f:
+        f.write(b"Zwhatever")
+    monkeypatch.setattr(store, "zstandard", None)
+    refs.append({"role": "user", "hash": "0" * 40, "length": 1})
+    out = [m["content"] for m in load_offloaded(refs)]
+    assert out[0].startswith("（转存内容无法读取") and "error" in out[0]
+    assert "RuntimeError" in out[1]
+    assert out[2].startswith("（转存内容缺失")
@@ -0,0 +1,24 @@
+from fenjin.history import KEYFRAME_EVERY, record_version, version_text
+from fenjin.store import delta_depth
+
+def _script(i):
+    return "".join(f"【分镜{n}】画面{n}\n" for n in range(60)) + f"结尾改动{i}\n"
+
+def test_delta_chain_bounded_with_rollbacks(blob_store):
+    versions = []
+    record_version(versions, _script(0), "初始")
+    for i in range(1, 61):
+        record_version(versions, _script(2 * i), "编辑")
+        record_version(versions, _script(2 * i + 1), "编辑")
+        # 回滚到上一个（差分存储的）版本，之后的编辑以它为基准
+        back = version_text(versions[-2])
+        entry = record_version(versions, back, "回滚")
+        assert entry["delta"] == (delta_depth(entry["hash"]) > 0)
+    assert max(delta_depth(v["hash"]) for v in versions) <= KEYFRAME_EVERY
+    assert version_text(versions[-1]) == back
+
+def test_identical_text_not_recorded(blob_store):
+    versions = []
+    record_version(versions, _script(0), "初始")
+    assert record_version(versions, _script(0), "编辑") is None
+    assert len(versions) == 1
@@ -0,0 +1,31 @@
+from fenjin.openings import parse_openings, render_openings, resolve_opening, store_opening_text
+
+ONE_CALL = """以下是6条方案：
+
+### 方案一：悬念倒叙
+1. 开场类型标签：悬念
+2. 前30秒：车厢灯闪
+**方案二：冲突切入**
+- 画面
+方案3｜视觉奇观
+内容3
+"""
+
+def test_parse_headings_not_inner_lists():
+    items = parse_openings(ONE_CALL)
+    assert [(it["n"], it["label"]) for it in items] == [(1, "悬念倒叙"), (2, "冲突切入"), (3, "视觉奇观")]
+    assert items[0]["text"].startswith("1. 开场类型标签")
+
+def test_rendered_openings_parse_back():
+    items = parse_openings(ONE_CALL)
+    assert parse_openings(render_openings(items)) == items
+
+def test_unparseable_text_kept_raw():
+    data = {}
+    assert store_opening_text(data, "随便写写") == "随便写写"
+    assert data["opening_items"] == []
+
+def test_resolve_number_to_full_design():
+    items = parse_openings(ONE_CALL)
+    assert resolve_opening(items, " 3 ") == "方案3｜视觉奇观\n内容3"
+    assert resolve_opening(items, "自己写的开场") == "自己写的开场"
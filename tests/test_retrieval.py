@@ -0,0 +1,42 @@
+from fenjin.retrieval import PassageIndex, project_sources, tokenize
+
+DATA = {"global_analysis": "秦洛是退伍军人，沉默寡言。\n\n许多多是秦洛收养的小女孩，怕黑。",
+        "analysis_sections": {}, "opening_designs": "",
+        "episodes": {1: "【分镜1】（实算3s）\n场景：车厢内 · 夜\n秦洛握着手电，铁轨轰鸣。",
+                     2: "【分镜1】（实算3s）\n场景：站台 · 清晨\n雾气很重，远处有人影。"},
+        "review_results": {}}
+
+def make_index():
+    index = PassageIndex()
+    index.sync(project_sources(DATA))
+    return index
+
+def test_tokenize_uses_chinese_bigrams():
+    assert tokenize("秦洛 Hi 2 多") == ["秦洛", "hi", "2", "多"]
+    assert tokenize("小女孩") == ["小女", "女孩"]
+
+def test_most_relevant_passage_ranks_first():
+    hits = make_index().search("怕黑的小女孩")
+    assert hits[0][1]["kind"] == "analysis"
+    assert "许多多" in hits[0][1]["text"]
+    assert [s for s, _ in hits] == sorted((s for s, _ in hits), reverse=True)
+
+def test_named_episode_is_boosted_without_term_hits():
+    hits = make_index().search("第2集怎么样")
+    assert hits[0][1]["ep"] == 2
+    assert all(p["ep"] == 2 for _, p in hits)
+
+def test_sync_only_reports_real_changes():
+    index = make_index()
+    assert not index.sync(project_sources(DATA))
+    edited = dict(DATA, episodes={1: DATA["episodes"][1]})
+    assert index.sync(project_sources(edited))
+    assert not any(p["ep"] == 2 for _, p in index.search("站台 雾气"))
+
+def test_context_stays_within_budget_in_source_order():
+    index = make_index()
+    assert index.context("秦洛", 0) == []
+    picked = index.context("秦洛 铁轨", 1000)
+    ids = [p["id"] for p in picked]
+    assert ids == [p["id"] for p in index._docs if p["id"] in ids]
+    assert any(p["ep"] == 1 for p in picked)
@@ -0,0 +1,31 @@
+from fenjin.review import failing_shots, merge_review, parse_review
+
+REPORT = """【分镜1】时长：约1分30秒，节奏偏慢……评分：8/10
+问题：无
+
+【分镜2】评分：5/10
+问题：台词重复
+
+【分镜3】整体 6.5 / 10，动作交代不清
+
+【分镜4】持续3分钟的长镜头，未给评分
+
+整集汇总：7/10
+"""
+
+def test_scores_prefer_labels_and_ignore_durations():
+    r = parse_review(REPORT)
+    assert r[1]["score"] == 8.0
+    assert r[2]["score"] == 5.0
+    assert r[3]["score"] == 6.5
+    assert r[4]["score"] is None
+    assert "整集汇总" not in r[4]["text"]
+
+def test_failing_shots():
+    assert list(failing_shots(REPORT)) == [2, 3]
+
+def test_merge_replaces_section():
+    out = merge_review(REPORT, "【分镜2】评分：9/10\n已解决", [2])
+    assert parse_review(out)[2]["score"] == 9.0
+    assert "台词重复" not in out
+    assert parse_review(out)[1]["score"] == 8.0
@@ -0,0 +1,58 @@
+import pytest
+
+from fenjin.runs import (RUN_HISTORY, add_run, finish_run, mark_done, mark_failed, new_run, pending,
+                         retry_delay, run_summary, with_retries)
+
+def test_pending_skips_completed_and_keeps_failed():
+    run = new_run([1, 2, 3, 4], ["第一章"], "m")
+    mark_done(run, 1, 12.34)
+    mark_failed(run, 2, "超时", 3)
+    assert pending(run) == [2, 3, 4]
+    mark_done(run, 2, 8, attempts=2)
+    assert pending(run) == [3, 4]
+    assert run["failed"] == {}
+    assert run["timing"]["1"] == {"secs": 12.3, "attempts": 1}
+
+def test_finish_run_is_partial_until_everything_is_done():
+    run = new_run([1, 2])
+    mark_done(run, 1, 5)
+    finish_run(run)
+    assert run["status"] == "partial"
+    mark_done(run, 2, 7)
+    finish_run(run)
+    assert run["status"] == "done"
+    assert run_summary(run) == {"total": 2, "done": 2, "failed": 0, "left": 0, "secs": 12, "avg": 6.0}
+
+def test_add_run_keeps_recent_history():
+    runs = []
+    for i in range(RUN_HISTORY + 3):
+        add_run(runs, new_run([i]))
+    assert len(runs) == RUN_HISTORY
+    assert runs[-1]["episodes"] == [RUN_HISTORY + 2]
+
+def test_with_retries_backs_off_then_succeeds():
+    calls, waits, notes = [], [], []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("断开")
+        return "剧本"
+
+    result = with_retries(flaky, on_retry=lambda w, n, e: notes.append((w, n, str(e))), sleep=waits.append)
+    assert result == ("剧本", 3)
+    assert waits == [5, 10]
+    assert notes == [(5, 1, "断开"), (10, 2, "断开")]
+
+def test_with_retries_raises_the_last_error():
+    waits = []
+
+    def broken():
+        raise ValueError(f"第{len(waits) + 1}次")
+
+    with pytest.raises(ValueError, match="第3次"):
+        with_retries(broken, retries=3, sleep=waits.append)
+    assert waits == [5, 10]
+
+def test_retry_delay_is_capped():
+    assert [retry_delay(n) for n in range(1, 6)] == [5, 10, 20, 40, 60]
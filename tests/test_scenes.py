@@ -0,0 +1,33 @@
+from fenjin.scenes import build_ending_context, estimate_tokens, parse_scenes, splice_scenes
+
+SCRIPT = """【分镜1】实算 3s
+场景：车厢内 · 夜
+秦洛握着手电，低声：（"别出声。"）
+
+【分镜2】实算 4s
+场景：站台 · 夜
+许多多抱着布偶，歪头：（"哥哥？"）
+"""
+
+def test_parse_scenes_fields():
+    scenes = parse_scenes(SCRIPT)
+    assert [s["num"] for s in scenes] == [1, 2]
+    assert scenes[0]["duration"] == 3.0
+    assert scenes[0]["place"] == "车厢内"
+    assert scenes[1]["location"] == "站台 · 夜"
+
+def test_splice_replaces_only_named_shots():
+    out = splice_scenes(SCRIPT, {2: "【分镜2】实算 5s\n场景：站台\n新的画面"})
+    assert "新的画面" in out
+    assert "别出声" in out
+    assert "哥哥" not in out
+
+def test_ending_context_keeps_last_shot_within_budget():
+    ctx = build_ending_context(SCRIPT, budget=30)
+    assert "哥哥" in ctx
+    assert ctx.startswith("【本集前段概要】分镜1-1")
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("中文四字") == 4
+    assert estimate_tokens("abcdefgh") == 2
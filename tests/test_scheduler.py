@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from fenjin.scheduler import QuotaExceeded, RequestScheduler
+
+def wait_for(cond, timeout=2.0):
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end
+        time.sleep(0.01)
+
+def start(sched, user, order):
+    def run():
+        with sched.slot({"user": user}):
+            order.append(user)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+def test_token_quota_rejects_once_used_up():
+    sched = RequestScheduler(user_tokens=100)
+    sched.release(sched.acquire({"user": "alice"}, 60), output_tokens=30)
+    with pytest.raises(QuotaExceeded):
+        sched.acquire({"user": "alice"}, 20)
+    sched.release(sched.acquire({"user": "bob"}, 20))
+    m = sched.metrics()
+    assert m["rejected"] == 1
+    assert m["users"]["alice"]["tokens"] == 90
+    assert m["users"]["bob"]["tokens"] == 20
+
+def test_usage_outside_the_window_no_longer_counts():
+    sched = RequestScheduler(user_tokens=100, window=0)
+    sched.release(sched.acquire({"user": "alice"}, 90))
+    time.sleep(0.01)
+    sched.release(sched.acquire({"user": "alice"}, 90))
+
+def test_per_user_limit_does_not_block_other_users():
+    sched = RequestScheduler(user_concurrency=1)
+    lease = sched.acquire({"user": "alice"})
+    order = []
+    alice = start(sched, "alice", order)
+    wait_for(lambda: sched.metrics()["queued"] == 1)
+    bob = start(sched, "bob", order)
+    bob.join(2)
+    assert order == ["bob"]
+    sched.release(lease)
+    alice.join(2)
+    assert order == ["bob", "alice"]
+    assert sched.metrics()["running"] == 0
+
+def test_waiting_requests_are_released_in_arrival_order():
+    sched = RequestScheduler(max_concurrency=1)
+    lease = sched.acquire({"user": "first"})
+    order, threads = [], []
+    for i, user in enumerate(["a", "b", "c", "d"]):
+        threads.append(start(sched, user, order))
+        wait_for(lambda: sched.metrics()["queued"] == i + 1)
+    sched.release(lease)
+    for t in threads:
+        t.join(2)
+    assert order == ["a", "b", "c", "d"]
+
+def test_release_is_idempotent():
+    sched = RequestScheduler(max_concurrency=1)
+    lease = sched.acquire({"user": "alice"}, 5)
+    sched.release(lease, 5)
+    sched.release(lease, 5)
+    m = sched.metrics()
+    assert m["running"] == 0
+    assert m["users"]["alice"]["tokens"] == 10
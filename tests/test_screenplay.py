@@ -0,0 +1,48 @@
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pytest
+
+from fenjin.screenplay import export_series
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# CT_PPrBase / CT_RPr 里本模块用到的子元素，按架构规定的顺序
+PPR_ORDER = ["keepNext", "spacing", "ind", "jc"]
+RPR_ORDER = ["b", "i", "sz"]
+
+SCRIPT = """【分镜1】实算 3s
+场景：车厢内 · 夜
+秦洛握着手电。
+秦洛（低声）：（"别出声。"）
+"""
+
+def _docx(tmp_path):
+    path = tmp_path / "out.docx"
+    export_series("docx", [(1, SCRIPT), (2, SCRIPT)], str(path), "测试剧本")
+    return path
+
+def _check_order(parent, order):
+    tags = [c.tag.replace(W, "") for c in parent]
+    assert all(t in order for t in tags), tags
+    assert tags == sorted(tags, key=order.index), tags
+
+def test_docx_properties_in_schema_order(tmp_path):
+    with zipfile.ZipFile(_docx(tmp_path)) as zf:
+        assert {"[Content_Types].xml", "_rels/.rels", "word/document.xml"} <= set(zf.namelist())
+        root = ET.fromstring(zf.read("word/document.xml"))
+    paras = root.iter(f"{W}p")
+    checked = 0
+    for p in paras:
+        for ppr in p.findall(f"{W}pPr"):
+            _check_order(ppr, PPR_ORDER)
+            checked += 1
+        for rpr in p.iter(f"{W}rPr"):
+            _check_order(rpr, RPR_ORDER)
+    assert checked > 4
+
+def test_docx_opens_with_python_docx(tmp_path):
+    docx = pytest.importorskip("docx")
+    doc = docx.Document(str(_docx(tmp_path)))
+    texts = [p.text for p in doc.paragraphs]
+    assert "测试剧本" in texts
+    assert any("别出声" in t for t in texts)
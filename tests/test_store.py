@@ -0,0 +1,57 @@
+import os
+
+from fenjin import store
+from fenjin.store import get_blob, load_project, put_blob, put_delta, save_project
+
+def test_blob_roundtrip_and_dedup(blob_store):
+    h = put_blob("秦洛抱着许多多。\n" * 20)
+    assert put_blob("秦洛抱着许多多。\n" * 20) == h
+    assert get_blob(h) == "秦洛抱着许多多。\n" * 20
+
+def test_delta_roundtrip(blob_store):
+    base = "".join(f"第{i}行台词\n" for i in range(200))
+    bh = put_blob(base)
+    text = base.replace("第50行台词", "第50行改过的台词")
+    h, is_delta = put_delta(text, base, bh)
+    assert is_delta
+    assert get_blob(h) == text
+
+def test_project_records_store_relative_to_project_file(tmp_path, monkeypatch):
+    old = store.store_dir()
+    try:
+        proj = tmp_path / "proj" / "x.json"
+        proj.parent.mkdir()
+        monkeypatch.chdir(tmp_path)
+        load_project(str(proj))
+        h = put_blob("章节正文")
+        save_project({"chapters": {"c1": {"hash": h, "length": 4}}}, str(proj))
+        assert os.path.isdir(tmp_path / "proj" / "chapter_store")
+
+        # 换一个工作目录打开同一个项目，仍然读得到章节
+        elsewhere = tmp_path / "elsewhere"
+        elsewhere.mkdir()
+        monkeypatch.chdir(elsewhere)
+        store.use_store("chapter_store")
+        store.get_blob.cache_clear()
+        data = load_project(str(proj))
+        assert data["store_dir"] == "chapter_store"
+        assert get_blob(data["chapters"]["c1"]["hash"]) == "章节正文"
+    finally:
+        store.use_store(old)
+        store.get_blob.cache_clear()
+
+def test_legacy_project_falls_back_to_working_directory_store(tmp_path, monkeypatch):
+    old = store.store_dir()
+    try:
+        monkeypatch.chdir(tmp_path)
+        store.use_store("chapter_store")
+        h = put_blob("旧章节")
+        proj = tmp_path / "other" / "old.json"
+        proj.parent.mkdir()
+        proj.write_text('{"chapters": {"c1": {"hash": "%s", "length": 3}}}' % h, encoding="utf-8")
+        store.get_blob.cache_clear()
+        load_project(str(proj))
+        assert get_blob(h) == "旧章节"
+    finally:
+        store.use_store(old)
+        store.get_blob.cache_clear()
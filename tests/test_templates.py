@@ -0,0 +1,52 @@
+import threading
+
+from fenjin.templates import apply_versions, load_overrides, register, rejected_overrides, render, set_active, template_id
+
+def test_render_and_escaped_braces():
+    register("t_basic", 1, "第{ep}集 {{字面}} {text}")
+    assert render("t_basic", ep=3, text="正文") == "第3集 {字面} 正文"
+
+def test_versions_and_thread_local_selection():
+    register("t_ab", 1, "A{x}")
+    register("t_ab", 2, "B{x}")
+    assert render("t_ab", x=1) == "A1"
+    set_active("t_ab", 2)
+    assert render("t_ab", x=1) == "B1"
+    assert template_id("t_ab").startswith("t_ab@2#")
+
+    seen = {}
+    def worker():
+        apply_versions({}, thread_local=True)
+        seen["other"] = render("t_ab", x=1)
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert seen["other"] == "A1"
+    assert render("t_ab", x=1) == "B1"
+    set_active("t_ab", 1)
+
+def test_format_specs_and_extra_values():
+    register("t_spec", 1, "第{ep:>3}集 {name!r}")
+    assert render("t_spec", ep=7, name="林默", unused="x") == "第  7集 '林默'"
+
+def test_overrides_limited_to_builtin_fields(tmp_path):
+    register("t_ov", 1, "{ep}|{text}")
+    (tmp_path / "t_ov@2.txt").write_text("只用{ep}", encoding="utf-8")
+    (tmp_path / "t_ov@3.txt").write_text("{ep}{extra}", encoding="utf-8")
+    (tmp_path / "t_ov@4.txt").write_text("坏{", encoding="utf-8")
+    loaded = load_overrides(str(tmp_path))
+    assert [i.split("#")[0] for i in loaded] == ["t_ov@2"]
+    assert set(rejected_overrides()) >= {"t_ov@3.txt", "t_ov@4.txt"}
+    set_active("t_ov", 2)
+    assert render("t_ov", ep=5, text="正文") == "只用5"
+    set_active("t_ov", 1)
+
+def test_format_fix_and_judge_prompts_are_registered():
+    from fenjin.checks import validate_script
+    from fenjin.prompts import build_format_fix_prompt, build_judge_prompt, prompt_id
+    script = "【分镜1】（实算3s）\n画面：天黑\n\n【分镜2】（实算2s）\n许多多抱着布偶。"
+    assert "画面：天黑" in build_format_fix_prompt(2, script, validate_script(script))
+    judge = build_judge_prompt(2, [{"text": "甲", "score": {"score": 80}}, {"text": "乙", "score": {"score": 70}}])
+    assert "2个候选" in judge and '{"best"' in judge
+    assert prompt_id("format_fix").startswith("format_fix@1#")
+    assert prompt_id("judge").startswith("judge@1#")